@@ -0,0 +1,62 @@
+"""Benchmarks the construction cost of `FilterDataBasedOnTime` for large lists
+of time patterns, with cold and warm pattern parsing caches.
+
+Usage:
+    python experiments/pattern_parsing_benchmark.py
+"""
+import itertools
+import time
+
+from mix_n_match.main import FilterDataBasedOnTime, _split_time_pattern
+from mix_n_match.utils import decompose_duration
+
+OPERATORS = ["<", "<=", ">", ">=", "==", "!="]
+DURATIONS = ["1wd", "2d", "6h", "1h30m", "15m", "45s", "3d12h"]
+
+
+def generate_time_patterns(n_patterns: int) -> list[str]:
+    """Generates distinct time patterns made of three conditions each.
+
+    :param n_patterns: number of patterns to generate
+    :return: time patterns
+    """
+    conditions = [
+        f"{operator}{duration}"
+        for operator, duration in itertools.product(OPERATORS, DURATIONS)
+    ]
+    patterns = (
+        "".join(combination)
+        for combination in itertools.permutations(conditions, 3)
+    )
+    return list(itertools.islice(patterns, n_patterns))
+
+
+def time_construction(
+    time_patterns: list[str], n_filters: int, clear_cache: bool
+) -> float:
+    """Times building filters from a list of time patterns.
+
+    :param time_patterns: time patterns of each filter
+    :param n_filters: number of filters to build
+    :param clear_cache: if True, clears the parsing caches before building
+        each filter
+    :return: mean construction time in seconds
+    """
+    start = time.perf_counter()
+    for _ in range(n_filters):
+        if clear_cache:
+            _split_time_pattern.cache_clear()
+            decompose_duration.cache_clear()
+        FilterDataBasedOnTime(time_column="date", time_patterns=time_patterns)
+
+    return (time.perf_counter() - start) / n_filters
+
+
+if __name__ == "__main__":
+    n_filters = 20
+    print(f"{'patterns':>10} {'cold (ms)':>12} {'warm (ms)':>12}")
+    for n_patterns in [10, 100, 1_000, 10_000]:
+        time_patterns = generate_time_patterns(n_patterns)
+        cold = time_construction(time_patterns, n_filters, clear_cache=True)
+        warm = time_construction(time_patterns, n_filters, clear_cache=False)
+        print(f"{n_patterns:>10} {cold * 1e3:>12.3f} {warm * 1e3:>12.3f}")
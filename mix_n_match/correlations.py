@@ -1,23 +1,143 @@
 import itertools
 import logging
 from functools import partial
-from typing import Dict, Iterable, List, Optional, Union
-
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
 import polars as pl
 import polars.selectors as cs
 
-from mix_n_match.utils import PolarsDuration
+from mix_n_match.utils import PolarsDuration, PrefixSumWindows
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# -- the exact variogram uses a dense grid if it has at most this many cells
+# per point
+MAX_EXACT_GRID_DENSITY = 4
+
+
+PAIRING_METHODS = {"full", "lower", "upper"}
+
+
+def count_pairs(
+    number_of_items: int, method: str = "full", ignore_diagonal: bool = False
+) -> int:
+    """Counts the pairs `pair_data` generates for a number of items.
+
+    :param number_of_items: number of items to pair
+    :param method: how to pair the data, see `pair_data`. Defaults to `full`
+    :param ignore_diagonal: if `True`, ignores cases where the item is paired
+        with itself. Defaults to `False`
+    :raises ValueError: if the method is not valid
+    :return: number of pairs
+    """
+    if method not in PAIRING_METHODS:
+        raise ValueError(
+            (
+                f"No method `{method}`. Please choose one of: "
+                f"{sorted(PAIRING_METHODS)}"
+            )
+        )
+
+    if method == "full":
+        return number_of_items * (number_of_items - ignore_diagonal)
+
+    return number_of_items * (number_of_items + 1 - 2 * ignore_diagonal) // 2
+
+
+def _count_pairs_before_row(
+    row: int, number_of_items: int, method: str, ignore_diagonal: bool
+) -> int:
+    """Counts the pairs in the rows before `row`, in row-major order."""
+    if method == "full":
+        return row * (number_of_items - ignore_diagonal)
+    if method == "lower":
+        return row * (row + 1 - 2 * ignore_diagonal) // 2
+
+    return row * (number_of_items - ignore_diagonal) - row * (row - 1) // 2
+
+
+def _iterate_pair_indices(
+    number_of_items: int,
+    method: str,
+    ignore_diagonal: bool,
+    start: int,
+    stop: int,
+) -> Iterator[Tuple[int, int]]:
+    """Generates the indices of pairs `start` to `stop` in row-major order,
+    without going through the pairs before `start`.
+
+    :param number_of_items: number of items to pair
+    :param method: how to pair the data, see `pair_data`
+    :param ignore_diagonal: if `True`, ignores cases where the item is paired
+        with itself
+    :param start: number of the first pair
+    :param stop: number of the pair to stop at, excluded
+    :yield: indices of each pair
+    """
+    if start >= stop:
+        return
+
+    # -- binary search for the row containing the first pair
+    low, high = 0, number_of_items - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if (
+            _count_pairs_before_row(
+                middle, number_of_items, method, ignore_diagonal
+            )
+            <= start
+        ):
+            low = middle
+        else:
+            high = middle - 1
+
+    pair_number = start
+    position = start - _count_pairs_before_row(
+        low, number_of_items, method, ignore_diagonal
+    )
+    for i in range(low, number_of_items):
+        if method == "upper":
+            columns = range(i + ignore_diagonal, number_of_items)
+        elif method == "lower":
+            columns = range(0, i + 1 - ignore_diagonal)
+        elif ignore_diagonal:
+            columns = itertools.chain(range(i), range(i + 1, number_of_items))
+        else:
+            columns = range(number_of_items)
+
+        for j in itertools.islice(
+            columns, position, position + stop - pair_number
+        ):
+            yield i, j
+            pair_number += 1
+
+        if pair_number >= stop:
+            return
+        position = 0
+
 
 def pair_data(
     iterable: Iterable,
     method: str = "full",
     ignore_diagonal: bool = False,
+    start: int = 0,
+    stop: Optional[int] = None,
 ) -> Iterable:
-    """Function pairs items in an iterator.
+    """Function pairs items in an iterator. Items are materialised once, and
+    only the requested pairs are generated, in row-major order. Pairs are
+    numbered in that order, so that ranges of pairs can be split between
+    workers with `start` and `stop`, see `count_pairs`.
 
     :param iterable: iterator of items to pair together
     :param method: how to pair the data.
@@ -27,26 +147,25 @@ def pair_data(
         defaults to `full`
     :param ignore_diagonal: if `True`, ignores cases where the item is paired
         with itself. Defaults to `False`
+    :param start: number of the first pair to generate, defaults to 0
+    :param stop: number of the pair to stop at, excluded. Defaults to None,
+        all remaining pairs
+    :raises ValueError: if the method is not valid
     :yield: iterable in the form (indices, item1, item2)
 
     Example:
         items = iter([0, 1])
         list(pair_data(items, method="lower", ignore_diagonal=True))
-        >>> [((0, 0), 1, 0)]
+        >>> [((1, 0), 1, 0)]
     """
-    iterable_1, iterable_2 = itertools.tee(iterable, 2)
-    for i, item1 in enumerate(iterable_1):
-        iterable_2, next_iter = itertools.tee(iterable_2, 2)
-        for j, item2 in enumerate(iterable_2):
-            if ignore_diagonal and i == j:
-                continue
-            if method == "lower" and j > i:
-                continue
-            if method == "upper" and i > j:
-                continue
-            yield ((i, j), item1, item2)
+    items = iterable if isinstance(iterable, Sequence) else list(iterable)
+    number_of_pairs = count_pairs(len(items), method, ignore_diagonal)
+    start, stop, _ = slice(start, stop).indices(number_of_pairs)
 
-        iterable_2 = next_iter
+    for i, j in _iterate_pair_indices(
+        len(items), method, ignore_diagonal, start, stop
+    ):
+        yield ((i, j), items[i], items[j])
 
 
 def calculate_polars_correlation(
@@ -279,27 +398,232 @@ class FindCorrelations:
         }
 
 
+def _calculate_semivariances(
+    keys: np.ndarray,
+    values: np.ndarray,
+    window_offsets: List[Tuple[int, int]],
+    closed: str = "right",
+) -> np.ndarray:
+    """Calculates the Matheron semivariance of each column of values, pairing
+    each key `k` with the keys in the window `(k + lower, k + upper]` for
+    each `(lower, upper)` in `window_offsets`. Null values, given as NaN, are
+    excluded from the pairs of their column only.
+
+    :param keys: sorted keys, e.g. timestamps as integer nanoseconds
+    :param values: values of shape (number of keys, number of columns)
+    :param window_offsets: lower and upper offset of each window
+    :param closed: which bounds of the windows are included, see
+        `PrefixSumWindows.window_indices`. Defaults to `right`
+    :return: semivariances of shape (number of windows, number of columns),
+        NaN if a window contains no pairs
+    """
+    is_valid = (~np.isnan(values)).astype(float)
+    values = np.where(is_valid, values, 0)
+
+    # -- centring leaves differences unchanged, but keeps the prefix sums of
+    # squares from losing the precision of values with a large mean
+    number_of_valid = is_valid.sum(axis=0)
+    means = np.divide(
+        values.sum(axis=0),
+        number_of_valid,
+        out=np.zeros(values.shape[1]),
+        where=number_of_valid > 0,
+    )
+    values = np.where(is_valid, values - means, 0)
+    squared_values = values**2
+
+    # -- counts are shared between columns, unless a column has nulls
+    has_nulls = ~is_valid.all(axis=0)
+    number_of_columns = values.shape[1]
+    windows = PrefixSumWindows(
+        keys,
+        np.column_stack([values, squared_values, is_valid[:, has_nulls]]),
+    )
+
+    semivariances = []
+    for lower, upper in window_offsets:
+        count, sums = windows.window_sums(
+            keys + lower, keys + upper, closed=closed
+        )
+        _sum, _squared_sum, valid_counts = np.split(
+            sums, [number_of_columns, 2 * number_of_columns], axis=1
+        )
+
+        # -- sums over rows of x² N + valid Σx² - 2 x Σx, where N is the
+        # count of valid values in the window, as dot products
+        total_count = np.full(number_of_columns, count.sum(), dtype=float)
+        squared_term = count @ squared_values
+        if has_nulls.any():
+            total_count[has_nulls] = np.einsum(
+                "ij,ij->j", valid_counts, is_valid[:, has_nulls]
+            )
+            squared_term[has_nulls] = np.einsum(
+                "ij,ij->j", valid_counts, squared_values[:, has_nulls]
+            )
+        metric = (
+            squared_term
+            + np.einsum("ij,ij->j", _squared_sum, is_valid)
+            - 2 * np.einsum("ij,ij->j", values, _sum)
+        )
+        with np.errstate(invalid="ignore", divide="ignore"):
+            semivariances.append(
+                np.where(total_count > 0, 0.5 * metric / total_count, np.nan)
+            )
+
+    return np.array(semivariances).reshape(
+        len(window_offsets), number_of_columns
+    )
+
+
+def _calculate_exact_semivariances(
+    keys: np.ndarray, values: np.ndarray, lag_dists: list
+) -> np.ndarray:
+    """Calculates the Matheron semivariance of each column of values, pairing
+    each key `k` with the key `k + lag` for each lag. If the keys are unique
+    integers on a grid of the first lag, and that lag is integral, values
+    are placed on a dense grid so that the pairs of each lag are two offset
+    slices of it. Otherwise, pairs are found with `_calculate_semivariances`.
+
+    :param keys: sorted keys, e.g. timestamps as integer nanoseconds
+    :param values: values of shape (number of keys, number of columns), with
+        nulls given as NaN
+    :param lag_dists: lags, as multiples of the first lag
+    :return: semivariances of shape (number of lags, number of columns),
+        NaN if a lag has no pairs
+    """
+    step = lag_dists[0]
+    if (
+        np.issubdtype(keys.dtype, np.integer)
+        and len(keys)
+        and step > 0
+        and float(step).is_integer()
+    ):
+        positions, remainders = np.divmod(keys - keys[0], int(step))
+        positions = positions.astype(np.int64)
+        is_gridded = (
+            not remainders.any()
+            and np.all(np.diff(positions) > 0)
+            and positions[-1] < MAX_EXACT_GRID_DENSITY * len(keys)
+        )
+    else:
+        is_gridded = False
+
+    if not is_gridded:
+        return _calculate_semivariances(
+            keys,
+            values,
+            [(lag_dist, lag_dist) for lag_dist in lag_dists],
+            closed="both",
+        )
+
+    grid = np.full((positions[-1] + 1, values.shape[1]), np.nan)
+    grid[positions] = values
+
+    semivariances = []
+    for lag_dist in lag_dists:
+        shift = int(lag_dist // step)
+        squared_differences = (grid[shift:] - grid[:-shift]) ** 2
+        count = (~np.isnan(squared_differences)).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            semivariances.append(
+                0.5 * np.nansum(squared_differences, axis=0) / count
+            )
+
+    return np.array(semivariances).reshape(len(lag_dists), values.shape[1])
+
+
+def _get_variogram_lags(
+    lazy_df: pl.LazyFrame,
+    direction: str,
+    number_of_lags: int,
+    lag_size: Union[str, int, float],
+    delta: Union[str, int, float, None],
+) -> Tuple[list, pl.Expr, list, Union[int, float, None]]:
+    """Gets the lags of a variogram along a direction as numeric distances.
+    Temporal directions take polars durations and are converted to integer
+    nanoseconds, numeric directions take numbers.
+
+    :param lazy_df: input data LazyFrame
+    :param direction: column to calculate the variogram along
+    :param number_of_lags: number of lags
+    :param lag_size: distance/lag to use for determining windows
+    :param delta: tolerance to use for the windows, None if exact
+    :raises ValueError: if `lag_size` or `delta` do not match the type of
+        the direction
+    :raises NotImplementedError: if the direction is neither temporal nor
+        numeric, or the durations are calendar durations
+    :return: lag labels, expression of the direction as numeric keys,
+        numeric lag distances and numeric delta
+    """
+    if direction in lazy_df.select(cs.temporal()).columns:
+        pl_duration = PolarsDuration(lag_size)
+        if delta is not None:
+            delta = PolarsDuration(delta)
+        if pl_duration.months or (delta is not None and delta.months):
+            raise NotImplementedError(
+                "There is currently no support for calendar durations, "
+                "e.g. `1mo`"
+            )
+        lag_dists = [
+            pl_duration * lags for lags in range(1, number_of_lags + 1)
+        ]
+
+        return (
+            [str(lag_dist) for lag_dist in lag_dists],
+            pl.col(direction).dt.epoch("ns"),
+            [lag_dist.nanoseconds for lag_dist in lag_dists],
+            None if delta is None else delta.nanoseconds,
+        )
+
+    if direction in lazy_df.select(cs.numeric()).columns:
+        if isinstance(lag_size, str) or isinstance(delta, str):
+            raise ValueError(
+                f"Direction `{direction}` is numeric, so `lag_size` and "
+                "`delta` must be numbers"
+            )
+        lag_dists = [lag_size * lags for lags in range(1, number_of_lags + 1)]
+
+        return lag_dists, pl.col(direction), lag_dists, delta
+
+    raise NotImplementedError(
+        "There is currently only support for temporal and numeric columns"
+    )
+
+
 def calculate_variogram(
     lazy_df: pl.LazyFrame,
     cardinal_direction: Union[str, List[str]],
     number_of_lags: int,
-    lag_size: Union[str, int],
-    delta: Union[str, int],  # TODO add support for exact variogram
-    target_col: Optional[str] = None,
+    lag_size: Union[str, int, float],
+    delta: Union[str, int, float, None],
+    target_col: Optional[Union[str, List[str]]] = None,
     normalise: bool = True,
 ):
     """Function to calculate variogram for a given LazyFrame. This
-    implementation is based on the Matheron metric.
+    implementation is based on the Matheron metric. For each lag `L`, each
+    point is paired with all points at a distance in `(0, L + delta]`, or
+    at a distance of exactly `L` if `delta` is None. The
+    data is sorted once, and the sums over each window are read from prefix
+    sums with `PrefixSumWindows`, so that all lags are computed without
+    further queries.
 
     :param lazy_df: input data LazyFrame
     :param cardinal_direction: column or list of columns to calculate variogram
         for
     :param number_of_lags: number of lags
-    :param lag_size: distance/lag to use for determining windows
-    :param delta: tolerance to use for the windows
+    :param lag_size: distance/lag to use for determining windows. A polars
+        duration for temporal directions, a number for numeric directions
+    :param delta: tolerance to use for the windows, same type as
+        `lag_size`. If None, calculates the exact variogram, pairing points
+        at a distance of exactly each lag. This is much cheaper on regularly
+        sampled data. Note that floating point keys must match exactly
+    :param target_col: column or list of columns to calculate the variogram
+        of, defaults to all columns except `cardinal_direction`
     :param normalise: whether to normalise variogram value, defaults to True
     :return: LazyFrame containing the variogram calculation for each
-        cardinal direction as well as the lags as a column `lags`
+        cardinal direction as well as the lags as a column `lags`. With
+        multiple target columns, variogram columns are named
+        `{direction}_{target_col}`
     """
     if isinstance(cardinal_direction, str):
         cardinal_direction = [cardinal_direction]
@@ -317,82 +641,740 @@ def calculate_variogram(
             col for col in lazy_df.columns if col not in cardinal_direction
         ]
 
-    if len(target_col) > 1:
-        raise NotImplementedError(
-            "There is currently no support for multiple target columns"
+    variogram = {}
+    for direction in cardinal_direction:
+        lags, keys, lag_dists, delta_dist = _get_variogram_lags(
+            lazy_df, direction, number_of_lags, lag_size, delta
+        )
+        variogram["lags"] = lags
+
+        # -- collect the data once, sorted, with the direction as numbers
+        df, variances = pl.collect_all(
+            [
+                lazy_df.select(keys, pl.col(target_col).cast(pl.Float64))
+                .drop_nulls(direction)
+                .sort(direction),
+                lazy_df.select(pl.col(target_col).var()),
+            ]
         )
-    pl_duration = PolarsDuration(lag_size)
-    lag_dists = [pl_duration * lags for lags in range(1, number_of_lags + 1)]
+        keys = df.get_column(direction).to_numpy()
+        values = df.select(target_col).to_numpy()
+
+        # -- each row is paired with the rows in (t, t + lag + delta], or
+        # exactly at t + lag if there is no delta
+        if delta_dist is None:
+            gamma_values = _calculate_exact_semivariances(
+                keys, values, lag_dists
+            )
+        else:
+            gamma_values = _calculate_semivariances(
+                keys,
+                values,
+                [(0, lag_dist + delta_dist) for lag_dist in lag_dists],
+                closed="right",
+            )
+        if normalise:
+            gamma_values = gamma_values / variances.to_numpy()
+
+        if len(target_col) == 1:
+            variogram[direction] = gamma_values[:, 0]
+        else:
+            for index, col in enumerate(target_col):
+                variogram[f"{direction}_{col}"] = gamma_values[:, index]
+
+    lazy_variogram = pl.LazyFrame(variogram)
+
+    return lazy_variogram
+
+
+def calculate_spatial_variogram(
+    lazy_df: pl.LazyFrame,
+    coordinate_columns: List[str],
+    number_of_lags: int,
+    lag_size: float,
+    delta: float,
+    target_col: Optional[Union[str, List[str]]] = None,
+    normalise: bool = True,
+    max_pairs: Optional[int] = None,
+    random_state: Optional[int] = None,
+):
+    """Function to calculate an isotropic variogram over several coordinate
+    columns, using the Matheron metric and euclidean distances. As with
+    `calculate_variogram`, for each lag `L` points are paired with all
+    points at a distance in `(0, L + delta]`.
+
+    Points are binned into a grid with cells as wide as the largest lag
+    window, so that only neighbouring cells are paired. For each pair of
+    cells, the range of the coordinates of their points bounds the distances
+    between them. If both bounds fall in the same lag bin, the squared
+    differences of all pairs of points are summed from per cell aggregates.
+    Otherwise, the cells are split in half along each coordinate and their
+    children are paired, until pairs of cells are small enough to compare
+    point by point.
+
+    :param lazy_df: input data LazyFrame
+    :param coordinate_columns: numeric columns with the coordinates of each
+        point
+    :param number_of_lags: number of lags
+    :param lag_size: distance/lag to use for determining windows
+    :param delta: tolerance to use for the windows
+    :param target_col: column or list of columns to calculate the variogram
+        of, defaults to all columns except `coordinate_columns`
+    :param normalise: whether to normalise variogram value, defaults to True
+    :param max_pairs: if the number of candidate pairs in neighbouring cells
+        exceeds `max_pairs`, points are randomly sampled so that about
+        `max_pairs` candidate pairs remain. Defaults to None, no sampling
+    :param random_state: seed used for sampling, defaults to None
+    :return: LazyFrame containing the lags as a column `lags` and the
+        variogram as a column named after the coordinate columns joined by
+        `_`. With multiple target columns, variogram columns are named
+        `{coordinates}_{target_col}`
+    """
+    if isinstance(target_col, str):
+        target_col = [target_col]
+
+    if target_col is None:
+        target_col = [
+            col for col in lazy_df.columns if col not in coordinate_columns
+        ]
 
+    lag_dists = [lag_size * lags for lags in range(1, number_of_lags + 1)]
+    bin_edges = [lag_dist + delta for lag_dist in lag_dists]
+    cell_size = bin_edges[-1]
+
+    # -- positions of each point in units of the largest cells. Targets are
+    # centred, which leaves their differences unchanged but keeps the sums
+    # of squares of each cell from losing precision
+    df, variances = pl.collect_all(
+        [
+            lazy_df.select(
+                *coordinate_columns, pl.col(target_col).cast(pl.Float64)
+            )
+            .drop_nulls(coordinate_columns)
+            .with_columns(pl.col(target_col) - pl.col(target_col).mean())
+            .with_row_index("_index")
+            .with_columns(
+                ((pl.col(col) - pl.col(col).min()) / cell_size).alias(
+                    f"_position_{col}"
+                )
+                for col in coordinate_columns
+            ),
+            lazy_df.select(pl.col(target_col).var()),
+        ]
+    )
+    grid = _SpatialGrid(coordinate_columns, target_col, bin_edges, df)
+
+    # -- pair each cell with itself and half of its neighbours, so that
+    # each pair of points is only counted once
+    cell_offsets = [
+        offset
+        for offset in itertools.product(
+            [-1, 0, 1], repeat=len(coordinate_columns)
+        )
+        if offset >= (0,) * len(coordinate_columns)
+    ]
+    cells = grid.get_cells(level=0)
+    cell_pairs = grid.get_neighbouring_cell_pairs(cells, cell_offsets)
+
+    if max_pairs is not None:
+        number_of_pairs = grid.count_point_pairs(cell_pairs)
+        if number_of_pairs > max_pairs:
+            grid.points = df.sample(
+                fraction=(max_pairs / number_of_pairs) ** 0.5,
+                seed=random_state,
+            )
+            cells = grid.get_cells(level=0)
+            cell_pairs = grid.get_neighbouring_cell_pairs(cells, cell_offsets)
+
+    binned_sums = grid.sum_cell_pairs(cell_pairs)
+
+    # -- cumulative sums over the bins give the sums over (0, L + delta]
+    bins = binned_sums.get_column("_bin").to_numpy()
+    counts = np.zeros((number_of_lags, len(target_col)))
+    sums = np.zeros((number_of_lags, len(target_col)))
+    counts[bins] = binned_sums.select(
+        f"{col}_count" for col in target_col
+    ).to_numpy()
+    sums[bins] = binned_sums.select(
+        f"{col}_sum" for col in target_col
+    ).to_numpy()
+    counts = np.cumsum(counts, axis=0)
+    sums = np.cumsum(sums, axis=0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        gamma_values = np.where(counts > 0, 0.5 * sums / counts, np.nan)
+    if normalise:
+        gamma_values = gamma_values / variances.to_numpy()
+
+    name = "_".join(coordinate_columns)
     variogram = {"lags": lag_dists}
-    print(lazy_df.collect())
-    target_col_variances = {
-        col: lazy_df.select(pl.col(col).var()).collect().item()
-        for col in target_col
-    }
-    for direction in cardinal_direction:
-        temporal_columns = lazy_df.select(cs.temporal()).schema
-        if direction not in temporal_columns:
-            raise NotImplementedError(
-                "There is currently only support for temporal columns"
-            )
-
-        lazy_df = lazy_df.sort(direction)
-        gamma_values = []
-        for lag_dist in lag_dists:
-            # period = 2 * delta
-            # offset = lag_distance - delta
-
-            offset_direction = f"_{direction}"
-
-            lazy_df_offset = lazy_df.with_columns(
-                pl.col(direction)
-                .dt.offset_by(f"-{delta}")
-                .alias(offset_direction)
-            )
-
-            rolling_obj = lazy_df_offset.rolling(
-                offset_direction, offset="0i", period=f"{lag_dist}{delta}"
-            )  # TODO option for choosing closed="both"?
-            # TODO add exact calculation, e.g. 0 offset
-
-            _sum = f"_sum_{target_col}"
-            _squared_sum = f"_sum_squared_{target_col}"
-            _count = "_count"
-            expressions = [pl.col(offset_direction).count().alias(_count)]
-            for col in target_col:
-                expressions.extend(
-                    [
-                        pl.col(col).sum().alias(_sum),
-                        (pl.col(col) ** 2).sum().alias(_squared_sum),
-                    ]
+    if len(target_col) == 1:
+        variogram[name] = gamma_values[:, 0]
+    else:
+        for index, col in enumerate(target_col):
+            variogram[f"{name}_{col}"] = gamma_values[:, index]
+
+    return pl.LazyFrame(variogram)
+
+
+class _SpatialGrid:
+    """Hierarchical grid summing the squared differences of pairs of points
+    per lag bin, for `calculate_spatial_variogram`. Cells at level `l` are
+    the cells at level 0 split in half `l` times along each coordinate.
+
+    :param coordinate_columns: columns with the coordinates of each point
+    :param target_col: columns to sum the squared differences of
+    :param bin_edges: upper edge of each lag bin, the first bin starting at 0
+    :param points: points with their coordinates, targets, an `_index` and
+        their positions in units of level 0 cells as `_position_{coordinate}`
+    """
+
+    # -- pairs of cells with at most this many pairs of points are compared
+    # point by point, instead of being split further
+    MAX_POINT_PAIRS_TO_COMPARE = 64
+    # -- cells are split at most this many times, e.g. for duplicated points
+    MAX_LEVEL = 24
+    # -- pairs of points are compared in batches of about this many pairs
+    POINT_PAIRS_PER_BATCH = 2**20
+
+    def __init__(
+        self,
+        coordinate_columns: List[str],
+        target_col: List[str],
+        bin_edges: List[float],
+        points: pl.DataFrame,
+    ):
+        self.coordinate_columns = coordinate_columns
+        self.target_col = target_col
+        self.bin_edges = pl.Series(bin_edges, dtype=pl.Float64)
+        self.points = points
+        self.cell_columns = [f"_cell_{col}" for col in coordinate_columns]
+        self.right_cell_columns = [f"{col}_right" for col in self.cell_columns]
+
+    def get_points(self, level: int) -> pl.DataFrame:
+        """Gets the points with the cell containing them at a level."""
+        return self.points.select(
+            "_index",
+            *self.coordinate_columns,
+            *self.target_col,
+            *(
+                (pl.col(f"_position_{col}") * 2**level)
+                .floor()
+                .cast(pl.Int64)
+                .alias(cell)
+                for col, cell in zip(  # noqa: B905 zip(strict) added in py310 but want code to work with >=py38
+                    self.coordinate_columns, self.cell_columns
                 )
+            ),
+        )
 
-            agg_lazy_df = rolling_obj.agg(expressions).filter(
-                pl.col(_count) != 0
+    def get_cells(self, level: int) -> pl.DataFrame:
+        """Gets the number of points, the bounds of their coordinates and, for
+        each target column, the number of non null values, their sum and
+        their sum of squares in each cell at a level.
+        """
+        expressions = [pl.len().cast(pl.Int64).alias("_count")]
+        for col in self.coordinate_columns:
+            expressions.extend(
+                [
+                    pl.col(col).min().alias(f"_min_{col}"),
+                    pl.col(col).max().alias(f"_max_{col}"),
+                ]
+            )
+        for col in self.target_col:
+            expressions.extend(
+                [
+                    pl.col(col).count().cast(pl.Int64).alias(f"{col}_count"),
+                    pl.col(col).sum().alias(f"{col}_sum"),
+                    (pl.col(col) ** 2).sum().alias(f"{col}_squared_sum"),
+                ]
             )
 
-            agg_lazy_df = agg_lazy_df.join(lazy_df_offset, on=offset_direction)
+        return (
+            self.get_points(level)
+            .group_by(self.cell_columns, maintain_order=True)
+            .agg(expressions)
+        )
 
-            # TODO here need to extend support to multiple columns
-            metric = agg_lazy_df.select(
-                (
-                    (pl.col(target_col[0]) ** 2) * pl.col(_count)
-                    + pl.col(_squared_sum)
-                    - 2 * pl.col(target_col[0]) * pl.col(_sum)
-                ).sum()
-                / pl.col(_count).sum()
+    def get_neighbouring_cell_pairs(
+        self, cells: pl.DataFrame, cell_offsets: List[Tuple[int, ...]]
+    ) -> pl.DataFrame:
+        """Pairs each cell with the cells at each offset from it. A zero
+        offset pairs each cell with itself.
+
+        :param cells: cells, see `get_cells`
+        :param cell_offsets: offsets of the paired cells along each axis
+        :return: pairs of cells, with the cell columns of the second cell
+            suffixed by `_right`
+        """
+        keys = cells.select(self.cell_columns)
+        pairs = []
+        for offset in cell_offsets:
+            neighbours = keys.with_columns(
+                (pl.col(cell) + cell_offset).alias(f"{cell}_right")
+                for cell, cell_offset in zip(  # noqa: B905 zip(strict) added in py310 but want code to work with >=py38
+                    self.cell_columns, offset
+                )
+            )
+            pairs.append(
+                neighbours.join(
+                    keys,
+                    left_on=self.right_cell_columns,
+                    right_on=self.cell_columns,
+                ).select(*self.cell_columns, *self.right_cell_columns)
             )
-            gamma = 0.5 * metric.collect().item()
-            if normalise:
-                gamma = gamma / target_col_variances[target_col[0]]
-            gamma_values.append(gamma)
 
-        variogram[direction] = gamma_values
+        return pl.concat(pairs)
 
-    lazy_variogram = pl.LazyFrame(variogram)
+    def count_point_pairs(self, cell_pairs: pl.DataFrame) -> int:
+        """Counts the pairs of distinct points in pairs of level 0 cells."""
+        return (
+            self._join_cells(cell_pairs, self.get_cells(level=0))
+            .select(self._get_number_of_point_pairs())
+            .to_series()
+            .sum()
+        )
 
-    return lazy_variogram
+    def sum_cell_pairs(self, cell_pairs: pl.DataFrame) -> pl.DataFrame:
+        """Sums, per lag bin, the squared differences of the pairs of points
+        in pairs of level 0 cells.
+
+        :param cell_pairs: pairs of cells, see `get_neighbouring_cell_pairs`
+        :return: dataframe with the `_bin` of each lag, and for each target
+            column the number of pairs `{col}_count` and the sum of squared
+            differences `{col}_sum`
+        """
+        number_of_bins = len(self.bin_edges)
+        binned_sums = []
+        for level in range(self.MAX_LEVEL + 1):
+            cell_pairs = self._join_cells(
+                cell_pairs, self.get_cells(level)
+            ).with_columns(self._get_bins_expressions())
+            cell_pairs = cell_pairs.filter(
+                pl.col("_lower_bin") < number_of_bins
+            )
+
+            # -- every pair of points of these cells is in the same bin
+            is_resolved = pl.col("_lower_bin") == pl.col("_upper_bin")
+            binned_sums.append(
+                self._sum_resolved_cell_pairs(cell_pairs.filter(is_resolved))
+            )
+
+            # -- otherwise, compare points or split the cells
+            cell_pairs = cell_pairs.filter(~is_resolved)
+            is_compared = (
+                self._get_number_of_point_pairs()
+                <= self.MAX_POINT_PAIRS_TO_COMPARE
+            )
+            if level == self.MAX_LEVEL:
+                is_compared = pl.lit(True)
+            binned_sums.extend(
+                self._sum_point_pairs(
+                    cell_pairs.filter(is_compared), self.get_points(level)
+                )
+            )
+            cell_pairs = self._split_cell_pairs(
+                cell_pairs.filter(~is_compared)
+            )
+            if cell_pairs.is_empty():
+                break
+
+        aggregations = [
+            pl.col(f"{col}{suffix}").sum()
+            for col in self.target_col
+            for suffix in ["_count", "_sum"]
+        ]
+        return (
+            pl.concat(binned_sums)
+            .group_by("_bin", maintain_order=True)
+            .agg(aggregations)
+        )
+
+    def _join_cells(
+        self, cell_pairs: pl.DataFrame, cells: pl.DataFrame
+    ) -> pl.DataFrame:
+        """Adds the aggregates of both cells of each pair, dropping pairs
+        with an empty cell.
+        """
+        return cell_pairs.join(cells, on=self.cell_columns).join(
+            cells,
+            left_on=self.right_cell_columns,
+            right_on=self.cell_columns,
+            suffix="_right",
+        )
+
+    def _is_same_cell(self) -> pl.Expr:
+        return pl.all_horizontal(
+            pl.col(cell) == pl.col(right_cell)
+            for cell, right_cell in zip(  # noqa: B905 zip(strict) added in py310 but want code to work with >=py38
+                self.cell_columns, self.right_cell_columns
+            )
+        )
+
+    def _get_number_of_point_pairs(self) -> pl.Expr:
+        return (
+            pl.when(self._is_same_cell())
+            .then(pl.col("_count") * (pl.col("_count") - 1) // 2)
+            .otherwise(pl.col("_count") * pl.col("_count_right"))
+        )
+
+    def _get_bins_expressions(self) -> List[pl.Expr]:
+        """Gets the bins of the smallest and largest distance between the
+        points of each pair of cells, from the bounds of their coordinates.
+        Points of different cells are at a distance between these, so if
+        both are in the same bin, so are all pairs of points. The bounds are
+        rounded like the distances of `_sum_point_pairs`, so this also holds
+        in floating point. Pairs of points in the same cell can be at any
+        distance from 0, so they are never in a single bin.
+        """
+        gaps = []
+        extents = []
+        for col in self.coordinate_columns:
+            lower, upper = pl.col(f"_min_{col}"), pl.col(f"_max_{col}")
+            right_lower = pl.col(f"_min_{col}_right")
+            right_upper = pl.col(f"_max_{col}_right")
+            gaps.append(
+                pl.max_horizontal(right_lower - upper, lower - right_upper, 0)
+                ** 2
+            )
+            extents.append(
+                pl.max_horizontal(right_upper - lower, upper - right_lower)
+                ** 2
+            )
+
+        smallest_distance = pl.sum_horizontal(gaps).sqrt()
+        largest_distance = pl.sum_horizontal(extents).sqrt()
+
+        return [
+            pl.lit(self.bin_edges)
+            .search_sorted(smallest_distance, side="left")
+            .alias("_lower_bin"),
+            pl.when(self._is_same_cell())
+            .then(-1)
+            .otherwise(
+                pl.lit(self.bin_edges).search_sorted(
+                    largest_distance, side="left"
+                )
+            )
+            .alias("_upper_bin"),
+        ]
+
+    def _sum_resolved_cell_pairs(
+        self, cell_pairs: pl.DataFrame
+    ) -> pl.DataFrame:
+        """Sums the squared differences of pairs of cells whose points are
+        all in the same bin, from the aggregates of each cell, using
+        sum((x - y)^2) = n_y sum(x^2) + n_x sum(y^2) - 2 sum(x) sum(y).
+        """
+        expressions = []
+        for col in self.target_col:
+            count, right_count = f"{col}_count", f"{col}_count_right"
+            _sum, right_sum = f"{col}_sum", f"{col}_sum_right"
+            squared_sum = f"{col}_squared_sum"
+            expressions.extend(
+                [
+                    (pl.col(count) * pl.col(right_count)).alias(count),
+                    (
+                        pl.col(right_count) * pl.col(squared_sum)
+                        + pl.col(count) * pl.col(f"{squared_sum}_right")
+                        - 2 * pl.col(_sum) * pl.col(right_sum)
+                    ).alias(_sum),
+                ]
+            )
+
+        return cell_pairs.select(
+            pl.col("_lower_bin").cast(pl.UInt32).alias("_bin"),
+            *expressions,
+        )
+
+    def _sum_point_pairs(
+        self, cell_pairs: pl.DataFrame, points: pl.DataFrame
+    ) -> List[pl.DataFrame]:
+        """Sums the squared differences of the pairs of points of pairs of
+        cells, per bin. Points in the same cell are only paired with later
+        points. Pairs of cells are compared in batches, to bound the number
+        of pairs of points held in memory.
+        """
+        batches = cell_pairs.select(
+            *self.cell_columns,
+            *self.right_cell_columns,
+            (
+                self._get_number_of_point_pairs().cum_sum()
+                // self.POINT_PAIRS_PER_BATCH
+            ).alias("_batch"),
+        ).partition_by("_batch", include_key=False)
+
+        distance = pl.sum_horizontal(
+            (pl.col(col) - pl.col(f"{col}_right")) ** 2
+            for col in self.coordinate_columns
+        ).sqrt()
+        squared_differences = [
+            (pl.col(col) - pl.col(f"{col}_right")) ** 2
+            for col in self.target_col
+        ]
+
+        aggregations = []
+        for col in self.target_col:
+            aggregations.extend(
+                [
+                    pl.col(col).count().cast(pl.Int64).alias(f"{col}_count"),
+                    pl.col(col).sum().alias(f"{col}_sum"),
+                ]
+            )
+
+        return [
+            batch.join(points, on=self.cell_columns)
+            .join(
+                points,
+                left_on=self.right_cell_columns,
+                right_on=self.cell_columns,
+                suffix="_right",
+            )
+            .filter(
+                ~self._is_same_cell()
+                | (pl.col("_index") < pl.col("_index_right"))
+            )
+            .select(distance.alias("_distance"), *squared_differences)
+            .filter(
+                (pl.col("_distance") > 0)
+                & (pl.col("_distance") <= self.bin_edges[-1])
+            )
+            .group_by(
+                pl.lit(self.bin_edges)
+                .search_sorted(pl.col("_distance"), side="left")
+                .alias("_bin"),
+                maintain_order=True,
+            )
+            .agg(aggregations)
+            for batch in batches
+        ]
+
+    def _split_cell_pairs(self, cell_pairs: pl.DataFrame) -> pl.DataFrame:
+        """Pairs the children of the cells of each pair at the next level.
+        Children of a cell paired with itself are only paired once.
+        """
+        children = pl.DataFrame(
+            list(
+                itertools.product(
+                    [0, 1], repeat=2 * len(self.coordinate_columns)
+                )
+            ),
+            schema=[
+                f"_child{col}"
+                for col in self.cell_columns + self.right_cell_columns
+            ],
+            orient="row",
+        )
+        child_pairs = (
+            cell_pairs.select(*self.cell_columns, *self.right_cell_columns)
+            .join(children, how="cross")
+            .select(
+                (2 * pl.col(col) + pl.col(f"_child{col}")).alias(col)
+                for col in self.cell_columns + self.right_cell_columns
+            )
+        )
+
+        # -- keep one of each pair of children of the same cell, by order
+        is_ordered = pl.lit(True)
+        for cell, right_cell in reversed(
+            list(
+                zip(  # noqa: B905 zip(strict) added in py310 but want code to work with >=py38
+                    self.cell_columns, self.right_cell_columns
+                )
+            )
+        ):
+            is_ordered = (pl.col(cell) < pl.col(right_cell)) | (
+                (pl.col(cell) == pl.col(right_cell)) & is_ordered
+            )
+        is_same_parent = pl.all_horizontal(
+            pl.col(cell) // 2 == pl.col(right_cell) // 2
+            for cell, right_cell in zip(  # noqa: B905 zip(strict) added in py310 but want code to work with >=py38
+                self.cell_columns, self.right_cell_columns
+            )
+        )
+
+        return child_pairs.filter(~is_same_parent | is_ordered)
+
+
+def _spherical_model(
+    lags: np.ndarray, effective_range: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    ratio = np.minimum(lags / effective_range, 1)
+    values = 1.5 * ratio - 0.5 * ratio**3
+    gradients = -1.5 * lags / effective_range**2 * (1 - ratio**2)
+
+    return values, gradients
+
+
+def _exponential_model(
+    lags: np.ndarray, effective_range: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    decay = np.exp(-3 * lags / effective_range)
+
+    return 1 - decay, -3 * lags / effective_range**2 * decay
+
+
+def _gaussian_model(
+    lags: np.ndarray, effective_range: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    decay = np.exp(-4 * lags**2 / effective_range**2)
+
+    return 1 - decay, -8 * lags**2 / effective_range**3 * decay
+
+
+# -- variogram models scaled to a unit sill with no nugget, parametrised by
+# their effective range as in scikit-gstat. Each callable returns the model
+# and its derivative with respect to the effective range
+VARIOGRAM_MODELS = {
+    "spherical": {"callable": _spherical_model},
+    "exponential": {"callable": _exponential_model},
+    "gaussian": {"callable": _gaussian_model},
+}
+
+
+def fit_variogram(
+    variogram: pl.LazyFrame | pl.DataFrame,
+    model: str = "spherical",
+    columns: Optional[Union[str, List[str]]] = None,
+    use_nugget: bool = False,
+    max_iterations: int = 100,
+    tolerance: float = 1e-10,
+) -> pl.DataFrame:
+    """Fits a variogram model to each variogram column by least squares. All
+    columns are fitted together with a batched Levenberg-Marquardt solver,
+    using the analytic derivatives of the model. The fitted model is
+    `nugget + sill * model(lags / range)`.
+
+    :param variogram: empirical variogram, as returned by
+        `calculate_variogram`, with the lags in a column `lags`. Lags given
+        as polars durations are converted to seconds
+    :param model: model to fit, one of `spherical`, `exponential` or
+        `gaussian`. Defaults to `spherical`
+    :param columns: variogram column or columns to fit, defaults to all
+        columns except `lags`
+    :param use_nugget: whether to fit a nugget, defaults to False
+    :param max_iterations: maximum number of iterations, defaults to 100
+    :param tolerance: fitting stops once the relative decrease of the sum of
+        squared residuals of each column is below `tolerance`. Defaults to
+        1e-10
+    :raises ValueError: if the model is not valid
+    :return: dataframe with one row per column, with the fitted `range`,
+        `sill` and `nugget`, the root mean squared error `rmse` and whether
+        the fit `converged`. Columns with no semivariances have null
+        parameters and did not converge
+    """
+    model_metadata = VARIOGRAM_MODELS.get(model)
+    if model_metadata is None:
+        raise ValueError(
+            (
+                f"No model `{model}`. Please choose one of: "
+                f"{sorted(VARIOGRAM_MODELS)}"
+            )
+        )
+    model_callable = model_metadata["callable"]
+
+    variogram = variogram.lazy().collect()
+    if isinstance(columns, str):
+        columns = [columns]
+    if columns is None:
+        columns = [col for col in variogram.columns if col != "lags"]
+
+    lags = variogram.get_column("lags")
+    if lags.dtype == pl.Utf8:
+        lags = [PolarsDuration(lag).nanoseconds / 10**9 for lag in lags]
+    lags = np.asarray(lags, dtype=float)
+
+    # -- lags with no pairs have null semivariances, and are ignored
+    gamma_values = (
+        variogram.select(pl.col(columns).cast(pl.Float64)).to_numpy().T.copy()
+    )
+    weights = (~np.isnan(gamma_values)).astype(float)
+    gamma_values = np.nan_to_num(gamma_values)
+
+    # -- parameters are the range, sill and nugget of each column
+    number_of_columns = len(columns)
+    parameters = np.zeros((number_of_columns, 3))
+    parameters[:, 0] = lags.max() / 2
+    parameters[:, 1] = np.maximum(gamma_values.max(axis=1), 1e-12)
+    number_of_parameters = 3 if use_nugget else 2
+
+    def get_residuals_and_jacobian(parameters):
+        values, gradients = model_callable(lags[None, :], parameters[:, [0]])
+        residuals = weights * (
+            parameters[:, [2]] + parameters[:, [1]] * values - gamma_values
+        )
+        jacobian = np.stack(
+            [parameters[:, [1]] * gradients, values, np.ones_like(values)],
+            axis=2,
+        )[:, :, :number_of_parameters]
+
+        return residuals, jacobian * weights[:, :, None]
+
+    residuals, jacobian = get_residuals_and_jacobian(parameters)
+    costs = (residuals**2).sum(axis=1)
+    damping = np.full(number_of_columns, 1e-3)
+    converged = np.zeros(number_of_columns, dtype=bool)
+    for _ in range(max_iterations):
+        if converged.all():
+            break
+
+        # -- solve the damped normal equations of every column at once
+        hessian = np.einsum("cli,clj->cij", jacobian, jacobian)
+        gradient = np.einsum("cli,cl->ci", jacobian, residuals)
+        diagonal = np.einsum("cii->ci", hessian)
+        damped_hessian = hessian + np.einsum(
+            "ci,ij->cij",
+            damping[:, None] * np.maximum(diagonal, 1e-12),
+            np.eye(number_of_parameters),
+        )
+        steps = np.linalg.solve(damped_hessian, -gradient[:, :, None])[:, :, 0]
+
+        # -- keep the range positive, and the sill and nugget non negative
+        candidates = parameters.copy()
+        candidates[:, :number_of_parameters] += steps
+        candidates[:, 0] = np.maximum(candidates[:, 0], 1e-12 * lags.max())
+        candidates[:, 1:] = np.maximum(candidates[:, 1:], 0)
+
+        candidate_residuals, candidate_jacobian = get_residuals_and_jacobian(
+            candidates
+        )
+        candidate_costs = (candidate_residuals**2).sum(axis=1)
+        improved = (candidate_costs < costs) & ~converged
+
+        converged |= improved & (
+            costs - candidate_costs <= tolerance * np.maximum(costs, 1e-300)
+        )
+        converged |= costs == 0
+        parameters[improved] = candidates[improved]
+        residuals[improved] = candidate_residuals[improved]
+        jacobian[improved] = candidate_jacobian[improved]
+        costs[improved] = candidate_costs[improved]
+        damping = np.where(improved, damping / 10, damping * 10)
+
+        # -- a column whose damping exploded can not improve any further
+        converged |= damping > 1e12
+
+    # -- columns without any semivariance can not be fitted
+    number_of_lags = weights.sum(axis=1)
+    is_empty = number_of_lags == 0
+    parameters[is_empty] = np.nan
+    converged[is_empty] = False
+
+    return pl.DataFrame(
+        {
+            "column": columns,
+            "model": [model] * number_of_columns,
+            "range": parameters[:, 0],
+            "sill": parameters[:, 1],
+            "nugget": parameters[:, 2],
+            "rmse": np.where(
+                is_empty,
+                np.nan,
+                np.sqrt(costs / np.maximum(number_of_lags, 1)),
+            ),
+            "converged": converged,
+        }
+    ).fill_nan(None)
 
 
 if __name__ == "__main__":
@@ -1,17 +1,36 @@
 # -- allow for multiple resampling types? what about case of rename?
 # -- I guess we won't allow rename perse, resampling function if string will
 # apply to all target cols that behave, unless specified otherwise
+import functools
+import itertools
 import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
 from enum import Enum
-from typing import Callable
+from typing import Callable, Iterable, Iterator
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
+import numpy as np
 import polars as pl
 from sklearn.base import BaseEstimator, TransformerMixin
 
 from mix_n_match.utils import (
-    PolarsDuration,
+    complement_intervals,
+    decompose_duration,
     detect_timeseries_frequency,
     generate_polars_condition,
+    get_utc_offset_transitions,
+    intersect_intervals,
+    is_in_intervals_expression,
+    iterate_in_chunks,
+    timeseries_frequency_expression,
+    union_intervals,
+    unique_timestamp_diff_expression,
 )
 
 logger = logging.getLogger(__file__)
@@ -62,6 +81,15 @@ SUPPORTED_RESAMPLING_OPERATIONS = {
     "collect": None,
 }
 
+# -- operations that can be computed from partial aggregates of a window
+SUPPORTED_INCREMENTAL_RESAMPLING_OPERATIONS = {
+    "sum",
+    "max",
+    "min",
+    "mean",
+    "count",
+}
+
 
 # TODO need to extend this to allow some default operations...
 # will need to modify code!
@@ -101,14 +129,48 @@ class FilterDataBasedOnTime(BaseEstimator, TransformerMixin):
         can specify * to the condition which triggers a cascade effect,
         e.g.  ['>1h*'] means: 'hour' > 1 OR
         ('hour' == 1 AND (any('minute', 'second', 'millisecond', etc... > 0))).
+        The cascade only applies to `>`, with other operators * has no
+        effect, e.g. ['<=1h*'] means 'hour' <= 1.
     :param keep: flag if set to True then the time patterns provided are data
-        to keep instead of remove
+        to keep instead of remove. When removing, the rules are negated
+        before being converted into expressions (e.g. `>` becomes `<=`), so
+        that the filter is a plain predicate either way
     :param label_data: flag if set to True then returns a column
         "_data_to_filter" with True if data to be filtered, false otherwise.
         No actual data filtering occurs
+    :param compile_intervals: flag if set to True then the time patterns
+        are compiled into a merged set of intervals over the week (or the
+        day if no weekdays are used), and each row is checked against them
+        with a single binary search instead of a tree of conditions. Only
+        supports the units "wd", "h", "m" and "s". Defaults to False
+    :param mask_cache_size: if provided, `transform` evaluates the rules
+        only on the unique timestamps of a dataframe and caches the result
+        for up to this many timestamps, evicting the least recently used.
+        Rows are then filtered by looking up their timestamp, which is
+        faster when many frames share the same timestamps (e.g. devices on
+        the same grid). Only applies to dataframes, not LazyFrames.
+        Defaults to None
+    :param time_zone: if provided, the patterns are evaluated in this time
+        zone (e.g. "Europe/Brussels"), with time zone naive data assumed to
+        be in UTC. Local time is computed from precomputed UTC offset
+        transitions (daylight saving time), which is cheaper than
+        converting the time column. Offsets are exact between 1970 and
+        2100. Defaults to None
+
+    When filtering a LazyFrame (e.g. from `pl.scan_parquet`), patterns that
+    pin the year (and possibly the month and day) also add a coarse range
+    predicate on the time column, so that row groups outside of it can be
+    skipped from their statistics.
+
+    The Polars expression built from the rules is cached on the instance,
+    and rebuilt only when `time_column`, `keep` or `filtering_rules` are
+    set (e.g. with `set_params`, including setting `time_patterns`). Rules
+    mutated in place are not detected, so reassign them instead.
     """
 
     UNIT_TO_POLARS_METHOD_MAPPING = {
+        "y": "year",
+        "mo": "month",
         "d": "day",
         "h": "hour",
         "m": "minute",
@@ -128,24 +190,155 @@ class FilterDataBasedOnTime(BaseEstimator, TransformerMixin):
         ">=": "ge",
     }
 
+    # -- units whose cascade conditions are lowered to a single comparison
+    # on nanoseconds, with the length of the unit and the period it repeats
+    # over. Days (of the month or week) are offset from the start of the
+    # month or week, the rest are taken from the time of day
+    LOWERED_CASCADE_UNITS = {
+        "d": {"length": 86_400 * 10**9, "period": None},
+        "wd": {"length": 86_400 * 10**9, "period": None},
+        "h": {"length": 3_600 * 10**9, "period": 86_400 * 10**9},
+        "m": {"length": 60 * 10**9, "period": 3_600 * 10**9},
+        "s": {"length": 10**9, "period": 60 * 10**9},
+    }
+
+    # -- operators negated, used to push the negation of rules into them
+    NEGATED_OPERATOR_MAPPING = {
+        "eq": "ne",
+        "ne": "eq",
+        "lt": "ge",
+        "ge": "lt",
+        "gt": "le",
+        "le": "gt",
+    }
+
+    # -- pseudo unit for the time of day in nanoseconds
+    TIME_OF_DAY_UNIT = "tod"
+
+    # -- units that can be compiled into intervals, with their first and
+    # last values, and their length and the period they repeat over in
+    # nanoseconds
+    INTERVAL_UNITS = {
+        "wd": {
+            "first": 1,
+            "last": 7,
+            "length": 86_400 * 10**9,
+            "period": 7 * 86_400 * 10**9,
+        },
+        "h": {
+            "first": 0,
+            "last": 23,
+            "length": 3_600 * 10**9,
+            "period": 86_400 * 10**9,
+        },
+        "m": {
+            "first": 0,
+            "last": 59,
+            "length": 60 * 10**9,
+            "period": 3_600 * 10**9,
+        },
+        "s": {
+            "first": 0,
+            "last": 59,
+            "length": 10**9,
+            "period": 60 * 10**9,
+        },
+    }
+
+    MAX_COMPILED_INTERVALS = 100_000
+
     def __init__(
         self,
         time_column: str,
         time_patterns: list[str],
         keep: bool = False,
         label_data: bool = False,
-    ):  # TODO add keep
+        compile_intervals: bool = False,
+        mask_cache_size: int | None = None,
+        time_zone: str | None = None,
+    ):
+        self._clear_cache()
+        self._mask_cache_calls = 0
+        self._cache_info = {
+            "hits": 0,
+            "misses": 0,
+            "build_time": 0.0,
+            "mask_hits": 0,
+            "mask_misses": 0,
+        }
+
         self.time_column = time_column
+        self.time_zone = time_zone
+        self.compile_intervals = compile_intervals
         self.keep = keep
-        if self.keep:
-            raise NotImplementedError(
-                "This needs to be implemented. Cascade operations need to be applied to <= etc..."  # noqa
-            )
+        self.time_patterns = time_patterns
+
+        self.label_data = label_data
+        self.mask_cache_size = mask_cache_size
+
+    @property
+    def time_column(self) -> str:
+        return self._time_column
+
+    @time_column.setter
+    def time_column(self, time_column: str) -> None:
+        self._time_column = time_column
+        self._clear_cache()
+
+    @property
+    def time_zone(self) -> str | None:
+        return self._time_zone
+
+    @time_zone.setter
+    def time_zone(self, time_zone: str | None) -> None:
+        if time_zone is not None:
+            try:
+                ZoneInfo(time_zone)
+            except (ZoneInfoNotFoundError, ValueError) as error:
+                msg = f"Unknown time zone `{time_zone}`"
+                logger.error(msg)
+                raise ValueError(msg) from error
+
+        self._time_zone = time_zone
+        self._clear_cache()
+
+    @property
+    def compile_intervals(self) -> bool:
+        return self._compile_intervals
+
+    @compile_intervals.setter
+    def compile_intervals(self, compile_intervals: bool) -> None:
+        self._compile_intervals = compile_intervals
+        self._clear_cache()
+
+    @property
+    def keep(self) -> bool:
+        return self._keep
+
+    @keep.setter
+    def keep(self, keep: bool) -> None:
+        self._keep = keep
+        self._clear_cache()
+
+    @property
+    def time_patterns(self) -> list[str]:
+        return self._time_patterns
+
+    @time_patterns.setter
+    def time_patterns(self, time_patterns: list[str]) -> None:
+        self._time_patterns = time_patterns
         self.filtering_rules = self._parse_time_patterns_into_rules(
             time_patterns
         )
 
-        self.label_data = label_data
+    @property
+    def filtering_rules(self) -> list:
+        return self._filtering_rules
+
+    @filtering_rules.setter
+    def filtering_rules(self, filtering_rules: list) -> None:
+        self._filtering_rules = filtering_rules
+        self._clear_cache()
 
     def fit(self, X: pl.DataFrame, y=None):
         pass
@@ -153,17 +346,414 @@ class FilterDataBasedOnTime(BaseEstimator, TransformerMixin):
     def transform(self, X: pl.DataFrame) -> pl.DataFrame:
         """Function to transform filter a polars dataframe.
 
+        Each time component used by the rules (e.g. the hour) is extracted
+        once into a temporary column, the rules are evaluated over these,
+        and the temporary columns are dropped.
+
         :param X: polars dataframe to filter
         :return: filtered polars dataframe
         """
-        rule_expression = self._convert_rules_to_polars_expressions()
+        if isinstance(X, pl.LazyFrame) and not self.label_data:
+            X = self._filter_time_range(X)
+
+        if self.mask_cache_size is not None and isinstance(X, pl.DataFrame):
+            component_columns = {}
+            rule_expression = self._get_mask_cache_expression(X)
+        else:
+            compiled = self._get_compiled_expressions()
+            component_columns = compiled["component_columns"]
+            rule_expression = compiled["component_expression"]
+            self._check_component_columns(X, component_columns.values())
+            X = X.with_columns(compiled["components"])
 
         if self.label_data:
             X = X.with_columns(rule_expression.alias("_data_to_filter"))
         else:
             X = X.filter(rule_expression)
 
-        return X
+        return X.drop(list(component_columns.values()))
+
+    @staticmethod
+    def combine(
+        filters: list["FilterDataBasedOnTime"],
+        names: list[str] | None = None,
+        pack_bits: bool = False,
+    ) -> "CombinedFilterDataBasedOnTime":
+        """Combines filters so that they label data in a single pass, see
+        `CombinedFilterDataBasedOnTime`.
+
+        :param filters: filters to combine
+        :param names: names of the label column of each filter, defaults to
+            `_data_to_filter_{index}`
+        :param pack_bits: if True, labels are packed into the bits of a
+            single integer column, defaults to False
+        :return: combined filter
+        """
+        return CombinedFilterDataBasedOnTime(
+            filters=filters, names=names, pack_bits=pack_bits
+        )
+
+    @staticmethod
+    def _check_component_columns(
+        X: pl.DataFrame | pl.LazyFrame, component_columns: Iterable[str]
+    ) -> None:
+        """Checks that the temporary time component columns do not already
+        exist in the data, since they would be overwritten and dropped.
+
+        :param X: data to filter
+        :param component_columns: names of the temporary columns
+        :raises ValueError: if any of the temporary columns already exists
+        """
+        existing_columns = set(X.columns).intersection(component_columns)
+        if existing_columns:
+            msg = (
+                f"Columns {sorted(existing_columns)} are reserved for "
+                "temporary time components, please rename them"
+            )
+            logger.error(msg)
+            raise ValueError(msg)
+
+    def get_expression(self) -> pl.Expr:
+        """Returns the Polars expression used for filtering, which is True
+        for the rows that are kept. The expression is built once and cached.
+        Unlike `transform`, it depends only on the time column, so it can be
+        used in any query.
+
+        :return: filtering expression
+        """
+        return self._get_compiled_expressions()["expression"]
+
+    def _get_compiled_expressions(self) -> dict:
+        """Returns the cached expressions built from the rules, building
+        them if the rules have changed.
+
+        :return: dictionary with the self contained `expression`, the
+            `components` expressions extracting each time component into a
+            temporary column, a mapping of unit to temporary column as
+            `component_columns`, and the `component_expression` evaluating
+            the rules over the temporary columns
+        """
+        if self._compiled is not None:
+            self._cache_info["hits"] += 1
+            return self._compiled
+
+        start_time = time.perf_counter()
+        mapping = {
+            **FilterDataBasedOnTime.UNIT_TO_POLARS_METHOD_MAPPING,
+            FilterDataBasedOnTime.TIME_OF_DAY_UNIT: "time_of_day",
+        }
+        # -- names identify the component, so that they can be shared
+        # between filters, see `combine`
+        suffix = "" if self.time_zone is None else f"_{self.time_zone}"
+        component_columns = {
+            unit: f"_{self.time_column}_{mapping[unit]}{suffix}"
+            for unit in self._get_required_units()
+        }
+        self._compiled = {
+            "expression": self._convert_rules_to_polars_expressions(),
+            "components": [
+                self._get_time_component(unit).alias(column)
+                for unit, column in component_columns.items()
+            ],
+            "component_columns": component_columns,
+            "component_expression": self._convert_rules_to_polars_expressions(
+                component_columns
+            ),
+            "time_range": self._get_time_range(),
+        }
+        self._cache_info["build_time"] += time.perf_counter() - start_time
+        self._cache_info["misses"] += 1
+
+        return self._compiled
+
+    def _get_required_units(self) -> list[str]:
+        """Gets the units of time the rules are evaluated on, including the
+        child units checked by cascade conditions, or the time of day for
+        cascade conditions that are lowered to a single comparison.
+
+        :return: units of time, in order of first use
+        """
+        if self.compile_intervals:
+            units = [FilterDataBasedOnTime.TIME_OF_DAY_UNIT]
+            if self._uses_weekdays():
+                units.insert(0, "wd")
+            return units
+
+        units = []
+        for rule_metadata in self.filtering_rules:
+            for condition in rule_metadata:
+                operator = condition["operator"]
+                for _, unit in condition["decomposed_duration"]:
+                    if self._get_condition_how(condition) == "simple":
+                        units.append(unit)
+                    elif self._can_lower_cascade_condition(unit, operator):
+                        if unit in {"d", "wd"}:
+                            units.append(unit)
+                        units.append(FilterDataBasedOnTime.TIME_OF_DAY_UNIT)
+                    else:
+                        units.append(unit)
+                        units.extend(
+                            child_unit
+                            for child_unit, _ in self._iterate_child_units(
+                                unit
+                            )
+                        )
+
+        return list(dict.fromkeys(units))
+
+    def cache_info(self) -> dict:
+        """Reports on the cache of the filtering expression, and on the
+        timestamp mask cache if `mask_cache_size` is set.
+
+        :return: dictionary with the number of cache `hits` and `misses`
+            (i.e. times the expression was built), the total `build_time`
+            in seconds spent building it, the number of timestamps found in
+            the mask cache as `mask_hits` and those evaluated as
+            `mask_misses`, and the number of timestamps in the mask cache as
+            `mask_cache_size`
+        """
+        mask_cache_size = 0
+        if self._mask_cache is not None:
+            mask_cache_size = self._mask_cache.height
+
+        return {**self._cache_info, "mask_cache_size": mask_cache_size}
+
+    def _filter_time_range(self, X: pl.LazyFrame) -> pl.LazyFrame:
+        """Filters a LazyFrame on the absolute time range the kept data falls
+        in, if the rules bound it, so the predicate can be pushed down to
+        the scan.
+
+        :param X: LazyFrame to filter
+        :return: filtered LazyFrame
+        """
+        time_range = self._get_compiled_expressions()["time_range"]
+        dtype = X.schema[self.time_column]
+        if time_range is None or not isinstance(dtype, pl.Datetime):
+            return X
+
+        start, end = time_range
+        if start is None and end is None:
+            return X
+
+        def _to_literal(value: datetime, widen_by: timedelta) -> pl.Expr:
+            if dtype.time_zone is None and self.time_zone is None:
+                return pl.lit(value).cast(pl.Datetime(dtype.time_unit))
+
+            # -- bounds are in local time, widened by a day since the UTC
+            # offset is always less than that
+            literal = pl.lit(value + widen_by).cast(
+                pl.Datetime(dtype.time_unit)
+            )
+            if dtype.time_zone is not None:
+                literal = literal.dt.replace_time_zone(
+                    "UTC"
+                ).dt.convert_time_zone(dtype.time_zone)
+
+            return literal
+
+        time_column = pl.col(self.time_column)
+        range_predicates = []
+        if start is not None:
+            range_predicates.append(
+                time_column >= _to_literal(start, timedelta(days=-1))
+            )
+        if end is not None:
+            range_predicates.append(
+                time_column < _to_literal(end, timedelta(days=1))
+            )
+
+        return X.filter(generate_polars_condition(range_predicates, "and_"))
+
+    def _get_time_range(self) -> tuple[datetime | None, datetime | None]:
+        """Derives a conservative range of absolute (local) time that the
+        kept data falls in, from conditions on the year, and on the month
+        and day when the year (and month) are pinned to a single value.
+
+        :return: inclusive start and exclusive end of the range, None if
+            unbounded. None if no data can be kept
+        """
+        if self.keep:
+            # -- data is kept if any rule matches, so the range is the hull
+            # of the ranges of each rule
+            rule_ranges = [
+                self._get_conditions_time_range(
+                    [
+                        (
+                            unit,
+                            value,
+                            condition["operator"],
+                            self._get_condition_how(condition),
+                        )
+                        for condition in rule_metadata
+                        for value, unit in condition["decomposed_duration"]
+                    ]
+                )
+                for rule_metadata in self.filtering_rules
+            ]
+            return _get_time_range_hull(rule_ranges)
+
+        # -- data is kept if no rule matches, i.e. if for each rule any of
+        # its negated conditions does
+        time_range = (None, None)
+        for rule_metadata in self.filtering_rules:
+            condition_ranges = [
+                self._get_conditions_time_range(
+                    [
+                        (
+                            unit,
+                            value,
+                            FilterDataBasedOnTime.NEGATED_OPERATOR_MAPPING[
+                                condition["operator"]
+                            ],
+                            self._get_condition_how(condition),
+                        )
+                    ]
+                )
+                for condition in rule_metadata
+                for value, unit in condition["decomposed_duration"]
+            ]
+            rule_range = _get_time_range_hull(condition_ranges)
+            time_range = _get_time_range_intersection(time_range, rule_range)
+
+        return time_range
+
+    def _get_conditions_time_range(
+        self, conditions: list[tuple[str, int, str, str]]
+    ) -> tuple[datetime | None, datetime | None] | None:
+        """Derives a conservative range of absolute time in which conditions
+        that are all applied together can hold.
+
+        :param conditions: unit, value, Polars operator and how (simple or
+            cascade) of each condition
+        :return: inclusive start and exclusive end of the range, None if
+            unbounded. None if the conditions can never hold
+        """
+        bounds = {"y": [1, 9999], "mo": [1, 12], "d": [1, 31]}
+        for unit, value, operator, how in conditions:
+            if unit not in bounds:
+                continue
+
+            # -- cascades only move the bound within the value
+            if how == "cascade" and operator == "gt":
+                operator = "ge"
+
+            lower, upper = {
+                "eq": (value, value),
+                "gt": (value + 1, None),
+                "ge": (value, None),
+                "lt": (None, value - 1),
+                "le": (None, value),
+                "ne": (None, None),
+            }[operator]
+            if lower is not None:
+                bounds[unit][0] = max(bounds[unit][0], lower)
+            if upper is not None:
+                bounds[unit][1] = min(bounds[unit][1], upper)
+
+        if any(lower > upper for lower, upper in bounds.values()):
+            return None
+
+        (
+            (start_year, end_year),
+            (start_month, end_month),
+            (start_day, end_day),
+        ) = (
+            bounds["y"],
+            bounds["mo"],
+            bounds["d"],
+        )
+
+        # -- months only bound the range within a single year, and days
+        # within a single month
+        if start_year != end_year:
+            start_month, end_month = 1, 12
+        if start_year != end_year or start_month != end_month:
+            start_day, end_day = 1, 31
+
+        # -- days past the end of the month overflow into the next one
+        start = None
+        if start_year > 1:
+            start = datetime(start_year, start_month, 1) + timedelta(
+                days=start_day - 1
+            )
+
+        end = None
+        if end_year < 9999:
+            end = min(
+                datetime(end_year, end_month, 1) + timedelta(days=end_day),
+                datetime(end_year + end_month // 12, end_month % 12 + 1, 1),
+            )
+
+        if start is not None and end is not None and start >= end:
+            return None
+
+        return start, end
+
+    def _clear_cache(self) -> None:
+        self._compiled = None
+        self._mask_cache = None
+
+    def _get_mask_cache_expression(self, X: pl.DataFrame) -> pl.Expr:
+        """Evaluates the rules on the timestamps of `X` that are not in the
+        mask cache, updates the cache and returns an expression looking up
+        the timestamps that are kept.
+
+        :param X: polars dataframe to filter
+        :return: filtering expression, True for the rows that are kept
+        """
+        time_column = pl.col(self.time_column)
+        timestamps = X.select(time_column.unique().drop_nulls())
+
+        # -- the cache is only valid for the type of the time column it was
+        # built with, e.g. the time zone
+        if (
+            self._mask_cache is not None
+            and self._mask_cache.schema[self.time_column]
+            != timestamps.schema[self.time_column]
+        ):
+            self._mask_cache = None
+
+        self._mask_cache_calls += 1
+        last_used = pl.lit(self._mask_cache_calls, dtype=pl.Int64)
+        if self._mask_cache is None:
+            missing_timestamps = timestamps
+            mask_cache = None
+        else:
+            missing_timestamps = timestamps.join(
+                self._mask_cache, on=self.time_column, how="anti"
+            )
+            mask_cache = self._mask_cache.with_columns(
+                pl.when(time_column.is_in(timestamps[self.time_column]))
+                .then(last_used)
+                .otherwise(pl.col("_last_used"))
+                .alias("_last_used")
+            )
+
+        masks = missing_timestamps.select(
+            time_column,
+            self.get_expression().alias("_mask"),
+            last_used.alias("_last_used"),
+        )
+        if mask_cache is not None:
+            masks = pl.concat([mask_cache, masks])
+
+        self._cache_info["mask_misses"] += missing_timestamps.height
+        self._cache_info["mask_hits"] += (
+            timestamps.height - missing_timestamps.height
+        )
+
+        kept_timestamps = masks.filter(
+            pl.col("_mask") & (pl.col("_last_used") == last_used)
+        )[self.time_column]
+
+        # -- evict the least recently used timestamps
+        if masks.height > self.mask_cache_size:
+            masks = masks.sort("_last_used", descending=True).head(
+                self.mask_cache_size
+            )
+        self._mask_cache = masks
+
+        return time_column.is_in(kept_timestamps)
 
     def _parse_time_patterns_into_rules(
         self, time_patterns: list[str]
@@ -211,25 +801,9 @@ class FilterDataBasedOnTime(BaseEstimator, TransformerMixin):
                 ["==", ">", "<"]
             )
         """
-        pattern = pattern.replace(" ", "")
-        operator = ""
-        operators = []
-        duration_string = ""
-        duration_strings = []
-        for char in pattern:
-            if char in {">", "<", "=", "!"}:
-                operator += char
-                if duration_string:
-                    duration_strings.append(duration_string)
-                    duration_string = ""
-            else:
-                duration_string += char
-                if operator:
-                    operators.append(operator)
-                    operator = ""
-        duration_strings.append(duration_string)
-
-        return duration_strings, operators
+        duration_strings, operators = _split_time_pattern(pattern)
+
+        return list(duration_strings), list(operators)
 
     def _create_rule_metadata_from_condition(
         self, duration_string: str, operator: str
@@ -276,8 +850,7 @@ class FilterDataBasedOnTime(BaseEstimator, TransformerMixin):
         else:
             how = "simple"
 
-        polars_duration = PolarsDuration(duration=duration_string)
-        decomposed_duration = polars_duration.decomposed_duration
+        decomposed_duration = list(decompose_duration(duration_string))
 
         if how == "cascade" and any(
             unit not in POLARS_DURATIONS_TO_IMMEDIATE_CHILD_MAPPING
@@ -299,59 +872,315 @@ class FilterDataBasedOnTime(BaseEstimator, TransformerMixin):
 
         return rule_metadata
 
-    def _convert_rules_to_polars_expressions(self):
+    @staticmethod
+    def _get_condition_how(condition: dict) -> str:
+        """Gets how a condition is applied. Cascades only change the meaning
+        of `>`, e.g. `<=1h*` means the same as `<=1h`, that is any time up
+        to 01:59:59. Cascades with other operators are only generated
+        internally, when negating `>` cascades.
+
+        :param condition: rule metadata of the condition, see
+            `_create_rule_metadata_from_condition`
+        :return: "cascade" or "simple"
+        """
+        if condition["how"] == "cascade" and condition["operator"] == "gt":
+            return "cascade"
+
+        return "simple"
+
+    def _convert_rules_to_polars_expressions(
+        self, component_columns: dict | None = None
+    ):
         """Converts defined rules into Polars expressions.
 
+        :param component_columns: mapping of unit of time to a column that
+            already contains it. If not provided, the units are extracted
+            from the time column
         :return: overall polars expression from parsed rules
         """
+        # -- data matching the rules is removed unless `keep`
+        negate = not self.keep
+        if self.compile_intervals:
+            return self._convert_rules_to_interval_expression(
+                component_columns, negate
+            )
+
+        return self._convert_rules_to_boolean_expression(
+            component_columns, negate
+        )
+
+    def _convert_rules_to_boolean_expression(
+        self, component_columns: dict | None = None, negate: bool = False
+    ) -> pl.Expr:
+        """Converts defined rules into a tree of conditions, OR across rules
+        and AND within them. If negated, De Morgan's laws are applied so that
+        the negation is pushed down into the conditions, i.e. AND across
+        rules and OR within them, with each operator negated.
+
+        :param component_columns: mapping of unit of time to a column that
+            already contains it. If not provided, the units are extracted
+            from the time column
+        :param negate: if True, the expression is True where no rule matches
+        :return: polars expression, True where any rule matches
+        """
+        within_rule, across_rules = ("and_", "or_")
+        if negate:
+            within_rule, across_rules = ("or_", "and_")
+
         rules = []  # list to store expressions for each rule
         for rule_metadata in self.filtering_rules:
             rule_expressions = []
             for condition in rule_metadata:
-                how = condition["how"]
-                decomposed_duration = condition["decomposed_duration"]
                 operator = condition["operator"]
-                if how == "simple":
-                    expression = generate_polars_condition(
-                        [
-                            self._generate_simple_condition(
-                                unit, value, operator
-                            )
-                            for value, unit in decomposed_duration
-                        ],
-                        "and_",
-                    )
+                if negate:
+                    operator = FilterDataBasedOnTime.NEGATED_OPERATOR_MAPPING[
+                        operator
+                    ]
+
+                if self._get_condition_how(condition) == "simple":
+                    generate_condition = self._generate_simple_condition
                 else:
-                    expression = generate_polars_condition(
-                        [
-                            self._generate_cascade_condition(
-                                unit, value, operator
-                            )
-                            for value, unit, in decomposed_duration
-                        ],
-                        "and_",
+                    generate_condition = (
+                        self._generate_lowered_cascade_condition
                     )
 
+                expression = generate_polars_condition(
+                    [
+                        generate_condition(
+                            unit, value, operator, component_columns
+                        )
+                        for value, unit in condition["decomposed_duration"]
+                    ],
+                    within_rule,
+                )
                 rule_expressions.append(expression)
 
             rule_expression = generate_polars_condition(
-                rule_expressions, "and_"
+                rule_expressions, within_rule
             )
             rules.append(rule_expression)
 
-        overall_rule_expression = generate_polars_condition(rules, "or_")
+        return generate_polars_condition(rules, across_rules)
+
+    def _uses_weekdays(self) -> bool:
+        return any(
+            unit == "wd"
+            for rule_metadata in self.filtering_rules
+            for condition in rule_metadata
+            for _, unit in condition["decomposed_duration"]
+        )
+
+    def _convert_rules_to_interval_expression(
+        self, component_columns: dict | None = None, negate: bool = False
+    ) -> pl.Expr:
+        """Converts defined rules into a check against the intervals they
+        describe over the week, or the day if no weekdays are used.
+
+        :param component_columns: mapping of unit of time to a column that
+            already contains it. If not provided, the units are extracted
+            from the time column
+        :param negate: if True, checks against the complement of the
+            intervals, i.e. is True where no rule matches
+        :return: polars expression, True where any rule matches
+        """
+        offset = self._get_time_component(
+            FilterDataBasedOnTime.TIME_OF_DAY_UNIT, component_columns
+        )
+        if self._uses_weekdays():
+            weekday = self._get_time_component("wd", component_columns)
+            offset = (
+                weekday.cast(pl.Int64) - 1
+            ) * FilterDataBasedOnTime.INTERVAL_UNITS["wd"]["length"] + offset
+
+        return is_in_intervals_expression(
+            offset, self._convert_rules_to_intervals(negate)
+        )
+
+    def _convert_rules_to_intervals(self, negate: bool = False) -> np.ndarray:
+        """Converts defined rules into the merged intervals they describe,
+        in nanoseconds from the start of the week (Monday), or from the
+        start of the day if no weekdays are used.
+
+        :param negate: if True, returns the complement of the intervals
+        :return: sorted, non-overlapping [start, end) intervals of shape
+            (n, 2)
+
+        Example:
+            # -- rules from ["<6wd<6h", "<6wd>=20h"]
+            _convert_rules_to_intervals() / 3_600 / 10**9
+            >>> np.array([[0, 6], [20, 30], [44, 54], ..., [116, 120]])
+        """
+        units = {
+            unit
+            for rule_metadata in self.filtering_rules
+            for condition in rule_metadata
+            for _, unit in condition["decomposed_duration"]
+        }
+        unsupported_units = units - FilterDataBasedOnTime.INTERVAL_UNITS.keys()
+        if unsupported_units:
+            msg = (
+                f"Units {sorted(unsupported_units)} can not be compiled into "
+                "intervals. Supported units: "
+                f"{list(FilterDataBasedOnTime.INTERVAL_UNITS)}"
+            )
+            logger.error(msg)
+            raise ValueError(msg)
+
+        domain = FilterDataBasedOnTime.INTERVAL_UNITS[
+            "wd" if "wd" in units else "h"
+        ]["period"]
 
-        if not self.keep:
-            overall_rule_expression = overall_rule_expression.not_()
+        rule_intervals = []
+        for rule_metadata in self.filtering_rules:
+            rule_intervals.append(
+                intersect_intervals(
+                    [
+                        self._get_condition_intervals(
+                            unit, value, condition, domain
+                        )
+                        for condition in rule_metadata
+                        for value, unit in condition["decomposed_duration"]
+                    ]
+                )
+            )
+
+        intervals = union_intervals(rule_intervals)
+        if negate:
+            intervals = complement_intervals(intervals, 0, domain)
+
+        return intervals
+
+    def _get_condition_intervals(
+        self, unit: str, value: int, condition: dict, domain: int
+    ) -> np.ndarray:
+        """Gets the intervals where a condition on a single unit of time
+        holds.
+
+        :param unit: unit of time, e.g. "h"
+        :param value: value to use for filtering
+        :param condition: rule metadata of the condition, see
+            `_create_rule_metadata_from_condition`
+        :param domain: length of the domain in nanoseconds, a week or a day
+        :return: [start, end) intervals of shape (n, 2)
+        """
+        unit_metadata = FilterDataBasedOnTime.INTERVAL_UNITS[unit]
+        first = unit_metadata["first"]
+        last = unit_metadata["last"]
+        length = unit_metadata["length"]
+        period = unit_metadata["period"]
+
+        operator = condition["operator"]
+        if self._get_condition_how(condition) == "cascade":
+            # -- strictly after the start of the value
+            runs = [[max((value - first) * length + 1, 0), period]]
+        else:
+            value_runs = {
+                "eq": [(value, value)],
+                "ne": [(first, value - 1), (value + 1, last)],
+                "lt": [(first, value - 1)],
+                "le": [(first, value)],
+                "gt": [(value + 1, last)],
+                "ge": [(value, last)],
+            }[operator]
+            runs = [
+                [
+                    (max(start, first) - first) * length,
+                    (min(end, last) - first + 1) * length,
+                ]
+                for start, end in value_runs
+            ]
+
+        runs = np.array(runs, dtype=np.int64)
+        runs = runs[runs[:, 0] < runs[:, 1]]
+
+        number_of_intervals = len(runs) * (domain // period)
+        if number_of_intervals > FilterDataBasedOnTime.MAX_COMPILED_INTERVALS:
+            msg = (
+                f"Condition on `{unit}` compiles into {number_of_intervals} "
+                "intervals, more than the maximum of "
+                f"{FilterDataBasedOnTime.MAX_COMPILED_INTERVALS}"
+            )
+            logger.error(msg)
+            raise ValueError(msg)
+
+        # -- the runs repeat every period within the domain
+        repetitions = np.arange(domain // period, dtype=np.int64) * period
+        return (repetitions[:, None, None] + runs[None]).reshape(-1, 2)
+
+    def _get_time_component(
+        self, unit: str, component_columns: dict | None = None
+    ) -> pl.Expr:
+        """Gets a unit of time of the time column.
+
+        :param unit: unit of time with a corresponding Polars method, e.g. "d"
+        :param component_columns: mapping of unit of time to a column that
+            already contains it, defaults to None
+        :return: a Polars expression of the unit of time
+        """
+        if component_columns is not None:
+            return pl.col(component_columns[unit])
+
+        local_time = self._get_local_time()
+        if unit == FilterDataBasedOnTime.TIME_OF_DAY_UNIT:
+            return local_time.dt.time().cast(pl.Int64)
+
+        return getattr(
+            local_time.dt,
+            FilterDataBasedOnTime.UNIT_TO_POLARS_METHOD_MAPPING[unit],
+        )()
+
+    def _get_local_time(self) -> pl.Expr:
+        """Gets the time column in `time_zone`, as a time zone naive
+        datetime. The UTC offset of each row is looked up from the offset
+        transitions of the time zone with a binary search, rather than
+        converting the time zone of the column.
+
+        :return: a Polars expression of the local time
+        """
+        time_column = pl.col(self.time_column)
+        if self.time_zone is None:
+            return time_column
+
+        transitions, offsets = get_utc_offset_transitions(self.time_zone)
+        timestamp = time_column.dt.epoch("ns")
+        offset = pl.lit(pl.Series(offsets)).gather(
+            pl.lit(pl.Series(transitions)).search_sorted(
+                timestamp, side="right"
+            )
+        )
 
-        return overall_rule_expression
+        return (timestamp + offset).cast(pl.Datetime("ns"))
 
-    def _generate_simple_condition(self, unit, value, operator):
+    def _iterate_child_units(self, unit: str) -> Iterator[tuple[str, int]]:
+        """Iterates over the descendants of a unit of time, e.g. for "h"
+        these are "m", "s", "ms", "us" and "ns".
+
+        :param unit: unit of time
+        :yield: child unit and the value it starts from
+        """
+        child_unit_metadata = POLARS_DURATIONS_TO_IMMEDIATE_CHILD_MAPPING.get(
+            unit, None
+        )
+        while child_unit_metadata is not None:
+            child_unit = child_unit_metadata["next"]
+            yield child_unit, child_unit_metadata["start"]
+            child_unit_metadata = (
+                POLARS_DURATIONS_TO_IMMEDIATE_CHILD_MAPPING.get(
+                    child_unit, None
+                )
+            )
+
+    def _generate_simple_condition(
+        self, unit, value, operator, component_columns=None
+    ):
         """Function to generate a simple filtering condition.
 
         :param unit: unit of time with a corresponding Polars method, e.g. "d"
         :param value: value to use for filtering
         :param operator: Polars operator to use, e.g. "lt" (less than)
+        :param component_columns: mapping of unit of time to a column that
+            already contains it. If not provided, the unit is extracted from
+            the time column
         :return: a Polars expression of the condition described applied
             to the time column
 
@@ -360,50 +1189,69 @@ class FilterDataBasedOnTime(BaseEstimator, TransformerMixin):
             >>> "[(col("date").dt.hour()) < (dyn int: 1)]"
         """
         return getattr(
-            getattr(
-                pl.col(self.time_column).dt,
-                FilterDataBasedOnTime.UNIT_TO_POLARS_METHOD_MAPPING[unit],
-            )(),
-            operator,
+            self._get_time_component(unit, component_columns), operator
         )(value)
 
-    def _generate_cascade_condition(self, unit, value, operator):
+    def _generate_cascade_condition(
+        self, unit, value, operator, component_columns=None
+    ):
         """Generates a cascade condition. E.g. makes sure that >01:00 (%H:%M)
         doesn't just mean >1 hour, but also means >01:XX.
 
         :param unit: unit of time with a corresponding Polars method, e.g. "d"
         :param value: value to use for filtering
-        :param operator: Polars operator to use, e.g. "lt" (less than)
+        :param operator: Polars operator to use, e.g. "lt" (less than). For
+            "le" the cascade makes sure that <=01:00 means <01:00 or exactly
+            01:00:00, i.e. the negation of >01:00 as a cascade. This is only
+            used internally, `<=` patterns are not cascaded, see
+            `_get_condition_how`
+        :param component_columns: mapping of unit of time to a column that
+            already contains it. If not provided, units are extracted from
+            the time column
         :return: a Polars expression of the condition described applied to the time column
 
         Example:
             str(_generate_cascade_condition("d", 1, "gt"))  # will search for hour, minute, second, ms, us and ns  # noqa
             >>> "[([([([([([([([(col("date").dt.nanosecond()) > (dyn int: 0)]) | ([(col("date").dt.hour()) > (dyn int: 0)])]) | ([(col("date").dt.minute()) > (dyn int: 0)])]) | ([(col("date").dt.second()) > (dyn int: 0)])]) | ([(col("date").dt.millisecond()) > (dyn int: 0)])]) | ([(col("date").dt.microsecond()) > (dyn int: 0)])]) & ([(col("date").dt.day()) == (dyn int: 1)])]) | ([(col("date").dt.day()) > (dyn int: 1)])]"  # noqa
         """
+        if operator == "le":
+            # -- strictly less, or equal with all child units at their start
+            equality_condition = self._generate_simple_condition(
+                unit, value, "eq", component_columns
+            )
+            child_unit_conditions = [
+                self._generate_simple_condition(
+                    child_unit, start_value, "eq", component_columns
+                )
+                for child_unit, start_value in self._iterate_child_units(unit)
+            ]
+
+            return generate_polars_condition(
+                [
+                    self._generate_simple_condition(
+                        unit, value, "lt", component_columns
+                    ),
+                    generate_polars_condition(
+                        [equality_condition, *child_unit_conditions], "and_"
+                    ),
+                ],
+                "or_",
+            )
+
         simple_condition = self._generate_simple_condition(
-            unit, value, operator
+            unit, value, operator, component_columns
         )
         all_conditions = [simple_condition]
         if operator == "gt":
             equality_condition = self._generate_simple_condition(
-                unit, value, "eq"
-            )
-            child_unit_conditions = []
-            child_unit_metadata = (
-                POLARS_DURATIONS_TO_IMMEDIATE_CHILD_MAPPING.get(unit, None)
+                unit, value, "eq", component_columns
             )
-            while child_unit_metadata is not None:
-                start_value = child_unit_metadata["start"]
-                child_unit = child_unit_metadata["next"]
-                child_unit_condition = self._generate_simple_condition(
-                    child_unit, start_value, "gt"
-                )
-                child_unit_conditions.append(child_unit_condition)
-                child_unit_metadata = (
-                    POLARS_DURATIONS_TO_IMMEDIATE_CHILD_MAPPING.get(
-                        child_unit, None
-                    )
+            child_unit_conditions = [
+                self._generate_simple_condition(
+                    child_unit, start_value, "gt", component_columns
                 )
+                for child_unit, start_value in self._iterate_child_units(unit)
+            ]
 
             cascase_condition = generate_polars_condition(
                 [
@@ -419,6 +1267,227 @@ class FilterDataBasedOnTime(BaseEstimator, TransformerMixin):
 
         return overall_condition
 
+    def _can_lower_cascade_condition(self, unit: str, operator: str) -> bool:
+        return (
+            operator in {"gt", "le"}
+            and unit in FilterDataBasedOnTime.LOWERED_CASCADE_UNITS
+        )
+
+    def _generate_lowered_cascade_condition(
+        self, unit, value, operator, component_columns=None
+    ):
+        """Generates a cascade condition as a single integer comparison,
+        where possible. E.g. >1h* is equivalent to the time of day being
+        past 01:00:00, >1m* to the time within the hour being past 00:01:00,
+        and its negation to the time of day being at most 01:00:00. Cascade
+        conditions that cannot be lowered are generated with
+        `_generate_cascade_condition`.
+
+        :param unit: unit of time with a corresponding Polars method, e.g. "d"
+        :param value: value to use for filtering
+        :param operator: Polars operator to use, e.g. "gt" (greater than)
+        :param component_columns: mapping of unit of time to a column that
+            already contains it. If not provided, units are extracted from
+            the time column
+        :return: a Polars expression of the condition described applied to
+            the time column
+
+        Example:
+            str(_generate_lowered_cascade_condition("h", 1, "gt"))
+            >>> "[([(col("date").dt.time().strict_cast(Int64)) % (dyn int: 86400000000000)]) > (dyn int: 3600000000000)]"  # noqa
+        """
+        if not self._can_lower_cascade_condition(unit, operator):
+            return self._generate_cascade_condition(
+                unit, value, operator, component_columns
+            )
+
+        unit_metadata = FilterDataBasedOnTime.LOWERED_CASCADE_UNITS[unit]
+        length = unit_metadata["length"]
+        period = unit_metadata["period"]
+        time_of_day = self._get_time_component(
+            FilterDataBasedOnTime.TIME_OF_DAY_UNIT, component_columns
+        )
+        if period is None:
+            # -- days start from 1, so offset from the start of the month
+            # (or week) is the number of whole days plus the time of day
+            day = self._get_time_component(unit, component_columns)
+            offset = (day.cast(pl.Int64) - 1) * length + time_of_day
+            threshold = (value - 1) * length
+        else:
+            offset = time_of_day % period
+            threshold = value * length
+
+        return getattr(offset, operator)(threshold)
+
+
+class CombinedFilterDataBasedOnTime(BaseEstimator, TransformerMixin):
+    """Labels data with several `FilterDataBasedOnTime` filters at once.
+    The time components used by any of the filters are extracted once and
+    shared between them, and all labels are computed in a single
+    `with_columns`. Labels are True for the data each filter keeps.
+
+    :param filters: filters to combine
+    :param names: names of the label column of each filter, defaults to
+        `_data_to_filter_{index}`
+    :param pack_bits: if True, returns a single unsigned integer column
+        "_data_to_filter" where bit `i` is set if filter `i` keeps the row,
+        instead of a boolean column per filter. At most 64 filters can be
+        packed. Defaults to False
+    """
+
+    def __init__(
+        self,
+        filters: list[FilterDataBasedOnTime],
+        names: list[str] | None = None,
+        pack_bits: bool = False,
+    ):
+        if names is None:
+            names = [
+                f"_data_to_filter_{index}" for index in range(len(filters))
+            ]
+
+        if len(names) != len(filters) or len(set(names)) != len(names):
+            msg = "`names` must be unique, with one name for each filter"
+            logger.error(msg)
+            raise ValueError(msg)
+
+        if pack_bits and len(filters) > 64:
+            msg = f"At most 64 filters can be packed, got {len(filters)}"
+            logger.error(msg)
+            raise ValueError(msg)
+
+        self.filters = filters
+        self.names = names
+        self.pack_bits = pack_bits
+
+    def fit(self, X: pl.DataFrame, y=None):
+        pass
+
+    def transform(
+        self, X: pl.DataFrame | pl.LazyFrame
+    ) -> pl.DataFrame | pl.LazyFrame:
+        """Labels data with each filter.
+
+        :param X: polars dataframe or LazyFrame to label
+        :return: data with the label columns, or the packed label column
+        """
+        components = {}
+        labels = []
+        for time_filter in self.filters:
+            compiled = time_filter._get_compiled_expressions()
+            for component in compiled["components"]:
+                components[component.meta.output_name()] = component
+            labels.append(compiled["component_expression"])
+        FilterDataBasedOnTime._check_component_columns(X, components)
+
+        if self.pack_bits:
+            dtype = pl.UInt8
+            for bits, bits_dtype in [
+                (8, pl.UInt16),
+                (16, pl.UInt32),
+                (32, pl.UInt64),
+            ]:
+                if len(labels) > bits:
+                    dtype = bits_dtype
+
+            labels = [
+                pl.sum_horizontal(
+                    [
+                        label.cast(dtype) * pl.lit(2**index, dtype=dtype)
+                        for index, label in enumerate(labels)
+                    ]
+                ).alias("_data_to_filter")
+            ]
+        else:
+            labels = [
+                label.alias(name)
+                for label, name in zip(  # noqa: B905 zip(strict) added in py310 but want code to work with >=py38
+                    labels, self.names
+                )
+            ]
+
+        return (
+            X.with_columns(list(components.values()))
+            .with_columns(labels)
+            .drop(list(components))
+        )
+
+
+TIME_PATTERN_OPERATOR_REGEX = re.compile(r"([<>=!]+)")
+
+
+@functools.lru_cache(maxsize=4096)
+def _split_time_pattern(pattern: str) -> tuple[tuple[str, ...], ...]:
+    """Splits a time pattern into its durations and the operators applied to
+    them, see `FilterDataBasedOnTime._parse_time_pattern`. Results are cached
+    since the same patterns are parsed every time a filter is built.
+
+    :param pattern: time pattern, e.g. "==1mo>6d1h<7d"
+    :return: durations and operators of the pattern
+    """
+    tokens = TIME_PATTERN_OPERATOR_REGEX.split(pattern.replace(" ", ""))
+
+    # -- tokens alternate between durations and operators, starting with an
+    # empty duration when the pattern starts with an operator
+    duration_strings = tokens[2::2] if not tokens[0] else tokens[::2]
+    operators = tokens[1::2]
+
+    return tuple(duration_strings), tuple(operators)
+
+
+def _get_time_range_hull(
+    time_ranges: list[tuple[datetime | None, datetime | None] | None]
+) -> tuple[datetime | None, datetime | None] | None:
+    """Smallest range containing all time ranges, ignoring empty ranges.
+
+    :param time_ranges: inclusive start and exclusive end of each range,
+        None if unbounded. Empty ranges are None
+    :return: hull of the ranges, None if all of them are empty
+    """
+    time_ranges = [
+        time_range for time_range in time_ranges if time_range is not None
+    ]
+    if not time_ranges:
+        return None
+
+    starts = [start for start, _ in time_ranges]
+    ends = [end for _, end in time_ranges]
+
+    return (
+        None if None in starts else min(starts),
+        None if None in ends else max(ends),
+    )
+
+
+def _get_time_range_intersection(
+    time_range: tuple[datetime | None, datetime | None] | None,
+    other_time_range: tuple[datetime | None, datetime | None] | None,
+) -> tuple[datetime | None, datetime | None] | None:
+    """Intersection of two time ranges.
+
+    :param time_range: inclusive start and exclusive end, None if
+        unbounded. Empty ranges are None
+    :param other_time_range: range to intersect with
+    :return: intersection of the ranges, None if empty
+    """
+    if time_range is None or other_time_range is None:
+        return None
+
+    starts = [
+        start
+        for start in (time_range[0], other_time_range[0])
+        if start is not None
+    ]
+    ends = [
+        end for end in (time_range[1], other_time_range[1]) if end is not None
+    ]
+    start = max(starts) if starts else None
+    end = min(ends) if ends else None
+    if start is not None and end is not None and start >= end:
+        return None
+
+    return start, end
+
 
 # If no target cols provided, tries to apply to all!
 class ResampleData(BaseEstimator, TransformerMixin):
@@ -445,13 +1514,27 @@ class ResampleData(BaseEstimator, TransformerMixin):
         onwards as the start of the day. Defaults to `None`
     :param partial_data_resolution_strategy: how to deal if you only
         have partial data in a resampling window. See
-        `PartialDataResolutionStrategy` enum for info
+        `PartialDataResolutionStrategy` enum for info. The frequency
+        of the data, which determines how many points a complete window
+        has, is detected for each group if `group_by_columns` is provided
     :param group_by_columns: group by columns before resampling
     :param filter_data_method: method that takes a dataframe and removes
         data from it. This is compatible with
         `partial_data_resolution_strategy`. Any extra rows removed here
         will not affect the logic of determining if a window contains
-        partial data
+        partial data. Can also be a boolean Polars expression that is True
+        for rows to keep (e.g. `FilterDataBasedOnTime.get_expression()`),
+        in which case filtering and partial data detection happen in a
+        single pass over the data
+    :param assume_sorted: if True, the time column is assumed to already be
+        sorted in ascending order and is not sorted again. Dataframes whose
+        time column Polars has flagged as sorted are not sorted again either
+        way. Defaults to `False`
+    :param sorted_within_groups: if True, the time column is assumed to
+        already be sorted in ascending order within each group of
+        `group_by_columns`, e.g. for data sorted by group and then by time,
+        and is not sorted again. Without `group_by_columns` this is the same
+        as `assume_sorted`. Defaults to `False`
     """
 
     def __init__(
@@ -476,7 +1559,10 @@ class ResampleData(BaseEstimator, TransformerMixin):
         partial_data_resolution_strategy: PartialDataResolutionStrategy = "keep",
         group_by_columns: list | None = None,
         filter_data_method: Callable[[pl.DataFrame], pl.DataFrame]
+        | pl.Expr
         | None = None,
+        assume_sorted: bool = False,
+        sorted_within_groups: bool = False,
     ):
         self.time_column = time_column
         self.resampling_frequency = resampling_frequency
@@ -519,6 +1605,8 @@ class ResampleData(BaseEstimator, TransformerMixin):
 
         self.group_by_columns = group_by_columns
         self.filter_data_method = filter_data_method
+        self.assume_sorted = assume_sorted
+        self.sorted_within_groups = sorted_within_groups
 
     def _set_start_window_offset(self, start_window_offset):
         if start_window_offset is not None:
@@ -605,10 +1693,7 @@ class ResampleData(BaseEstimator, TransformerMixin):
                     logger.error(msg)
                     raise ValueError(msg)
 
-    def _groupby(self, X):
-        # TODO add sorting support for group by with the "by" key, e.g. sort
-        # the time WITHIN a group!
-
+    def _groupby(self, X, is_sorted: bool = False):
         if self.start_window_offset:
             logger.info(
                 f"Detected offset... applying offset={self.start_window_offset}"
@@ -617,7 +1702,11 @@ class ResampleData(BaseEstimator, TransformerMixin):
                 pl.col(self.time_column).dt.offset_by(self.start_window_offset)
             )
 
-        X = X.sort(self.time_column)
+        if not is_sorted:
+            X = X.sort(self.time_column)
+        elif not self.group_by_columns:
+            # -- offsetting keeps the order but polars drops the sorted flag
+            X = X.with_columns(pl.col(self.time_column).set_sorted())
 
         # TODO note: start_window vs. offset. With start window,
         # you can guarantee the start date because you are shifting by
@@ -663,11 +1752,11 @@ class ResampleData(BaseEstimator, TransformerMixin):
 
         return groupby_obj
 
-    def _aggregate(self, X):
-        # validation on the target functions!
+    def _get_target_columns(self, X, mask_column: str | None = None):
         if self.target_columns is None:
             target_columns = set(X.columns)
             target_columns.remove(self.time_column)
+            target_columns.discard(mask_column)
 
             if self.group_by_columns:
                 for column in self.group_by_columns:
@@ -677,7 +1766,15 @@ class ResampleData(BaseEstimator, TransformerMixin):
         else:
             target_columns = self.target_columns
 
-        groupby_obj = self._groupby(X)
+        return target_columns
+
+    def _aggregate(
+        self, X, mask_column: str | None = None, is_sorted: bool = False
+    ):
+        # validation on the target functions!
+        target_columns = self._get_target_columns(X, mask_column)
+
+        groupby_obj = self._groupby(X, is_sorted)
 
         agg_func_list = []
         multiple_resampling_functions = len(self.resampling_function) > 1
@@ -687,6 +1784,10 @@ class ResampleData(BaseEstimator, TransformerMixin):
                 # TODO add support for arguments to these, e.g.
                 # "sum with truncation" if these are native!
                 target_column_obj = pl.col(target_column)
+                if mask_column is not None:
+                    target_column_obj = target_column_obj.filter(
+                        pl.col(mask_column)
+                    )
                 if func_name in SUPPORTED_RESAMPLING_OPERATIONS:
                     if func_name != "collect":
                         agg_func = getattr(target_column_obj, func_name)()
@@ -718,25 +1819,720 @@ class ResampleData(BaseEstimator, TransformerMixin):
                 .alias("_unique_timestamp_count")
             )
 
+        if mask_column is not None:
+            # -- windows with all their data masked out are dropped, as they
+            # would be had the rows been removed
+            agg_func_list.append(pl.col(mask_column).any().alias(mask_column))
+
         df_agg = groupby_obj.agg(agg_func_list)
 
+        if mask_column is not None:
+            df_agg = df_agg.filter(pl.col(mask_column)).drop(mask_column)
+
         return df_agg
 
     def fit(self, X, y=None):
         pass
 
-    def transform(self, X):
+    def transform(
+        self, X: pl.DataFrame | pl.LazyFrame
+    ) -> pl.DataFrame | pl.LazyFrame:
+        """Resamples a dataframe.
+
+        If `X` is a LazyFrame then a LazyFrame is returned and every step,
+        including frequency detection and partial data resolution, is kept
+        within a single lazy query, so nothing is computed until the caller
+        collects. In this case `filter_data_method` receives a LazyFrame, and
+        with the `fail` strategy the error is raised (as a polars
+        `ComputeError`) on collection.
+
+        :param X: dataframe or LazyFrame to resample
+        :return: resampled data, of the same type as `X`
+        """
+        return self._resample(X)
+
+    def transform_chunks(
+        self,
+        chunks: Iterable[pl.DataFrame] | pl.LazyFrame,
+        chunk_size: int = 1_000_000,
+    ) -> Iterator[pl.DataFrame]:
+        """Resamples data that does not fit in memory chunk by chunk.
+
+        Chunks must be ordered by time, both within and across chunks.
+        Resampled windows are yielded as soon as they are complete, i.e. once
+        data past their right boundary has been seen, and the rows of the
+        window that is still open are carried over to the next chunk. The
+        frequency used for partial data resolution is the most common
+        difference between consecutive timestamps seen so far (in each
+        group, if `group_by_columns` is provided), including across chunk
+        boundaries, so the output matches `transform` for data with a stable
+        frequency.
+
+        :param chunks: iterable of time ordered dataframes, or a LazyFrame
+            (e.g. from `pl.scan_parquet`) to read in slices of `chunk_size`
+        :param chunk_size: number of rows per slice when `chunks` is a
+            LazyFrame, defaults to 1_000_000
+        :yield: resampled windows
+        """
+        if isinstance(chunks, pl.LazyFrame):
+            chunks = iterate_in_chunks(chunks, chunk_size)
+
+        detect_frequency = (
+            self.partial_data_resolution_strategy
+            != PartialDataResolutionStrategy.KEEP
+        )
+        frequency = None
+        frequency_counts = None
+        last_timestamps = None
+        carried_over = None
+        for chunk in chunks:
+            if chunk.is_empty():
+                continue
+
+            if detect_frequency:
+                frequency_counts = self._update_frequency_counts(
+                    frequency_counts, chunk, last_timestamps
+                )
+                frequency = self._get_frequency_from_counts(frequency_counts)
+                last_timestamps = self._get_last_timestamps(
+                    chunk, last_timestamps
+                )
+
+            if carried_over is not None:
+                chunk = pl.concat([carried_over, chunk])
+
+            finished, carried_over = self._split_finished_windows(chunk)
+            if not finished.is_empty():
+                yield self._resample(finished, frequency, is_sorted=True)
+
+        if carried_over is not None:
+            yield self._resample(carried_over, frequency, is_sorted=True)
+
+    def transform_partitioned(
+        self,
+        X: pl.DataFrame | pl.LazyFrame,
+        number_of_partitions: int,
+        use_processes: bool = False,
+        max_workers: int | None = None,
+        chunk_size: int = 1_000_000,
+    ) -> pl.DataFrame:
+        """Resamples data in parallel by hash partitioning it on the
+        `group_by_columns`, so that each group is resampled within a single
+        partition. Partitions are resampled in a thread pool, or in a process
+        pool if `use_processes` is True, and the results concatenated. If `X`
+        is a LazyFrame then it is read once, in slices of `chunk_size`, and
+        each slice is split into partitions written to temporary Arrow IPC
+        files. Each partition is then only collected by the worker that
+        resamples it, bounding memory per partition. Since frequencies are
+        detected per group, partitions are fully independent.
+
+        :param X: data to resample
+        :param number_of_partitions: number of partitions to split data into
+        :param use_processes: if True, resamples partitions in separate
+            processes. This requires the resampler to be picklable (e.g. a
+            `filter_data_method` that is not a lambda). Defaults to False
+        :param max_workers: maximum number of workers, defaults to the
+            executor's default
+        :param chunk_size: number of rows per slice when `X` is a LazyFrame,
+            defaults to 1_000_000
+        :return: resampled data, sorted by the group columns and time
+        """
+        if not self.group_by_columns:
+            raise ValueError(
+                "Partitioned resampling requires `group_by_columns`"
+            )
+
+        partition = (
+            pl.struct(self.group_by_columns).hash() % number_of_partitions
+        ).alias("_partition")
+        if isinstance(X, pl.LazyFrame):
+            with tempfile.TemporaryDirectory() as directory:
+                partitions = self._write_partitions(
+                    X, partition, directory, chunk_size
+                )
+                return self._resample_partitions(
+                    partitions, use_processes, max_workers
+                )
+
+        partitions = X.with_columns(partition).partition_by(
+            "_partition", include_key=False
+        )
+
+        return self._resample_partitions(
+            partitions, use_processes, max_workers
+        )
+
+    @staticmethod
+    def _write_partitions(
+        X: pl.LazyFrame, partition: pl.Expr, directory: str, chunk_size: int
+    ) -> list[pl.LazyFrame]:
+        """Reads data once in slices, writing the rows of each partition of
+        each slice to a separate Arrow IPC file.
+
+        :param X: data to partition
+        :param partition: expression of the partition of each row, named
+            `_partition`
+        :param directory: directory to write the partitions to
+        :param chunk_size: number of rows per slice
+        :return: scans of the files of each non empty partition
+        """
+        partition_ids = set()
+        for chunk_index, chunk in enumerate(iterate_in_chunks(X, chunk_size)):
+            for partition_data in chunk.with_columns(partition).partition_by(
+                "_partition"
+            ):
+                partition_id = partition_data["_partition"][0]
+                partition_ids.add(partition_id)
+                os.makedirs(
+                    os.path.join(directory, str(partition_id)), exist_ok=True
+                )
+                partition_data.drop("_partition").write_ipc(
+                    os.path.join(
+                        directory,
+                        str(partition_id),
+                        f"{chunk_index:08d}.arrow",
+                    )
+                )
+
+        return [
+            pl.scan_ipc(os.path.join(directory, str(partition_id), "*.arrow"))
+            for partition_id in sorted(partition_ids)
+        ]
+
+    def _resample_partitions(
+        self,
+        partitions: list[pl.DataFrame] | list[pl.LazyFrame],
+        use_processes: bool = False,
+        max_workers: int | None = None,
+    ) -> pl.DataFrame:
+        """Resamples partitions in parallel, see `transform_partitioned`.
+
+        :param partitions: partitions of data, each containing whole groups
+        :param use_processes: if True, resamples partitions in separate
+            processes
+        :param max_workers: maximum number of workers
+        :return: resampled data, sorted by the group columns and time
+        """
+        if use_processes:
+            executor = ProcessPoolExecutor(
+                max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers)
+
+        with executor:
+            results = list(
+                executor.map(
+                    _resample_partition,
+                    itertools.repeat(self),
+                    partitions,
+                )
+            )
+
+        return pl.concat(
+            [result for result in results if result is not None]
+        ).sort([*self.group_by_columns, self.time_column])
+
+    def update(self, X: pl.DataFrame) -> pl.DataFrame:
+        """Incrementally resamples data. New rows are folded into the state
+        kept for each window (sums, counts, minimums and maximums, and the
+        first and last timestamps and number of unique timestamps), so
+        previously seen data never has to be resampled again. Rows can belong
+        to any window, including ones that were already returned. The state
+        is kept in the `window_state_` and `frequency_counts_` attributes.
+
+        Only `sum`, `count`, `min`, `max` and `mean` are supported, and
+        `filter_data_method` must be an expression if provided. The
+        frequency used for partial data resolution is the most common
+        difference between consecutive timestamps, counted within each
+        update and accumulated over all updates (in each group, if
+        `group_by_columns` is provided). A timestamp seen in several updates
+        is only counted once in the unique timestamps of its window if it is
+        the last timestamp of the window seen so far, e.g. when data arrives
+        in time order. Otherwise, it is counted again.
+
+        :param X: new data
+        :return: resampled data for the windows that received new rows
+        """
+        unsupported_functions = [
+            resampling_function["name"]
+            for resampling_function in self.resampling_function
+            if resampling_function["name"]
+            not in SUPPORTED_INCREMENTAL_RESAMPLING_OPERATIONS
+        ]
+        if unsupported_functions:
+            raise NotImplementedError(
+                (
+                    f"Resampling functions {unsupported_functions} are not "
+                    "supported for incremental resampling. Supported: "
+                    f"{sorted(SUPPORTED_INCREMENTAL_RESAMPLING_OPERATIONS)}"
+                )
+            )
+
+        if self.filter_data_method is not None and not isinstance(
+            self.filter_data_method, pl.Expr
+        ):
+            raise NotImplementedError(
+                (
+                    "Incremental resampling only supports a "
+                    "`filter_data_method` given as a Polars expression"
+                )
+            )
+
+        target_columns = self._get_target_columns(X)
+        df_state = self._aggregate_window_state(
+            X.lazy(), target_columns
+        ).collect()
+
+        keys = [*(self.group_by_columns or []), "_lower_boundary"]
+        if hasattr(self, "window_state_"):
+            df_state = self._merge_window_state(
+                pl.concat(
+                    [
+                        self.window_state_.join(df_state, on=keys, how="semi"),
+                        df_state,
+                    ]
+                ),
+                target_columns,
+            )
+            self.window_state_ = pl.concat(
+                [
+                    self.window_state_.join(df_state, on=keys, how="anti"),
+                    df_state,
+                ]
+            ).sort(keys)
+        else:
+            self.window_state_ = df_state.sort(keys)
+
+        frequency = None
         if (
             self.partial_data_resolution_strategy
             != PartialDataResolutionStrategy.KEEP
         ):
-            frequency = detect_timeseries_frequency(
-                X, self.time_column, "mode"
+            self.frequency_counts_ = self._update_frequency_counts(
+                getattr(self, "frequency_counts_", None),
+                X.sort(self.time_column),
             )
+            frequency = self._get_frequency_from_counts(self.frequency_counts_)
 
-        # -- filter data, but keep information on number of rows prior to filtration
+        df_agg = self._window_state_to_resampled_data(
+            df_state.sort(keys).lazy(), target_columns
+        )
+        if (
+            self.partial_data_resolution_strategy
+            != PartialDataResolutionStrategy.KEEP
+        ):
+            df_agg = self._resolve_partial_data(
+                df_agg, frequency, defer_partial_data_check=False
+            )
+
+        df_agg = df_agg.collect()
+        if (
+            self.partial_data_resolution_strategy
+            == PartialDataResolutionStrategy.FAIL
+        ):
+            self._check_for_partial_data(df_agg["_is_partial"])
+
+        return df_agg
+
+    def save_state(self, path: str) -> None:
+        """Saves the state built by `update` to disk as Arrow IPC files, so
+        that incremental resampling can be resumed with `load_state`.
+
+        :param path: directory to save the state to
+        """
+        if not hasattr(self, "window_state_"):
+            raise ValueError("No state to save. Call `update` first")
+
+        os.makedirs(path, exist_ok=True)
+        self.window_state_.write_ipc(os.path.join(path, "window_state.arrow"))
+        if hasattr(self, "frequency_counts_"):
+            self.frequency_counts_.write_ipc(
+                os.path.join(path, "frequency_counts.arrow")
+            )
+
+    def load_state(self, path: str) -> None:
+        """Loads state saved with `save_state`.
+
+        :param path: directory the state was saved to
+        """
+        self.window_state_ = pl.read_ipc(
+            os.path.join(path, "window_state.arrow")
+        )
+
+        frequency_counts_path = os.path.join(path, "frequency_counts.arrow")
+        if os.path.exists(frequency_counts_path):
+            self.frequency_counts_ = pl.read_ipc(frequency_counts_path)
+        elif hasattr(self, "frequency_counts_"):
+            del self.frequency_counts_
+
+    def _aggregate_window_state(
+        self, X: pl.LazyFrame, target_columns: list[str]
+    ) -> pl.LazyFrame:
+        """Aggregates data into the state kept for each window by `update`.
+
+        :param X: data
+        :param target_columns: columns to resample
+        :return: state for each window in the data
+        """
+        mask = None
         if self.filter_data_method is not None:
-            df_agg_non_filtered = self._groupby(X).agg(
+            mask = self.filter_data_method.fill_null(False)
+
+        def _apply_mask(expression):
+            if mask is None:
+                return expression
+            return expression.filter(mask)
+
+        # -- as in `transform`, the first timestamp (used as the label of
+        # the window) and unique timestamps include rows that are masked out
+        agg_func_list = [
+            pl.col(self.time_column).min().alias("_first_timestamp"),
+            _apply_mask(pl.col(self.time_column)).count().alias("_row_count"),
+        ]
+        for target_column in target_columns:
+            target_column_obj = _apply_mask(pl.col(target_column))
+            agg_func_list.extend(
+                [
+                    target_column_obj.sum().alias(f"_{target_column}_sum"),
+                    target_column_obj.count().alias(f"_{target_column}_count"),
+                    target_column_obj.min().alias(f"_{target_column}_min"),
+                    target_column_obj.max().alias(f"_{target_column}_max"),
+                ]
+            )
+
+        if (
+            self.partial_data_resolution_strategy
+            != PartialDataResolutionStrategy.KEEP
+        ):
+            agg_func_list.extend(
+                [
+                    pl.col(self.time_column).max().alias("_last_timestamp"),
+                    pl.col(self.time_column)
+                    .n_unique()
+                    .alias("_unique_timestamp_count"),
+                ]
+            )
+
+        return (
+            self._groupby(X, self._is_sorted(X))
+            .agg(agg_func_list)
+            .drop(self.time_column)
+        )
+
+    def _merge_window_state(
+        self, df_state: pl.DataFrame, target_columns: list[str]
+    ) -> pl.DataFrame:
+        """Merges rows of window state that belong to the same window.
+
+        :param df_state: window state, with at most two rows per window, the
+            previous state followed by the state of new data
+        :param target_columns: columns being resampled
+        :return: window state with a single row per window
+        """
+        agg_func_list = [
+            pl.col("_upper_boundary").first(),
+            pl.col("_first_timestamp").min(),
+            pl.col("_row_count").sum(),
+        ]
+        for target_column in target_columns:
+            agg_func_list.extend(
+                [
+                    pl.col(f"_{target_column}_sum").sum(),
+                    pl.col(f"_{target_column}_count").sum(),
+                    pl.col(f"_{target_column}_min").min(),
+                    pl.col(f"_{target_column}_max").max(),
+                ]
+            )
+
+        if "_unique_timestamp_count" in df_state.columns:
+            # -- the last timestamp seen so far is counted once if the new
+            # data starts with it
+            is_repeated = (pl.len() > 1) & (
+                pl.col("_last_timestamp").first()
+                == pl.col("_first_timestamp").last()
+            )
+            agg_func_list.extend(
+                [
+                    pl.col("_last_timestamp").max(),
+                    pl.col("_unique_timestamp_count").sum()
+                    - is_repeated.cast(pl.UInt32),
+                ]
+            )
+
+        keys = [*(self.group_by_columns or []), "_lower_boundary"]
+        return df_state.group_by(keys, maintain_order=True).agg(agg_func_list)
+
+    def _window_state_to_resampled_data(
+        self, df_state: pl.LazyFrame, target_columns: list[str]
+    ) -> pl.LazyFrame:
+        """Computes the resampled output from window state, in the same
+        format as `transform`.
+
+        :param df_state: window state
+        :param target_columns: columns being resampled
+        :return: resampled data
+        """
+        label_column = {
+            "left": "_lower_boundary",
+            "right": "_upper_boundary",
+            "datapoint": "_first_timestamp",
+        }[self.labelling_strategy]
+
+        agg_func_list = []
+        multiple_resampling_functions = len(self.resampling_function) > 1
+        for target_column in target_columns:
+            for resampling_function_metadata in self.resampling_function:
+                func_name = resampling_function_metadata["name"]
+                count = pl.col(f"_{target_column}_count")
+                if func_name == "mean":
+                    agg_func = pl.when(count > 0).then(
+                        pl.col(f"_{target_column}_sum") / count
+                    )
+                elif func_name == "count":
+                    agg_func = count.cast(pl.UInt32)
+                else:
+                    agg_func = pl.col(f"_{target_column}_{func_name}")
+
+                if multiple_resampling_functions:
+                    agg_func = agg_func.alias(f"{target_column}_{func_name}")
+                else:
+                    agg_func = agg_func.alias(target_column)
+
+                agg_func_list.append(agg_func)
+
+        if "_unique_timestamp_count" in df_state.columns:
+            agg_func_list.append(pl.col("_unique_timestamp_count"))
+
+        return df_state.filter(pl.col("_row_count") > 0).select(
+            *(self.group_by_columns or []),
+            "_lower_boundary",
+            "_upper_boundary",
+            pl.col(label_column).alias(self.time_column),
+            *agg_func_list,
+        )
+
+    def _split_finished_windows(
+        self, X: pl.DataFrame
+    ) -> tuple[pl.DataFrame, pl.DataFrame]:
+        """Splits time ordered data into the rows of windows that are
+        complete, and the rows of the last window which may still receive
+        data.
+
+        :param X: time ordered dataframe
+        :return: rows of finished windows, rows of the last window
+        """
+        # -- resample the last row on its own to get its window boundaries
+        last_window = (
+            self._groupby(X.tail(1).lazy(), is_sorted=True).agg([]).collect()
+        )
+        lower_boundary = pl.lit(last_window["_lower_boundary"])
+
+        time_column = pl.col(self.time_column)
+        if self.start_window_offset:
+            time_column = time_column.dt.offset_by(self.start_window_offset)
+
+        if self.closed_boundaries == "left":
+            is_open = time_column >= lower_boundary
+        else:
+            is_open = time_column > lower_boundary
+
+        return X.filter(~is_open), X.filter(is_open)
+
+    def _update_frequency_counts(
+        self,
+        frequency_counts: pl.DataFrame | None,
+        X: pl.DataFrame,
+        X_previous: pl.DataFrame | None = None,
+    ) -> pl.DataFrame:
+        """Updates the counts of differences between consecutive unique
+        timestamps, per group if `group_by_columns` is provided, with those
+        in `X`.
+
+        :param frequency_counts: counts so far, None if no counts yet
+        :param X: time ordered dataframe
+        :param X_previous: last timestamps (of each group) preceeding `X`,
+            used to count the difference across the boundary between the two
+        :return: updated counts, with the difference in nanoseconds as
+            `_diff` and the number of occurences as `_count`
+        """
+        keys = self.group_by_columns or []
+        X = X.select(*keys, self.time_column)
+        if X_previous is not None:
+            X = pl.concat([X_previous, X])
+
+        diff = (
+            unique_timestamp_diff_expression(self.time_column, is_sorted=True)
+            .dt.total_nanoseconds()
+            .alias("_diff")
+        )
+        if keys:
+            diffs = (
+                X.group_by(keys, maintain_order=True)
+                .agg(diff)
+                .explode("_diff")
+                .drop_nulls("_diff")
+            )
+        else:
+            diffs = X.select(diff)
+
+        counts = diffs.group_by([*keys, "_diff"]).agg(
+            pl.col("_diff").count().alias("_count")
+        )
+
+        if frequency_counts is not None:
+            counts = (
+                pl.concat([frequency_counts, counts])
+                .group_by([*keys, "_diff"])
+                .agg(pl.col("_count").sum())
+            )
+
+        return counts
+
+    def _get_frequency_from_counts(
+        self, frequency_counts: pl.DataFrame
+    ) -> pl.DataFrame:
+        """Gets the most common difference from the counts of
+        `_update_frequency_counts`.
+
+        :param frequency_counts: counts of differences
+        :return: frequency in seconds as `_frequency`, for each group if
+            `group_by_columns` is provided
+        """
+        keys = self.group_by_columns or []
+
+        # -- ties are resolved by the smallest difference
+        frequency = frequency_counts.sort(
+            ["_count", "_diff"], descending=[True, False]
+        )
+        frequency_expression = (pl.col("_diff").first() / 10**9).alias(
+            "_frequency"
+        )
+        if keys:
+            return frequency.group_by(keys).agg(frequency_expression)
+
+        # -- a single row, null if there are no counts yet
+        return frequency.select(frequency_expression)
+
+    def _get_last_timestamps(
+        self, X: pl.DataFrame, X_previous: pl.DataFrame | None = None
+    ) -> pl.DataFrame:
+        """Gets the last timestamp, of each group if `group_by_columns` is
+        provided, so that the difference across consecutive chunks can be
+        counted.
+
+        :param X: time ordered dataframe
+        :param X_previous: last timestamps preceeding `X`
+        :return: last timestamps
+        """
+        keys = self.group_by_columns or []
+        X = X.select(*keys, self.time_column)
+        if not keys:
+            return X.tail(1)
+
+        if X_previous is not None:
+            X = pl.concat([X_previous, X])
+
+        return X.group_by(keys).agg(pl.col(self.time_column).last())
+
+    def _resample(
+        self,
+        X: pl.DataFrame | pl.LazyFrame,
+        frequency: pl.DataFrame | None = None,
+        is_sorted: bool | None = None,
+    ) -> pl.DataFrame | pl.LazyFrame:
+        is_lazy = isinstance(X, pl.LazyFrame)
+        if is_sorted is None:
+            is_sorted = self._is_sorted(X)
+
+        # -- filter data, but keep information on number of rows prior to
+        # filtration. Filtering happens before going lazy so that the filter
+        # method receives the same type of frame as was passed in
+        X_filtered = None
+        is_filtered_sorted = False
+        if self.filter_data_method is not None and not isinstance(
+            self.filter_data_method, pl.Expr
+        ):
+            X_filtered = self.filter_data_method(X)
+            is_filtered_sorted = self._is_sorted(X_filtered)
+            X_filtered = X_filtered.lazy()
+
+        df_agg = self._transform(
+            X.lazy(),
+            X_filtered,
+            defer_partial_data_check=is_lazy,
+            is_sorted=is_sorted,
+            is_filtered_sorted=is_filtered_sorted,
+            frequency=frequency,
+        )
+
+        if is_lazy:
+            return df_agg
+
+        df_agg = df_agg.collect()
+        if (
+            self.partial_data_resolution_strategy
+            == PartialDataResolutionStrategy.FAIL
+        ):
+            self._check_for_partial_data(df_agg["_is_partial"])
+
+        return df_agg
+
+    def _is_sorted(self, X: pl.DataFrame | pl.LazyFrame) -> bool:
+        """Checks if the time column is known to be sorted, either because
+        `assume_sorted` or `sorted_within_groups` is set or because Polars
+        has flagged it as sorted. Only the flag is read, so this does not
+        scan the data.
+
+        :param X: dataframe or LazyFrame
+        :return: True if the time column is sorted in ascending order,
+            within each group if `group_by_columns` is provided
+        """
+        if self.assume_sorted or self.sorted_within_groups:
+            return True
+
+        if isinstance(X, pl.LazyFrame):
+            return False
+
+        return X[self.time_column].flags["SORTED_ASC"]
+
+    def _check_for_partial_data(self, is_partial: pl.Series) -> pl.Series:
+        if is_partial.any():
+            _supported_values = sorted(
+                value
+                for value in (PartialDataResolutionStrategy.supported_values())
+                if value != PartialDataResolutionStrategy.FAIL
+            )
+            raise ValueError(
+                (
+                    "Detected partial data. If you wish to "
+                    "proceed then set your "
+                    "`partial_data_resolution_strategy` "
+                    f"to one of {_supported_values}"
+                )
+            )
+
+        return is_partial
+
+    def _check_for_partial_data_mask(self, is_partial: pl.Series) -> pl.Series:
+        """Checks for partial data, returning a mask keeping every row."""
+        self._check_for_partial_data(is_partial)
+
+        return pl.Series(np.ones(len(is_partial), dtype=bool))
+
+    def _transform(
+        self,
+        X: pl.LazyFrame,
+        X_filtered: pl.LazyFrame | None = None,
+        defer_partial_data_check: bool = True,
+        is_sorted: bool = False,
+        is_filtered_sorted: bool = False,
+        frequency: pl.DataFrame | None = None,
+    ) -> pl.LazyFrame:
+        is_filtered = X_filtered is not None
+        mask_column = None
+        if is_filtered:
+            df_agg_non_filtered = self._groupby(X, is_sorted).agg(
                 [
                     pl.col(self.time_column)
                     .unique()
@@ -744,71 +2540,140 @@ class ResampleData(BaseEstimator, TransformerMixin):
                     .alias("_unique_timestamp_count_non_filtered")
                 ]
             )
-
-            X = self.filter_data_method(X)
+        elif isinstance(self.filter_data_method, pl.Expr):
+            # -- single pass: filtered rows are masked rather than removed,
+            # so the unique timestamp count is over the unfiltered data
+            mask_column = "_keep"
+            while mask_column in X.columns:
+                # -- avoid overwriting a user column of the same name
+                mask_column = f"_{mask_column}"
+            X_filtered = X.with_columns(
+                self.filter_data_method.fill_null(False).alias(mask_column)
+            )
+            is_filtered_sorted = is_sorted
+        else:
+            X_filtered = X
+            is_filtered_sorted = is_sorted
 
         # -- group by and aggregate
-        df_agg = self._aggregate(X)
+        df_agg = self._aggregate(X_filtered, mask_column, is_filtered_sorted)
 
         if (
             self.partial_data_resolution_strategy
             != PartialDataResolutionStrategy.KEEP
         ):
-            df_agg = df_agg.with_columns(
-                pl.col("_upper_boundary")
-                .sub(pl.col("_lower_boundary"))
-                .alias("_date_diff")
-                .dt.total_seconds()
-                .truediv(frequency)
-            )
+            if frequency is None:
+                frequency = self._detect_frequency(X, is_sorted)
 
-            if self.filter_data_method is not None:
-                df_agg = df_agg.join(df_agg_non_filtered, on=self.time_column)
+            if is_filtered:
+                df_agg = df_agg.join(
+                    df_agg_non_filtered,
+                    on=[*(self.group_by_columns or []), self.time_column],
+                )
                 df_agg = df_agg.with_columns(
                     pl.col("_unique_timestamp_count_non_filtered").alias(
                         "_unique_timestamp_count"
                     )
                 )
 
-            df_agg = df_agg.with_columns(
-                pl.col("_unique_timestamp_count")
-                .lt(pl.col("_date_diff"))
-                .alias("_is_partial")
+            df_agg = self._resolve_partial_data(
+                df_agg, frequency, defer_partial_data_check
             )
 
-            match self.partial_data_resolution_strategy:
-                case PartialDataResolutionStrategy.FAIL:
-                    if df_agg["_is_partial"].any():
-                        _supported_values = sorted(
-                            value
-                            for value in (
-                                PartialDataResolutionStrategy.supported_values()
-                            )
-                            if value != PartialDataResolutionStrategy.FAIL
-                        )
-                        raise ValueError(
-                            (
-                                "Detected partial data. If you wish to "
-                                "proceed then set your "
-                                "`partial_data_resolution_strategy` "
-                                f"to one of {_supported_values}"
-                            )
+        return df_agg
+
+    def _detect_frequency(
+        self, X: pl.LazyFrame, is_sorted: bool = False
+    ) -> pl.LazyFrame:
+        """Detects the frequency of the data as the most common difference
+        between consecutive timestamps. If `group_by_columns` is provided the
+        frequency is detected for each group in a single aggregation, since
+        groups (e.g. devices) may be sampled at different frequencies.
+
+        :param X: data
+        :param is_sorted: whether the time column is sorted in ascending
+            order, within each group if `group_by_columns` is provided
+        :return: frequency in seconds as `_frequency`, for each group if
+            `group_by_columns` is provided
+        """
+        frequency = timeseries_frequency_expression(
+            self.time_column, "mode", is_sorted=is_sorted
+        ).alias("_frequency")
+        if self.group_by_columns:
+            return X.group_by(self.group_by_columns).agg(frequency)
+
+        return X.select(frequency)
+
+    def _resolve_partial_data(
+        self,
+        df_agg: pl.LazyFrame,
+        frequency: pl.LazyFrame | pl.DataFrame,
+        defer_partial_data_check: bool = True,
+    ) -> pl.LazyFrame:
+        """Flags resampled windows with partial data and applies the
+        `partial_data_resolution_strategy`.
+
+        :param df_agg: resampled data, with window boundaries and the
+            `_unique_timestamp_count` of each window
+        :param frequency: frequency of the data in seconds as `_frequency`,
+            a single row or a row for each group if `group_by_columns` is
+            provided
+        :param defer_partial_data_check: if True, the `fail` strategy check
+            is added to the query instead of being left to the caller
+        :return: resampled data with partial data resolved
+        """
+        if self.group_by_columns:
+            df_agg = df_agg.join(
+                frequency.lazy(),
+                on=self.group_by_columns,
+                how="left",
+                join_nulls=True,
+            )
+        else:
+            df_agg = df_agg.join(frequency.lazy(), how="cross")
+
+        df_agg = df_agg.with_columns(
+            pl.col("_upper_boundary")
+            .sub(pl.col("_lower_boundary"))
+            .alias("_date_diff")
+            .dt.total_seconds()
+            .truediv(pl.col("_frequency"))
+        ).drop("_frequency")
+
+        df_agg = df_agg.with_columns(
+            pl.col("_unique_timestamp_count")
+            .lt(pl.col("_date_diff"))
+            .alias("_is_partial")
+        )
+
+        match self.partial_data_resolution_strategy:
+            case PartialDataResolutionStrategy.FAIL:
+                # -- check runs when the query is collected. It is a filter
+                # keeping every row rather than a column, so that it is not
+                # dropped by projection pushdown when `_is_partial` is not
+                # selected
+                if defer_partial_data_check:
+                    df_agg = df_agg.filter(
+                        pl.col("_is_partial").map_batches(
+                            self._check_for_partial_data_mask
                         )
-                case PartialDataResolutionStrategy.DROP:
-                    df_agg = df_agg.filter(~pl.col("_is_partial"))
-                case PartialDataResolutionStrategy.NULL:
-                    columns_to_set_to_null = [
-                        col
-                        for col in df_agg.columns
-                        if not col.startswith("_") and col != "date"
-                    ]
-                    df_agg = df_agg.with_columns(
-                        [
-                            pl.when(~pl.col("_is_partial"))
-                            .then(pl.col(columns_to_set_to_null))
-                            .keep_name()
-                        ]
                     )
+            case PartialDataResolutionStrategy.DROP:
+                df_agg = df_agg.filter(~pl.col("_is_partial"))
+            case PartialDataResolutionStrategy.NULL:
+                columns_to_set_to_null = [
+                    col
+                    for col in df_agg.columns
+                    if not col.startswith("_") and col != "date"
+                ]
+                df_agg = df_agg.with_columns(
+                    [
+                        pl.when(~pl.col("_is_partial"))
+                        .then(pl.col(columns_to_set_to_null))
+                        .keep_name()
+                    ]
+                )
+
         return df_agg
 
     def inverse_transform(
@@ -817,6 +2682,26 @@ class ResampleData(BaseEstimator, TransformerMixin):
         pass
 
 
+def _resample_partition(
+    resampler: ResampleData,
+    X: pl.DataFrame | pl.LazyFrame,
+) -> pl.DataFrame:
+    """Resamples a single partition. Defined at module level so it can be
+    sent to worker processes.
+
+    :param resampler: resampler to use
+    :param X: partition of data
+    :return: resampled partition, None if the partition is empty
+    """
+    if isinstance(X, pl.LazyFrame):
+        X = X.collect()
+
+    if X.is_empty():
+        return None
+
+    return resampler._resample(X)
+
+
 if __name__ == "__main__":
     df = pl.DataFrame(
         {
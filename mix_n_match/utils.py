@@ -1,6 +1,12 @@
 from __future__ import annotations
 
-from typing import List, Tuple
+import calendar
+import functools
+import numbers
+import re
+from datetime import datetime, timedelta
+from typing import Iterator, List, Tuple
+from zoneinfo import ZoneInfo
 
 import numpy as np
 import polars as pl
@@ -13,17 +19,114 @@ import polars as pl
 # POLARS_TO_TIME_UNIT_MAPPING = {"m": MINUTE}
 
 
+DURATION_UNIT_TO_MONTHS = {"mo": 1, "q": 3, "y": 12}
+DURATION_UNIT_TO_NANOSECONDS = {
+    "ns": 1,
+    "us": 10**3,
+    "ms": 10**6,
+    "s": 10**9,
+    "m": 60 * 10**9,
+    "h": 3600 * 10**9,
+    "d": 86400 * 10**9,
+    "w": 7 * 86400 * 10**9,
+}
+
+
+@functools.total_ordering
 class PolarsDuration:
     """Class for working with polars string durations. This is created since as
     of 27.11.2023 there is no native support in polars for converting string
     durations into time components.
 
-    :param duration: Polars string duration, e.g. "1w"
+    Durations are stored as a number of calendar months and a number of
+    nanoseconds, so they can be added, multiplied and compared without
+    going through strings. Strings are parsed when adding or subtracting,
+    but are never equal to a duration. Durations are only ordered when they
+    differ in either months or nanoseconds, since months have no fixed
+    length. Arithmetic returns durations, whose string form (see `str`) is
+    normalised, e.g. "1d" for 24 hours.
+
+    The `duration` attribute and `decomposed_duration` keep the duration as
+    it was given, e.g. "24h" and [(24, "h")]. Durations built from months
+    and nanoseconds use the normalised string.
+
+    :param duration: Polars string duration, e.g. "1w" or "-1d12h"
+    :param months: number of months, used if `duration` is None
+    :param nanoseconds: number of nanoseconds, used if `duration` is None
+    :raises ValueError: if the duration contains units that are not calendar
+        or fixed length units, e.g. "1i"
     """
 
-    def __init__(self, duration: str) -> None:
-        self.duration = duration
-        self.decomposed_duration = self._decompose_duration(duration)
+    __slots__ = ("months", "nanoseconds", "_duration")
+
+    def __init__(
+        self,
+        duration: str | None = None,
+        months: int = 0,
+        nanoseconds: int = 0,
+    ) -> None:
+        if duration is not None:
+            months, nanoseconds = self._parse_duration(duration)
+
+        self.months = months
+        self.nanoseconds = nanoseconds
+        self._duration = duration
+
+    def _parse_duration(self, duration: str) -> tuple[int, int]:
+        """Converts a polars duration string into months and nanoseconds.
+
+        :param duration: polars duration string, e.g. "1mo2d"
+        :return: number of months and number of nanoseconds
+        """
+        sign = -1 if duration.startswith("-") else 1
+        months = 0
+        nanoseconds = 0
+        for multiplier, unit in self._decompose_duration(duration.lstrip("-")):
+            if unit in DURATION_UNIT_TO_MONTHS:
+                months += multiplier * DURATION_UNIT_TO_MONTHS[unit]
+            elif unit in DURATION_UNIT_TO_NANOSECONDS:
+                nanoseconds += multiplier * DURATION_UNIT_TO_NANOSECONDS[unit]
+            else:
+                raise ValueError(
+                    f"Unit `{unit}` in duration `{duration}` is not "
+                    "supported. Supported units: "
+                    f"{[*DURATION_UNIT_TO_MONTHS, *DURATION_UNIT_TO_NANOSECONDS]}"  # noqa: B950
+                )
+
+        return sign * months, sign * nanoseconds
+
+    @property
+    def duration(self) -> str:
+        """Polars string duration as it was given, or normalised if the
+        duration was built from months and nanoseconds.
+        """
+        if self._duration is None:
+            return str(self)
+        return self._duration
+
+    @property
+    def decomposed_duration(self) -> List[Tuple[int, str]]:
+        """Time components of `duration`, without sign."""
+        if self._duration is None:
+            return self._get_normalised_components()
+        return self._decompose_duration(self._duration.lstrip("-"))
+
+    def _get_normalised_components(self) -> List[Tuple[int, str]]:
+        """Normalised time components of the duration, without sign."""
+        components = []
+        years, months = divmod(abs(self.months), 12)
+        components.extend([(years, "y"), (months, "mo")])
+
+        nanoseconds = abs(self.nanoseconds)
+        for unit in ["d", "h", "m", "s", "ms", "us", "ns"]:
+            multiplier, nanoseconds = divmod(
+                nanoseconds, DURATION_UNIT_TO_NANOSECONDS[unit]
+            )
+            components.append((multiplier, unit))
+
+        return [
+            (multiplier, unit) for multiplier, unit in components if multiplier
+        ]
 
     def _recompose_duration(
         self, decomposed_duration: List[Tuple[int, str]]
@@ -35,7 +138,7 @@ class PolarsDuration:
 
         Example:
             decomposed = [(1, 'd'), (1, 'h')]
-            PolarsDuration(None)._recompose_duration(decomposed)
+            PolarsDuration()._recompose_duration(decomposed)
             >>> "1d1h"
         """
         duration = ""
@@ -53,7 +156,7 @@ class PolarsDuration:
 
         Example:
             duration = "3d12h4m25s"
-            PolarsDuration(None)._decompose_duration(duration)
+            PolarsDuration()._decompose_duration(duration)
             >>> [
                 (3, "d"),
                 (12, "h"),
@@ -61,46 +164,161 @@ class PolarsDuration:
                 (25, "s"),
             ]
         """
-        multiplier_string = ""
-        time_component = ""
-        components = []
-        for item in duration:
-            is_digit = item.isdigit()
-            if is_digit:
-                if time_component:
-                    components.append((int(multiplier_string), time_component))
-                    multiplier_string = item
-                    time_component = ""
-                else:
-                    multiplier_string += item
-            else:
-                time_component += item
+        return list(decompose_duration(duration))
+
+    def to_timedelta(self) -> timedelta:
+        """Converts the duration to a timedelta, rounded down to
+        microseconds.
 
-        components.append((int(multiplier_string), time_component))
+        :raises ValueError: if the duration contains months
+        :return: duration as a timedelta
+        """
+        self._check_fixed_length("timedelta")
+        return timedelta(microseconds=self.nanoseconds // 1000)
+
+    def to_expression(self) -> pl.Expr:
+        """Converts the duration to a polars duration literal.
+
+        :raises ValueError: if the duration contains months
+        :return: polars expression of the duration in nanoseconds
+        """
+        self._check_fixed_length("polars duration")
+        return pl.duration(nanoseconds=self.nanoseconds, time_unit="ns")
+
+    def _check_fixed_length(self, conversion: str) -> None:
+        if self.months:
+            raise ValueError(
+                f"Can not convert `{self}` to a {conversion} since months "
+                "have no fixed length"
+            )
+
+    def _coerce(self, other) -> "PolarsDuration":
+        if isinstance(other, str):
+            return PolarsDuration(other)
+        return other
+
+    def __add__(self, other: "PolarsDuration | str") -> "PolarsDuration":
+        other = self._coerce(other)
+        if not isinstance(other, PolarsDuration):
+            return NotImplemented
+        return PolarsDuration(
+            months=self.months + other.months,
+            nanoseconds=self.nanoseconds + other.nanoseconds,
+        )
+
+    __radd__ = __add__
 
-        return components
+    def __neg__(self) -> "PolarsDuration":
+        return PolarsDuration(
+            months=-self.months, nanoseconds=-self.nanoseconds
+        )
+
+    def __sub__(self, other: "PolarsDuration | str") -> "PolarsDuration":
+        other = self._coerce(other)
+        if not isinstance(other, PolarsDuration):
+            return NotImplemented
+        return self + -other
+
+    def __rsub__(self, other: "PolarsDuration | str") -> "PolarsDuration":
+        return -self + other
 
-    def __mul__(self, multiply_by: int) -> str:
-        """Method to enble multiplication of a polars duration string by some
+    def __mul__(self, multiply_by: numbers.Integral) -> "PolarsDuration":
+        """Method to enble multiplication of a polars duration by some
         integer.
 
         :param multiply_by: integer to multiply by
-        :return: polars duration multiplied by value returned as a string
+        :return: polars duration multiplied by value
 
         Example:
             duration = "1d"
             pl_duration = PolarsDuration(duration)
-            pl_duration * 5
+            str(pl_duration * 5)
             >>> "5d"
         """
-        decomposed_duration = [
-            (multiplier * multiply_by, unit)
-            for multiplier, unit in self.decomposed_duration
-        ]
+        if not isinstance(multiply_by, numbers.Integral):
+            return NotImplemented
+        multiply_by = int(multiply_by)
+        return PolarsDuration(
+            months=self.months * multiply_by,
+            nanoseconds=self.nanoseconds * multiply_by,
+        )
 
-        # TODO should it return the class here???
-        # E.g. PolarsDuration(self._recompose_duration(decomposed_duration))
-        return self._recompose_duration(decomposed_duration)
+    __rmul__ = __mul__
+
+    # -- equality and ordering do not parse strings, so that equal durations
+    # always have equal hashes
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, PolarsDuration):
+            return NotImplemented
+        return (self.months, self.nanoseconds) == (
+            other.months,
+            other.nanoseconds,
+        )
+
+    def __lt__(self, other: "PolarsDuration") -> bool:
+        if not isinstance(other, PolarsDuration):
+            return NotImplemented
+
+        months = self.months - other.months
+        nanoseconds = self.nanoseconds - other.nanoseconds
+        if months and nanoseconds and (months > 0) != (nanoseconds > 0):
+            raise TypeError(
+                f"Can not compare `{self}` and `{other}` since months have "
+                "no fixed length"
+            )
+        return months < 0 or nanoseconds < 0
+
+    def __hash__(self) -> int:
+        return hash((self.months, self.nanoseconds))
+
+    def __str__(self) -> str:
+        """Polars string form of the duration, e.g. "1y2mo3d".
+
+        :raises ValueError: if months and nanoseconds have different signs,
+            since polars only supports a sign for the whole duration
+        """
+        if self.months * self.nanoseconds < 0:
+            raise ValueError(
+                f"Can not represent {self.months} months and "
+                f"{self.nanoseconds} nanoseconds as a polars duration"
+            )
+
+        duration = self._recompose_duration(self._get_normalised_components())
+        if not duration:
+            return "0ns"
+        if self.months < 0 or self.nanoseconds < 0:
+            return f"-{duration}"
+        return duration
+
+    def __repr__(self) -> str:
+        return (
+            f"PolarsDuration(months={self.months}, "
+            f"nanoseconds={self.nanoseconds})"
+        )
+
+
+DURATION_REGEX = re.compile(r"(?:\d+\D+)+")
+DURATION_COMPONENT_REGEX = re.compile(r"(\d+)(\D+)")
+
+
+@functools.lru_cache(maxsize=4096)
+def decompose_duration(duration: str) -> tuple[tuple[int, str], ...]:
+    """Decomposes a Polars duration string into its time components. Results
+    are cached since the same durations are parsed every time a transformer
+    is built.
+
+    :param duration: polars duration string, e.g. "3d12h"
+    :raises ValueError: if the duration is not a sequence of integers
+        followed by units
+    :return: time components of the duration, e.g. ((3, "d"), (12, "h"))
+    """
+    if not DURATION_REGEX.fullmatch(duration):
+        raise ValueError(f"Invalid duration `{duration}`")
+
+    return tuple(
+        (int(multiplier), unit)
+        for multiplier, unit in DURATION_COMPONENT_REGEX.findall(duration)
+    )
 
 
 def detect_timeseries_frequency(
@@ -129,7 +347,9 @@ def detect_timeseries_frequency(
 
     # -- need to sort the time column, AND drop duplicates
     diff = df.select(
-        pl.col(time_column).unique().sort().diff(null_behavior="drop")
+        unique_timestamp_diff_expression(
+            time_column, df[time_column].flags["SORTED_ASC"]
+        )
     )
     frequency = getattr(diff[time_column], frequency_detector)()
 
@@ -156,6 +376,341 @@ def detect_timeseries_frequency(
     return frequency.total_seconds()
 
 
+def unique_timestamp_diff_expression(
+    time_column: str, is_sorted: bool = False
+) -> pl.Expr:
+    """Differences between consecutive unique timestamps. If the column is
+    already sorted then the duplicates are the zero differences, so they are
+    filtered out instead of running a unique and a sort.
+
+    :param time_column: time series column
+    :param is_sorted: whether the time column is sorted in ascending order
+    :return: expression of the differences
+    """
+    if not is_sorted:
+        return pl.col(time_column).unique().sort().diff(null_behavior="drop")
+
+    diff = pl.col(time_column).diff(null_behavior="drop")
+    return diff.filter(diff.dt.total_nanoseconds() != 0)
+
+
+def timeseries_frequency_expression(
+    time_column: str, how: str = "mode", is_sorted: bool = False
+) -> pl.Expr:
+    """Expression equivalent of `detect_timeseries_frequency`, for use
+    inside lazy queries where the frequency should not be collected eagerly.
+
+    :param time_column: time series column
+    :param how: strategy for calculating frequency. If `mode` then detects
+        frequency as the most commonly occurring difference between
+        consecutive timestamps (the smallest one is taken if there are
+        several), if `max` then detects frequency as the maximum occuring
+        difference, defaults to "mode"
+    :param is_sorted: whether the time column is sorted in ascending order,
+        defaults to False
+    :return: expression aggregating to the detected frequency in seconds
+
+    Example:
+        df.lazy().select(timeseries_frequency_expression("date"))
+    """
+    SUPPORTED_METHODS = {"mode", "max"}
+    if how not in SUPPORTED_METHODS:
+        raise ValueError(
+            f"Expected `how` in {sorted(SUPPORTED_METHODS)}. Got `{how}`"
+        )
+
+    diff = unique_timestamp_diff_expression(time_column, is_sorted)
+    if how == "mode":
+        frequency = diff.mode().min()
+    else:
+        frequency = diff.max()
+
+    return frequency.dt.total_nanoseconds() / 10**9
+
+
+def iterate_in_chunks(
+    lazy_df: pl.LazyFrame, chunk_size: int
+) -> Iterator[pl.DataFrame]:
+    """Reads a LazyFrame in consecutive slices of rows, so that the data
+    never has to be in memory all at once. For scans (e.g. `pl.scan_parquet`)
+    the slice is pushed down to the reader.
+
+    :param lazy_df: LazyFrame to read
+    :param chunk_size: number of rows per chunk
+    :yield: chunks as dataframes, in order
+    """
+    offset = 0
+    while True:
+        chunk = lazy_df.slice(offset, chunk_size).collect()
+        if chunk.is_empty():
+            break
+
+        yield chunk
+        offset += chunk_size
+
+
+def _sweep_intervals(
+    interval_sets: List[np.ndarray], min_count: int
+) -> np.ndarray:
+    """Sweeps over the boundaries of sets of half open intervals, returning
+    the intervals covered by at least `min_count` of them.
+
+    :param interval_sets: arrays of shape (n, 2) of [start, end) intervals
+    :param min_count: minimum number of intervals covering a point
+    :return: sorted, non-overlapping and non-adjacent intervals
+    """
+    intervals = np.concatenate(
+        [np.empty((0, 2), dtype=np.int64), *interval_sets]
+    )
+    points = np.concatenate([intervals[:, 0], intervals[:, 1]])
+    deltas = np.concatenate(
+        [
+            np.ones(len(intervals), dtype=np.int64),
+            -np.ones(len(intervals), dtype=np.int64),
+        ]
+    )
+
+    # -- starts are processed before ends at the same point, so adjacent
+    # intervals are merged
+    order = np.lexsort((-deltas, points))
+    points = points[order]
+    is_covered = np.cumsum(deltas[order]) >= min_count
+    was_covered = np.concatenate([[False], is_covered[:-1]])
+
+    merged = np.stack(
+        [
+            points[is_covered & ~was_covered],
+            points[~is_covered & was_covered],
+        ],
+        axis=1,
+    )
+
+    return merged[merged[:, 0] < merged[:, 1]]
+
+
+def union_intervals(interval_sets: List[np.ndarray]) -> np.ndarray:
+    """Union of sets of half open intervals.
+
+    :param interval_sets: arrays of shape (n, 2) of [start, end) intervals
+    :return: sorted and merged intervals
+
+    Example:
+        union_intervals([np.array([[0, 5], [8, 9]]), np.array([[5, 6]])])
+        >>> np.array([[0, 6], [8, 9]])
+    """
+    return _sweep_intervals(interval_sets, 1)
+
+
+def intersect_intervals(interval_sets: List[np.ndarray]) -> np.ndarray:
+    """Intersection of sets of half open intervals.
+
+    :param interval_sets: arrays of shape (n, 2) of [start, end) intervals
+    :return: sorted and merged intervals
+
+    Example:
+        intersect_intervals([np.array([[0, 5], [8, 9]]), np.array([[4, 8]])])
+        >>> np.array([[4, 5]])
+    """
+    # -- merge each set first, so overlaps within a set are counted once
+    interval_sets = [
+        union_intervals([intervals]) for intervals in interval_sets
+    ]
+
+    return _sweep_intervals(interval_sets, len(interval_sets))
+
+
+def complement_intervals(
+    intervals: np.ndarray, start: int, end: int
+) -> np.ndarray:
+    """Complement of sorted, non-overlapping half open intervals within the
+    domain [start, end).
+
+    :param intervals: sorted, non-overlapping intervals of shape (n, 2), as
+        returned by `union_intervals`
+    :param start: start of the domain
+    :param end: end of the domain
+    :return: sorted intervals covering the domain where `intervals` do not
+
+    Example:
+        complement_intervals(np.array([[2, 4], [6, 10]]), 0, 10)
+        >>> np.array([[0, 2], [4, 6]])
+    """
+    boundaries = np.concatenate([[start], intervals.ravel(), [end]])
+    complement = boundaries.reshape(-1, 2)
+
+    return complement[complement[:, 0] < complement[:, 1]]
+
+
+def is_in_intervals_expression(
+    expression: pl.Expr, intervals: np.ndarray
+) -> pl.Expr:
+    """Expression checking if values fall in sorted, non-overlapping half
+    open intervals, with a single binary search per value.
+
+    :param expression: integer expression to check
+    :param intervals: sorted, non-overlapping intervals of shape (n, 2), as
+        returned by `union_intervals`
+    :return: boolean expression, True if the value is in an interval
+    """
+    if len(intervals) == 0:
+        return pl.lit(False)
+
+    boundaries = pl.Series(intervals.ravel(), dtype=pl.Int64)
+
+    # -- values are within an interval if an odd number of boundaries is
+    # less than or equal to them
+    return pl.lit(boundaries).search_sorted(expression, side="right") % 2 == 1
+
+
+@functools.lru_cache(maxsize=None)
+def get_utc_offset_transitions(
+    time_zone: str, start_year: int = 1970, end_year: int = 2100
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds the instants at which the UTC offset of a time zone changes
+    (e.g. daylight saving time), to the second. Offsets before `start_year`
+    and after `end_year` are assumed to stay as they were at those years.
+    Results are cached.
+
+    :param time_zone: IANA time zone, e.g. "Europe/Brussels"
+    :param start_year: first year to search, defaults to 1970
+    :param end_year: year to search until, defaults to 2100
+    :return: instants of the transitions in nanoseconds since the epoch,
+        and the UTC offsets in nanoseconds, with one more offset than
+        transitions: the offset at index `i` applies before transition `i`
+
+    Example:
+        transitions, offsets = get_utc_offset_transitions("Europe/Brussels")
+        offsets[np.searchsorted(transitions, timestamp, side="right")]
+        >>> 3600000000000  # offset at timestamp, in winter
+    """
+    zone = ZoneInfo(time_zone)
+
+    def _get_offset(timestamp: int) -> int:
+        offset = datetime.fromtimestamp(timestamp, zone).utcoffset()
+        return int(offset.total_seconds())
+
+    day = 86_400
+    start = calendar.timegm((start_year, 1, 1, 0, 0, 0))
+    end = calendar.timegm((end_year, 1, 1, 0, 0, 0))
+
+    transitions = []
+    offsets = [_get_offset(start)]
+    for day_start in range(start, end, day):
+        offset = _get_offset(day_start + day)
+        if offset == offsets[-1]:
+            continue
+
+        # -- binary search for the first second with the new offset,
+        # assuming at most one transition a day
+        low, high = day_start, day_start + day
+        while high - low > 1:
+            middle = (low + high) // 2
+            if _get_offset(middle) == offsets[-1]:
+                low = middle
+            else:
+                high = middle
+
+        transitions.append(high)
+        offsets.append(offset)
+
+    transitions = np.array(transitions, dtype=np.int64) * 10**9
+    offsets = np.array(offsets, dtype=np.int64) * 10**9
+
+    # -- results are cached, so they must not be modified
+    transitions.flags.writeable = False
+    offsets.flags.writeable = False
+
+    return transitions, offsets
+
+
+class PrefixSumWindows:
+    """Class for computing the count and sums of values over many windows of
+    a sorted key. Cumulative sums are computed once, after which the sums of
+    any window are the difference of two cumulative sums, found with
+    `np.searchsorted`. Differences of cumulative sums lose the precision of
+    values far from zero, so values with a large mean should be centred
+    first.
+
+    :param keys: sorted keys, e.g. timestamps as integer nanoseconds
+    :param values: values to sum, of shape (n,) or (n, number_of_columns)
+    :raises ValueError: if the keys are not sorted, or do not match the
+        number of values
+
+    Example:
+        windows = PrefixSumWindows(np.array([0, 1, 2, 5]), np.ones(4))
+        windows.window_sums(np.array([0, 2]), np.array([2, 6]))
+        >>> (array([2, 2]), array([2., 2.]))
+    """
+
+    CLOSED_OPTIONS = {"left", "right", "both", "none"}
+
+    def __init__(self, keys: np.ndarray, values: np.ndarray) -> None:
+        if len(keys) != len(values):
+            raise ValueError(
+                f"Got {len(keys)} keys but {len(values)} values, expected "
+                "one key for each value"
+            )
+        if np.any(keys[1:] < keys[:-1]):
+            raise ValueError("`keys` must be sorted in ascending order")
+
+        self.keys = keys
+        self.prefix_sums = np.concatenate(
+            [np.zeros((1, *values.shape[1:])), np.cumsum(values, axis=0)]
+        )
+
+    def window_indices(
+        self, lower: np.ndarray, upper: np.ndarray, closed: str = "left"
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Finds the first and one past the last index of each window.
+
+        :param lower: lower bound of each window
+        :param upper: upper bound of each window
+        :param closed: which bounds are included, one of `left` ([lower,
+            upper)), `right` ((lower, upper]), `both` or `none`. Defaults to
+            `left`
+        :raises ValueError: if `closed` is not a valid option
+        :return: start and end indices of each window
+        """
+        if closed not in self.CLOSED_OPTIONS:
+            raise ValueError(
+                f"Got closed `{closed}`, expected one of "
+                f"{sorted(self.CLOSED_OPTIONS)}"
+            )
+
+        starts = np.searchsorted(
+            self.keys,
+            lower,
+            side="left" if closed in {"left", "both"} else "right",
+        )
+        ends = np.searchsorted(
+            self.keys,
+            upper,
+            side="right" if closed in {"right", "both"} else "left",
+        )
+
+        return starts, np.maximum(starts, ends)
+
+    def window_sums(
+        self, lower: np.ndarray, upper: np.ndarray, closed: str = "left"
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Computes the count and sums of the values in each window.
+
+        :param lower: lower bound of each window
+        :param upper: upper bound of each window
+        :param closed: which bounds are included, see `window_indices`.
+            Defaults to `left`
+        :return: number of values and sums of the values in each window
+        """
+        starts, ends = self.window_indices(lower, upper, closed=closed)
+
+        # -- np.take is much faster than fancy indexing on 2D arrays
+        sums = np.take(self.prefix_sums, ends, axis=0) - np.take(
+            self.prefix_sums, starts, axis=0
+        )
+
+        return ends - starts, sums
+
+
 # only get contiguous segments of a specific length
 def find_contiguous_segments(
     array: np.array,
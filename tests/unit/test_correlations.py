@@ -1,6 +1,17 @@
+import itertools
 import unittest
 
-from mix_n_match.correlations import pair_data
+import numpy as np
+import polars as pl
+
+from mix_n_match.correlations import (
+    VARIOGRAM_MODELS,
+    calculate_spatial_variogram,
+    calculate_variogram,
+    count_pairs,
+    fit_variogram,
+    pair_data,
+)
 
 
 class TestCorrelations(unittest.TestCase):
@@ -57,6 +68,379 @@ class TestCorrelations(unittest.TestCase):
         expected_list = [((1, 0), 2, 1)]
         assert output_list == expected_list
 
+    def test_pair_data_ranges(self):
+        items = ["a", "b", "c", "d"]
+        for method, ignore_diagonal in itertools.product(
+            ["full", "upper", "lower"], [False, True]
+        ):
+            pairs = list(pair_data(items, method, ignore_diagonal))
+            assert len(pairs) == count_pairs(4, method, ignore_diagonal)
+            for (i, j), item1, item2 in pairs:
+                assert (item1, item2) == (items[i], items[j])
+                assert i != j or not ignore_diagonal
+                assert method != "upper" or i <= j
+                assert method != "lower" or i >= j
+
+            # -- shards cover all pairs in order
+            shards = [
+                list(
+                    pair_data(
+                        iter(items), method, ignore_diagonal, start, stop
+                    )
+                )
+                for start, stop in [(0, 3), (3, 5), (5, None)]
+            ]
+            assert list(itertools.chain(*shards)) == pairs
+
+        with self.assertRaises(ValueError):
+            count_pairs(4, "diagonal")
+
+    def test_calculate_variogram(self):
+        rng = np.random.default_rng(0)
+        seconds = np.sort(rng.choice(200 * 3600, 200, replace=False))
+        values = rng.normal(size=200)
+        lazy_df = pl.LazyFrame(
+            {
+                "date": pl.Series(seconds * 10**6).cast(pl.Datetime("us")),
+                "value": values,
+            }
+        )
+
+        variogram = calculate_variogram(
+            lazy_df, "date", 5, "1h", "30m"
+        ).collect()
+
+        assert variogram.get_column("lags").to_list() == [
+            "1h",
+            "2h",
+            "3h",
+            "4h",
+            "5h",
+        ]
+
+        # -- pairs at a distance in (0, lag + delta]
+        distances = seconds[None, :] - seconds[:, None]
+        differences = (values[None, :] - values[:, None]) ** 2
+        expected = [
+            0.5
+            * differences[
+                (distances > 0) & (distances <= lag * 3600 + 1800)
+            ].mean()
+            / values.var(ddof=1)
+            for lag in range(1, 6)
+        ]
+        np.testing.assert_allclose(
+            variogram.get_column("date").to_numpy(), expected
+        )
+
+        # -- multiple columns, with nulls excluded per column
+        other_values = np.where(values > 1, np.nan, rng.normal(size=200))
+        variogram_with_nulls = calculate_variogram(
+            lazy_df.with_columns(
+                pl.Series("other", other_values).fill_nan(None)
+            ),
+            "date",
+            5,
+            "1h",
+            "30m",
+        ).collect()
+        assert variogram_with_nulls.columns == [
+            "lags",
+            "date_value",
+            "date_other",
+        ]
+        np.testing.assert_allclose(
+            variogram_with_nulls.get_column("date_value").to_numpy(), expected
+        )
+
+        differences = (other_values[None, :] - other_values[:, None]) ** 2
+        expected = [
+            0.5
+            * np.nanmean(
+                differences[(distances > 0) & (distances <= lag * 3600 + 1800)]
+            )
+            / np.nanvar(other_values, ddof=1)
+            for lag in range(1, 6)
+        ]
+        np.testing.assert_allclose(
+            variogram_with_nulls.get_column("date_other").to_numpy(), expected
+        )
+
+        # -- numeric directions
+        variogram = calculate_variogram(
+            lazy_df.with_columns(pl.Series("date", seconds / 3600)),
+            "date",
+            5,
+            1,
+            0.5,
+        ).collect()
+        assert variogram.get_column("lags").to_list() == [1, 2, 3, 4, 5]
+        np.testing.assert_allclose(
+            variogram.get_column("date").to_numpy(),
+            variogram_with_nulls.get_column("date_value").to_numpy(),
+        )
+
+        with self.assertRaises(ValueError):
+            calculate_variogram(
+                lazy_df.with_columns(pl.Series("date", seconds)),
+                "date",
+                5,
+                "1h",
+                "30m",
+            )
+
+    def test_calculate_variogram_with_large_offset(self):
+        # -- a constant offset does not change the differences of values
+        rng = np.random.default_rng(0)
+        keys = np.sort(rng.choice(30000, 3000, replace=False))
+        values = rng.normal(size=3000)
+        lazy_df = pl.LazyFrame({"key": keys, "value": values})
+
+        variogram = calculate_variogram(
+            lazy_df, "key", 10, 5, 2.5, normalise=False
+        ).collect()
+        offset_variogram = calculate_variogram(
+            lazy_df.with_columns(pl.col("value") + 1e6),
+            "key",
+            10,
+            5,
+            2.5,
+            normalise=False,
+        ).collect()
+        np.testing.assert_allclose(
+            offset_variogram.get_column("key").to_numpy(),
+            variogram.get_column("key").to_numpy(),
+            rtol=1e-9,
+        )
+
+        # -- with several columns, nulls and exact lags on irregular keys
+        other_values = np.where(values > 1, np.nan, rng.normal(size=3000))
+        lazy_df = lazy_df.with_columns(
+            pl.Series("other", other_values).fill_nan(None)
+        )
+        for delta in [2.5, None]:
+            variogram = calculate_variogram(
+                lazy_df, "key", 10, 5, delta, normalise=False
+            ).collect()
+            offset_variogram = calculate_variogram(
+                lazy_df.with_columns(
+                    pl.col("value") + 1e6, pl.col("other") - 1e6
+                ),
+                "key",
+                10,
+                5,
+                delta,
+                normalise=False,
+            ).collect()
+            for col in ["key_value", "key_other"]:
+                np.testing.assert_allclose(
+                    offset_variogram.get_column(col).to_numpy(),
+                    variogram.get_column(col).to_numpy(),
+                    rtol=1e-9,
+                )
+
+    def test_calculate_exact_variogram(self):
+        rng = np.random.default_rng(0)
+        hours = np.sort(rng.choice(300, 200, replace=False))
+        values = rng.normal(size=200)
+        lazy_df = pl.LazyFrame(
+            {
+                "date": pl.Series(hours * 3600 * 10**6).cast(
+                    pl.Datetime("us")
+                ),
+                "value": values,
+            }
+        )
+
+        variogram = calculate_variogram(
+            lazy_df, "date", 5, "1h", None
+        ).collect()
+
+        distances = hours[None, :] - hours[:, None]
+        differences = (values[None, :] - values[:, None]) ** 2
+        expected = [
+            0.5 * differences[distances == lag].mean() / values.var(ddof=1)
+            for lag in range(1, 6)
+        ]
+        np.testing.assert_allclose(
+            variogram.get_column("date").to_numpy(), expected
+        )
+
+        # -- integer keys with an integral float lag
+        variogram = calculate_variogram(
+            lazy_df.with_columns(pl.Series("date", hours)),
+            "date",
+            5,
+            1.0,
+            None,
+        ).collect()
+        np.testing.assert_allclose(
+            variogram.get_column("date").to_numpy(), expected
+        )
+
+        # -- integer keys with a fractional lag fall back to matching each
+        # lag
+        variogram = calculate_variogram(
+            lazy_df.with_columns(pl.Series("date", hours * 2)),
+            "date",
+            5,
+            2.5,
+            None,
+        ).collect()
+        expected_fractional = [
+            0.5
+            * differences[2 * distances == 2.5 * lag].mean()
+            / values.var(ddof=1)
+            if (2 * distances == 2.5 * lag).any()
+            else np.nan
+            for lag in range(1, 6)
+        ]
+        np.testing.assert_allclose(
+            variogram.get_column("date").to_numpy(), expected_fractional
+        )
+
+        # -- keys off the lag grid fall back to matching each lag
+        variogram = calculate_variogram(
+            lazy_df.with_columns(pl.Series("date", hours.astype(float))),
+            "date",
+            5,
+            1.0,
+            None,
+        ).collect()
+        np.testing.assert_allclose(
+            variogram.get_column("date").to_numpy(), expected
+        )
+
+    def test_calculate_spatial_variogram(self):
+        rng = np.random.default_rng(0)
+        x = rng.uniform(-50, 50, 300)
+        y = rng.uniform(0, 100, 300)
+        values = np.sin(x / 10) + rng.normal(size=300)
+        lazy_df = pl.LazyFrame({"x": x, "y": y, "value": values})
+
+        variogram = calculate_spatial_variogram(
+            lazy_df, ["x", "y"], 5, 3.0, 1.5
+        ).collect()
+        assert variogram.columns == ["lags", "x_y"]
+
+        # -- pairs at a distance in (0, lag + delta]
+        distances = np.sqrt(
+            (x[None, :] - x[:, None]) ** 2 + (y[None, :] - y[:, None]) ** 2
+        )
+        differences = (values[None, :] - values[:, None]) ** 2
+        expected = [
+            0.5
+            * differences[
+                (distances > 0) & (distances <= lag * 3 + 1.5)
+            ].mean()
+            / values.var(ddof=1)
+            for lag in range(1, 6)
+        ]
+        np.testing.assert_allclose(
+            variogram.get_column("x_y").to_numpy(), expected
+        )
+
+        # -- sampling is reproducible
+        sampled_variograms = [
+            calculate_spatial_variogram(
+                lazy_df,
+                ["x", "y"],
+                5,
+                3.0,
+                1.5,
+                max_pairs=500,
+                random_state=0,
+            ).collect()
+            for _ in range(2)
+        ]
+        assert sampled_variograms[0].equals(sampled_variograms[1])
+        assert not sampled_variograms[0].equals(variogram)
+
+    def test_calculate_spatial_variogram_long_lags(self):
+        # -- largest lag comparable to the extent of the data, with
+        # duplicated points and distances on the edges of the windows
+        rng = np.random.default_rng(1)
+        x = np.round(rng.uniform(0, 20, 500) * 2) / 2
+        y = np.round(rng.uniform(0, 20, 500) * 2) / 2
+        x[:10], y[:10] = x[0], y[0]
+        first = rng.normal(size=500) + x
+        second = rng.normal(size=500)
+        second[rng.random(500) < 0.2] = np.nan
+        lazy_df = pl.LazyFrame(
+            {"x": x, "y": y, "first": first, "second": second}
+        ).with_columns(pl.col("second").fill_nan(None))
+
+        variogram = calculate_spatial_variogram(
+            lazy_df, ["x", "y"], 8, 1.25, 0.5, normalise=False
+        ).collect()
+        assert variogram.columns == ["lags", "x_y_first", "x_y_second"]
+
+        distances = np.sqrt(
+            (x[None, :] - x[:, None]) ** 2 + (y[None, :] - y[:, None]) ** 2
+        )
+        for col, values in [("first", first), ("second", second)]:
+            differences = (values[None, :] - values[:, None]) ** 2
+            expected = [
+                0.5
+                * np.nanmean(
+                    differences[
+                        (distances > 0) & (distances <= lag * 1.25 + 0.5)
+                    ]
+                )
+                for lag in range(1, 9)
+            ]
+            np.testing.assert_allclose(
+                variogram.get_column(f"x_y_{col}").to_numpy(), expected
+            )
+
+    def test_fit_variogram(self):
+        lags = np.arange(1, 31)
+        parameters = [(12.0, 1.5, 0.2), (25.0, 0.8, 0.0)]
+        for model, metadata in VARIOGRAM_MODELS.items():
+            variogram = pl.DataFrame(
+                {
+                    "lags": [f"{lag}h" for lag in lags],
+                    **{
+                        f"value_{index}": nugget
+                        + sill * metadata["callable"](lags, hours)[0]
+                        for index, (hours, sill, nugget) in enumerate(
+                            parameters
+                        )
+                    },
+                }
+            )
+            fitted = fit_variogram(variogram, model, use_nugget=True)
+
+            assert fitted.get_column("converged").all()
+            np.testing.assert_allclose(
+                fitted.select("range", "sill", "nugget").to_numpy(),
+                [
+                    (hours * 3600, sill, nugget)
+                    for hours, sill, nugget in parameters
+                ],
+                atol=1e-6,
+            )
+
+        # -- columns with no semivariances are not fitted
+        fitted = fit_variogram(
+            variogram.with_columns(
+                pl.lit(None, dtype=pl.Float64).alias("value_0")
+            )
+        )
+        assert fitted.row(0, named=True) == {
+            "column": "value_0",
+            "model": "spherical",
+            "range": None,
+            "sill": None,
+            "nugget": None,
+            "rmse": None,
+            "converged": False,
+        }
+        assert fitted.get_column("converged").to_list() == [False, True]
+
+        with self.assertRaises(ValueError):
+            fit_variogram(variogram, "linear")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,4 +1,8 @@
+import datetime
+import os
+import tempfile
 import unittest
+from unittest.mock import patch
 
 import polars as pl
 from polars.testing import assert_frame_equal
@@ -159,6 +163,61 @@ class TestFilterDataBasedOnTime(unittest.TestCase):
 
         assert str(expression) == str(expected_expression)
 
+    def test_generate_lowered_cascade_condition(self):
+        processor = FilterDataBasedOnTime(
+            time_column="date", time_patterns=[">1h"]  # dummy
+        )
+        df = pl.DataFrame(
+            {
+                "date": pl.datetime_range(
+                    pl.datetime(2023, 1, 1),
+                    pl.datetime(2023, 3, 1),
+                    "7m13s",
+                    time_unit="ns",
+                    eager=True,
+                )
+            }
+        )
+        # -- exact boundaries, e.g. 01:00:00, and just past them
+        df = pl.concat(
+            [
+                df,
+                df.select(pl.col("date").dt.truncate("1m")),
+                df.select(
+                    pl.col("date").dt.truncate("1m")
+                    + pl.duration(nanoseconds=1)
+                ),
+            ]
+        )
+
+        # -- lowered conditions match the cascade of child units
+        for unit, value in [
+            ("d", 1),
+            ("d", 15),
+            ("wd", 3),
+            ("h", 0),
+            ("h", 13),
+            ("m", 0),
+            ("m", 30),
+            ("s", 59),
+        ]:
+            lowered = processor._generate_lowered_cascade_condition(
+                unit, value, "gt"
+            )
+            cascade = processor._generate_cascade_condition(unit, value, "gt")
+            assert str(lowered) != str(cascade)
+            assert df.select(
+                (lowered == cascade).all()
+            ).item(), f"{unit}, {value}"
+
+        # -- other operators and units keep the cascade
+        for unit, operator in [("h", "lt"), ("ms", "gt"), ("us", "gt")]:
+            assert str(
+                processor._generate_lowered_cascade_condition(
+                    unit, 1, operator
+                )
+            ) == str(processor._generate_cascade_condition(unit, 1, operator))
+
     def test_filter_data_based_on_time(self):
         df = pl.DataFrame(
             {
@@ -260,6 +319,456 @@ class TestFilterDataBasedOnTime(unittest.TestCase):
             ),
         )
 
+    def test_expression_cache(self):
+        df = pl.DataFrame(
+            {"date": ["2023-01-01 00:00:00", "2023-01-01 02:00:00"]}
+        ).with_columns(pl.col("date").str.strptime(pl.Datetime))
+
+        processor = FilterDataBasedOnTime(
+            time_column="date", time_patterns=[">1h"]
+        )
+        expression = processor.get_expression()
+        assert processor.cache_info()["misses"] == 1
+
+        for _ in range(3):
+            processor.transform(df)
+
+        cache_info = processor.cache_info()
+        assert cache_info["hits"] == 3
+        assert cache_info["misses"] == 1
+        assert cache_info["build_time"] > 0
+        assert processor.get_expression() is expression
+
+        # -- changing the rules rebuilds the expression
+        processor.set_params(time_column="other_date")
+        assert str(processor.get_expression()) != str(expression)
+        assert processor.cache_info()["misses"] == 2
+
+        processor.set_params(time_column="date", time_patterns=["<1h"])
+        df_transformed = processor.transform(df)
+        assert processor.cache_info()["misses"] == 3
+
+        processor.filtering_rules = processor._parse_time_patterns_into_rules(
+            [">1h"]
+        )
+        assert str(processor.get_expression()) == str(expression)
+        assert df_transformed["date"].dt.hour().to_list() == [2]
+
+    def test_shared_time_components(self):
+        df = pl.DataFrame(
+            {
+                "date": pl.datetime_range(
+                    pl.datetime(2023, 1, 1),
+                    pl.datetime(2023, 1, 15),
+                    "37m",
+                    eager=True,
+                )
+            }
+        ).with_columns(pl.col("date").dt.hour().alias("value"))
+
+        time_patterns = ["<6wd<6h", "<6wd>=20h", ">=6wd<8h>=22h", ">1d*<3d"]
+        processor = FilterDataBasedOnTime(
+            time_column="date", time_patterns=time_patterns
+        )
+
+        # -- each unit is extracted once, with the time of day for cascades
+        assert processor._get_required_units() == ["wd", "h", "d", "tod"]
+
+        expected = df.filter(processor.get_expression())
+        assert_frame_equal(processor.transform(df), expected)
+        assert_frame_equal(processor.transform(df.lazy()).collect(), expected)
+
+        processor.set_params(label_data=True)
+        assert_frame_equal(
+            processor.transform(df),
+            df.with_columns(
+                processor.get_expression().alias("_data_to_filter")
+            ),
+        )
+
+        # -- existing columns are never overwritten by time components
+        with self.assertRaises(ValueError):
+            processor.transform(df.rename({"value": "_date_hour"}))
+        with self.assertRaises(ValueError):
+            FilterDataBasedOnTime.combine([processor]).transform(
+                df.rename({"value": "_date_hour"}).lazy()
+            )
+
+    def test_compile_intervals(self):
+        df = pl.DataFrame(
+            {
+                "date": pl.datetime_range(
+                    pl.datetime(2023, 1, 1),
+                    pl.datetime(2023, 1, 16),
+                    "17s",
+                    time_unit="ns",
+                    eager=True,
+                )
+            }
+        )
+        df = pl.concat(
+            [
+                df,
+                df.select(pl.col("date").dt.truncate("1s")),
+                df.select(
+                    pl.col("date").dt.truncate("1s")
+                    + pl.duration(nanoseconds=1)
+                ),
+            ]
+        )
+
+        for time_patterns in [
+            ["<6wd<6h", "<6wd>=20h", ">=6wd<8h>=22h"],
+            [">1h*<8h", "==3wd!=30m"],
+            [">6wd*", "<=1wd>=23h>30m*"],
+            ["==12h==30m>15s*", "!=0h<=5s"],
+        ]:
+            processor = FilterDataBasedOnTime(
+                time_column="date", time_patterns=time_patterns
+            )
+            expected = processor.transform(df)
+
+            processor.set_params(compile_intervals=True)
+            assert_frame_equal(processor.transform(df), expected)
+            assert_frame_equal(df.filter(processor.get_expression()), expected)
+
+        # -- weekdays over a week, hours over a day
+        processor = FilterDataBasedOnTime(
+            time_column="date",
+            time_patterns=["<6wd<6h", "<6wd>=20h"],
+            compile_intervals=True,
+        )
+        intervals = processor._convert_rules_to_intervals() // (
+            3_600 * 10**9
+        )
+        assert intervals.tolist() == [
+            [0, 6],
+            [20, 30],
+            [44, 54],
+            [68, 78],
+            [92, 102],
+            [116, 120],
+        ]
+
+        processor.set_params(time_patterns=[">1h*<8h"])
+        assert processor._get_required_units() == ["tod"]
+        intervals = processor._convert_rules_to_intervals()
+        assert intervals.tolist() == [
+            [3_600 * 10**9 + 1, 8 * 3_600 * 10**9]
+        ]
+
+        # -- unsupported units and too many intervals
+        processor.set_params(time_patterns=["<6d"])
+        with self.assertRaises(ValueError):
+            processor.get_expression()
+
+        processor.set_params(time_patterns=["<6wd!=1s"])
+        with patch.object(
+            FilterDataBasedOnTime, "MAX_COMPILED_INTERVALS", 100
+        ):
+            with self.assertRaises(ValueError):
+                processor.get_expression()
+
+    def test_mask_cache(self):
+        grid = pl.datetime_range(
+            pl.datetime(2023, 1, 1),
+            pl.datetime(2023, 1, 3),
+            "1h",
+            eager=True,
+        )
+        df = pl.DataFrame(
+            {
+                "device_id": [0] * len(grid) + [1] * len(grid),
+                "date": pl.concat([grid, grid]),
+            }
+        )
+
+        for label_data in [False, True]:
+            processor = FilterDataBasedOnTime(
+                time_column="date",
+                time_patterns=[">1h*<8h", "==3wd"],
+                label_data=label_data,
+            )
+            expected = processor.transform(df)
+
+            processor.set_params(mask_cache_size=1_000)
+            assert_frame_equal(processor.transform(df), expected)
+
+            # -- second frame on the same grid is served from the cache
+            assert_frame_equal(processor.transform(df), expected)
+            cache_info = processor.cache_info()
+            assert cache_info["mask_misses"] == len(grid)
+            assert cache_info["mask_hits"] == len(grid)
+            assert cache_info["mask_cache_size"] == len(grid)
+
+        # -- least recently used timestamps are evicted
+        processor.set_params(mask_cache_size=10)
+        processor.transform(df.head(5))
+        processor.transform(df.slice(20, 5))
+        processor.transform(df.slice(40, 5))
+        assert processor.cache_info()["mask_cache_size"] == 10
+        assert (
+            processor._mask_cache["date"].sort().to_list()
+            == pl.concat([grid.slice(20, 5), grid.slice(40, 5)]).to_list()
+        )
+
+        # -- changing the rules clears the cache
+        processor.set_params(time_patterns=[">1h"])
+        assert processor.cache_info()["mask_cache_size"] == 0
+        assert_frame_equal(
+            processor.transform(df),
+            df.with_columns(
+                (pl.col("date").dt.hour() <= 1).alias("_data_to_filter")
+            ),
+        )
+
+    def test_keep(self):
+        df = pl.DataFrame(
+            {
+                "date": pl.datetime_range(
+                    pl.datetime(2023, 1, 1),
+                    pl.datetime(2023, 1, 16),
+                    "17s",
+                    time_unit="ns",
+                    eager=True,
+                )
+            }
+        )
+        df = pl.concat(
+            [
+                df,
+                df.select(pl.col("date").dt.truncate("1s")),
+                df.select(
+                    pl.col("date").dt.truncate("1s")
+                    + pl.duration(nanoseconds=1)
+                ),
+            ]
+        ).with_row_index()
+
+        # -- cascades on milliseconds are not lowered
+        for time_patterns in [
+            ["<6wd<6h", "<6wd>=20h", ">=6wd<8h>=22h"],
+            [">1h*<8h", "==3wd!=30m"],
+            [">6wd*", "<=1wd>=23h>30m*"],
+            ["<=12h*>=30m", ">=1d6h*<=5s*", ">500ms*"],
+        ]:
+            processor = FilterDataBasedOnTime(
+                time_column="date", time_patterns=time_patterns
+            )
+            removed = processor.transform(df)
+            assert "not" not in str(processor.get_expression())
+
+            processor.set_params(keep=True)
+            kept = processor.transform(df)
+            assert_frame_equal(
+                kept, df.join(removed, on="index", how="anti", join_nulls=True)
+            )
+
+            if "d" not in "".join(time_patterns) and "ms" not in "".join(
+                time_patterns
+            ):
+                processor.set_params(compile_intervals=True)
+                assert_frame_equal(processor.transform(df), kept)
+
+                processor.set_params(keep=False)
+                assert_frame_equal(processor.transform(df), removed)
+
+        # -- cascades only apply to >, so <=1h* matches any time up to
+        # 01:59:59 whether the rules are negated or not
+        for keep in [True, False]:
+            for compile_intervals in [True, False]:
+                processor = FilterDataBasedOnTime(
+                    time_column="date",
+                    time_patterns=["<=1h*"],
+                    keep=keep,
+                    compile_intervals=compile_intervals,
+                )
+                expected = df.filter((pl.col("date").dt.hour() <= 1) == keep)
+                assert_frame_equal(processor.transform(df), expected)
+
+    def test_time_range_pushdown(self):
+        df = pl.DataFrame(
+            {
+                "date": pl.datetime_range(
+                    pl.datetime(2022, 1, 1),
+                    pl.datetime(2024, 12, 31),
+                    "1h",
+                    eager=True,
+                )
+            }
+        )
+
+        for time_patterns, keep, expected_time_range in [
+            (
+                ["==2023y==3mo"],
+                True,
+                (datetime.datetime(2023, 3, 1), datetime.datetime(2023, 4, 1)),
+            ),
+            (
+                ["==2023y==2mo>=27d<6h", "==2024y==1mo==31d"],
+                True,
+                (
+                    datetime.datetime(2023, 2, 27),
+                    datetime.datetime(2024, 2, 1),
+                ),
+            ),
+            (
+                ["<2023y", ">=2024y"],
+                False,
+                (datetime.datetime(2023, 1, 1), datetime.datetime(2024, 1, 1)),
+            ),
+            (["==2023y", "<6h"], True, (None, None)),
+            (["==2023y==2mo==30d"], True, None),
+        ]:
+            processor = FilterDataBasedOnTime(
+                time_column="date", time_patterns=time_patterns, keep=keep
+            )
+            assert processor._get_time_range() == expected_time_range
+            expected = processor.transform(df)
+
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "data.parquet")
+                df.write_parquet(path, row_group_size=1_000)
+                transformed = processor.transform(pl.scan_parquet(path))
+                if expected_time_range not in [(None, None), None]:
+                    assert "SELECTION" in transformed.explain()
+                assert_frame_equal(transformed.collect(), expected)
+
+            # -- time zone aware data is compared in local time
+            df_local = df.with_columns(
+                pl.col("date")
+                .dt.replace_time_zone("UTC")
+                .dt.convert_time_zone("Europe/Brussels")
+            )
+            assert_frame_equal(
+                processor.transform(df_local.lazy()).collect(),
+                processor.transform(df_local),
+            )
+
+    def test_time_zone(self):
+        # -- around the daylight saving time changes in Brussels, on
+        # 2023-03-26 at 01:00 UTC and 2023-10-29 at 01:00 UTC
+        df = pl.DataFrame(
+            {
+                "date": pl.concat(
+                    [
+                        pl.datetime_range(
+                            pl.datetime(2023, 3, 24),
+                            pl.datetime(2023, 3, 28),
+                            "7m30s",
+                            eager=True,
+                        ),
+                        pl.datetime_range(
+                            pl.datetime(2023, 10, 27),
+                            pl.datetime(2023, 10, 31),
+                            "7m30s",
+                            eager=True,
+                        ),
+                    ]
+                )
+            }
+        )
+        df_local = df.with_columns(
+            pl.col("date")
+            .dt.replace_time_zone("UTC")
+            .dt.convert_time_zone("Europe/Brussels")
+        )
+
+        for time_patterns, compile_intervals in [
+            (["<6wd>=2h*<3h", "==7wd==2h"], False),
+            (["<6wd>=2h*<3h", "==7wd==2h"], True),
+            ([">1h*<=3h*"], True),
+            (["==2023y==3mo>=26d", "==10mo==29d<3h"], False),
+        ]:
+            for keep in [False, True]:
+                processor = FilterDataBasedOnTime(
+                    time_column="date",
+                    time_patterns=time_patterns,
+                    keep=keep,
+                    compile_intervals=compile_intervals,
+                )
+                expected = processor.transform(df_local)
+                assert expected.height not in [0, df.height]
+
+                processor.set_params(time_zone="Europe/Brussels")
+                # -- naive data is in UTC, aware data in any time zone
+                transformed = processor.transform(df)
+                assert_frame_equal(
+                    transformed.with_columns(
+                        pl.col("date")
+                        .dt.replace_time_zone("UTC")
+                        .dt.convert_time_zone("Europe/Brussels")
+                    ),
+                    expected,
+                )
+                assert_frame_equal(processor.transform(df_local), expected)
+                assert_frame_equal(
+                    processor.transform(df.lazy()).collect(), transformed
+                )
+
+        with self.assertRaises(ValueError):
+            FilterDataBasedOnTime(
+                time_column="date", time_patterns=[">1h"], time_zone="Mars"
+            )
+
+    def test_combine(self):
+        df = pl.DataFrame(
+            {
+                "date": pl.datetime_range(
+                    pl.datetime(2023, 3, 20),
+                    pl.datetime(2023, 3, 30),
+                    "17m",
+                    eager=True,
+                )
+            }
+        )
+        filters = [
+            FilterDataBasedOnTime(
+                time_column="date", time_patterns=["<6wd>=2h*<3h"]
+            ),
+            FilterDataBasedOnTime(
+                time_column="date",
+                time_patterns=[">1h*<=3h*"],
+                keep=True,
+                compile_intervals=True,
+            ),
+            FilterDataBasedOnTime(
+                time_column="date",
+                time_patterns=["==3wd"],
+                time_zone="Europe/Brussels",
+            ),
+        ]
+        expected = [
+            time_filter.set_params(label_data=True)
+            .transform(df)
+            .get_column("_data_to_filter")
+            for time_filter in filters
+        ]
+
+        combined = FilterDataBasedOnTime.combine(
+            filters, names=["a", "b", "c"]
+        )
+        transformed = combined.transform(df)
+        assert transformed.columns == ["date", "a", "b", "c"]
+        for name, labels in zip(["a", "b", "c"], expected):  # noqa: B905
+            assert transformed.get_column(name).to_list() == labels.to_list()
+
+        transformed = (
+            FilterDataBasedOnTime.combine(filters, pack_bits=True)
+            .transform(df.lazy())
+            .collect()
+        )
+        packed = transformed.get_column("_data_to_filter")
+        assert packed.dtype == pl.UInt8
+        for index, labels in enumerate(expected):
+            bit = packed // 2**index % 2 == 1
+            assert bit.to_list() == labels.to_list()
+
+        with self.assertRaises(ValueError):
+            FilterDataBasedOnTime.combine(filters, names=["a", "a", "b"])
+        with self.assertRaises(ValueError):
+            FilterDataBasedOnTime.combine(filters * 22, pack_bits=True)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,4 +1,5 @@
 import datetime
+import tempfile
 import unittest
 from copy import deepcopy
 from functools import partial
@@ -7,7 +8,7 @@ import dateutil
 import polars as pl
 from polars.testing import assert_frame_equal
 
-from mix_n_match.main import ResampleData
+from mix_n_match.main import FilterDataBasedOnTime, ResampleData
 
 DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
@@ -648,6 +649,499 @@ class TestResample(unittest.TestCase):
             == _remove_n_rows(dataframe, 1)["values"].sum()
         )
 
+    def test_resample_with_data_filtration_mask(self):
+        dataframe = _prepare_dataframe(
+            [
+                "2023-01-01 00:00:00",
+                "2023-01-01 06:00:00",
+                "2023-01-01 12:00:00",
+                "2023-01-01 18:00:00",
+                "2023-01-02 00:00:00",
+                "2023-01-02 18:00:00",
+                "2023-01-03 18:00:00",
+            ],
+            "%Y-%m-%d %H:%M:%S",
+        )
+
+        # -- expression masks match the equivalent filter methods
+        mask = FilterDataBasedOnTime(
+            "date", time_patterns=[">=18h"]
+        ).get_expression()
+        for strategy in ["keep", "drop", "null"]:
+            processor = ResampleData(
+                time_column="date",
+                resampling_frequency="1d",
+                resampling_function=["sum", "count"],
+                partial_data_resolution_strategy=strategy,
+                filter_data_method=mask,
+            )
+            transformed = processor.transform(dataframe)
+
+            processor.set_params(filter_data_method=lambda df: df.filter(mask))
+            expected = processor.transform(dataframe)
+
+            assert_frame_equal(transformed, expected[transformed.columns])
+
+        # -- windows where all data is masked are removed
+        assert transformed["date"].dt.day().to_list() == [1, 2]
+
+        # -- user columns named like the mask are resampled, not overwritten
+        dataframe = dataframe.with_columns(
+            pl.col("values").alias("_keep"), pl.col("values").alias("__keep")
+        )
+        processor.set_params(filter_data_method=mask)
+        transformed = processor.transform(dataframe)
+
+        processor.set_params(filter_data_method=lambda df: df.filter(mask))
+        expected = processor.transform(dataframe)
+
+        assert {"_keep_sum", "__keep_sum"} <= set(transformed.columns)
+        assert_frame_equal(transformed, expected[transformed.columns])
+
+    def test_resample_sorted_data(self):
+        dataframe = _prepare_dataframe(
+            [
+                "2023-01-01 00:00:00",
+                "2023-01-01 06:00:00",
+                "2023-01-01 06:00:00",
+                "2023-01-01 12:00:00",
+                "2023-01-01 18:00:00",
+                "2023-01-02 06:00:00",
+            ],
+            "%Y-%m-%d %H:%M:%S",
+        )
+        expected = ResampleData(
+            time_column="date",
+            resampling_frequency="1d",
+            resampling_function="sum",
+            start_window_offset="6h",
+            partial_data_resolution_strategy="null",
+        ).transform(dataframe.reverse())
+
+        # -- sorted flag and assume_sorted give the same outcome as sorting
+        processor = ResampleData(
+            time_column="date",
+            resampling_frequency="1d",
+            resampling_function="sum",
+            start_window_offset="6h",
+            partial_data_resolution_strategy="null",
+        )
+        assert_frame_equal(
+            processor.transform(dataframe.sort("date")), expected
+        )
+
+        processor.set_params(assume_sorted=True)
+        assert_frame_equal(processor.transform(dataframe), expected)
+
+        # -- no sort in the query plan when the data is assumed sorted
+        query_plan = processor.transform(dataframe.lazy()).explain()
+        assert "SORT" not in query_plan
+
+        processor.set_params(assume_sorted=False)
+        query_plan = processor.transform(dataframe.lazy()).explain()
+        assert "SORT" in query_plan
+
+        # -- data sorted by group and then by time
+        dataframe = pl.concat(
+            [
+                dataframe.with_columns(pl.lit(device_id).alias("device_id"))
+                for device_id in [2, 1]
+            ]
+        )
+        processor.set_params(group_by_columns=["device_id"])
+        expected = processor.transform(dataframe)
+
+        processor.set_params(sorted_within_groups=True)
+        assert_frame_equal(processor.transform(dataframe), expected)
+
+        query_plan = processor.transform(dataframe.lazy()).explain()
+        assert "SORT" not in query_plan
+
+    def test_transform_chunks(self):
+        dataframe = _prepare_dataframe(
+            [
+                "2023-01-01 00:00:00",
+                "2023-01-01 06:00:00",
+                "2023-01-01 12:00:00",
+                "2023-01-01 18:00:00",
+                "2023-01-02 00:00:00",
+                "2023-01-02 06:00:00",
+                "2023-01-02 06:00:00",
+                "2023-01-02 18:00:00",
+                "2023-01-03 00:00:00",
+                "2023-01-03 06:00:00",
+                "2023-01-03 12:00:00",
+                "2023-01-03 18:00:00",
+                "2023-01-04 00:00:00",
+            ],
+            "%Y-%m-%d %H:%M:%S",
+        )
+
+        for closed_boundaries in ["left", "right"]:
+            for strategy in ["keep", "drop", "null"]:
+                processor = ResampleData(
+                    time_column="date",
+                    resampling_frequency="1d",
+                    resampling_function=["sum", "max"],
+                    closed_boundaries=closed_boundaries,
+                    start_window_offset="6h",
+                    partial_data_resolution_strategy=strategy,
+                )
+                expected = processor.transform(dataframe)
+
+                # -- chunks split windows (and duplicates) across them
+                for chunk_size in [1, 4, 7, 100]:
+                    chunks = list(dataframe.iter_slices(chunk_size))
+                    transformed = pl.concat(processor.transform_chunks(chunks))
+                    assert_frame_equal(transformed, expected)
+
+                # -- lazy frames are read in slices
+                transformed = pl.concat(
+                    processor.transform_chunks(dataframe.lazy(), chunk_size=3)
+                )
+                assert_frame_equal(transformed, expected)
+
+        # -- finished windows are yielded before the data is exhausted
+        processor = ResampleData(
+            time_column="date",
+            resampling_frequency="1d",
+            resampling_function="sum",
+        )
+
+        def _chunks():
+            yield dataframe.head(6)
+            raise AssertionError("Only the first chunk should be read")
+
+        transformed = next(processor.transform_chunks(_chunks()))
+        assert transformed["values"].to_list() == [
+            dataframe.head(4)["values"].sum()
+        ]
+
+        # -- partial data detected across chunks
+        processor = ResampleData(
+            time_column="date",
+            resampling_frequency="1d",
+            resampling_function="sum",
+            partial_data_resolution_strategy="fail",
+        )
+        with self.assertRaises(ValueError):
+            list(processor.transform_chunks(dataframe.iter_slices(5)))
+
+    def test_resample_with_per_group_frequency(self):
+        start = datetime.datetime(2023, 1, 1)
+        # -- device `a` samples every minute, `b` every 15 minutes. Both miss
+        # a sample in the second hour
+        timestamps = {
+            "a": [
+                start + datetime.timedelta(minutes=minute)
+                for minute in range(120)
+                if minute != 90
+            ],
+            "b": [
+                start + datetime.timedelta(minutes=minute)
+                for minute in range(0, 120, 15)
+                if minute != 90
+            ],
+        }
+        dataframe = pl.concat(
+            [
+                pl.DataFrame(
+                    {
+                        "device_id": device_id,
+                        "date": device_timestamps,
+                        "values": 1,
+                    }
+                )
+                for device_id, device_timestamps in timestamps.items()
+            ]
+        ).sort("date")
+
+        processor = ResampleData(
+            time_column="date",
+            resampling_frequency="1h",
+            resampling_function="sum",
+            group_by_columns=["device_id"],
+            partial_data_resolution_strategy="drop",
+        )
+        expected = pl.DataFrame(
+            {
+                "device_id": ["a", "b"],
+                "date": [start, start],
+                "values": [60, 4],
+            }
+        )
+
+        transformed = processor.transform(dataframe)
+        assert_frame_equal(
+            transformed.select(expected.columns).sort("device_id"),
+            expected,
+            check_dtype=False,
+        )
+
+        transformed = processor.transform(dataframe.lazy()).collect()
+        assert_frame_equal(
+            transformed.select(expected.columns).sort("device_id"),
+            expected,
+            check_dtype=False,
+        )
+
+        transformed = pl.concat(
+            processor.transform_chunks(dataframe.iter_slices(50))
+        )
+        assert_frame_equal(
+            transformed.select(expected.columns).sort("device_id"),
+            expected,
+            check_dtype=False,
+        )
+
+        transformed = processor.update(dataframe)
+        assert_frame_equal(
+            transformed.select(expected.columns).sort("device_id"),
+            expected,
+            check_dtype=False,
+        )
+
+    def test_transform_partitioned(self):
+        dataframe = pl.concat(
+            [
+                _prepare_dataframe(
+                    [
+                        "2023-01-01 00:00:00",
+                        "2023-01-01 06:00:00",
+                        "2023-01-01 12:00:00",
+                        "2023-01-01 18:00:00",
+                        "2023-01-02 06:00:00",
+                    ],
+                    "%Y-%m-%d %H:%M:%S",
+                ).with_columns(pl.lit(device_id).alias("device_id"))
+                for device_id in range(5)
+            ]
+        ).drop("timestamp_string")
+
+        processor = ResampleData(
+            time_column="date",
+            resampling_frequency="1d",
+            resampling_function="sum",
+            group_by_columns=["device_id"],
+            partial_data_resolution_strategy="null",
+        )
+        expected = processor.transform(dataframe).sort(["device_id", "date"])
+
+        reads = []
+        lazy_df = dataframe.lazy().map_batches(
+            lambda df: reads.append(df.height) or df
+        )
+
+        # -- more partitions than groups leaves some partitions empty
+        for number_of_partitions in [1, 2, 8]:
+            transformed = processor.transform_partitioned(
+                dataframe, number_of_partitions
+            )
+            assert_frame_equal(transformed, expected)
+
+            transformed = processor.transform_partitioned(
+                dataframe.lazy(), number_of_partitions
+            )
+            assert_frame_equal(transformed, expected)
+
+            # -- lazy frames are read once, in slices, whatever the number
+            # of partitions
+            reads.clear()
+            transformed = processor.transform_partitioned(
+                lazy_df, number_of_partitions, chunk_size=7
+            )
+            assert_frame_equal(transformed, expected)
+            assert len(reads) == len(range(0, dataframe.height, 7)) + 1
+
+        for X in [dataframe, dataframe.lazy()]:
+            transformed = processor.transform_partitioned(
+                X, 2, use_processes=True, max_workers=2
+            )
+            assert_frame_equal(transformed, expected)
+
+        # -- group by columns are required
+        processor.set_params(group_by_columns=None)
+        with self.assertRaises(ValueError):
+            processor.transform_partitioned(dataframe, 2)
+
+    def test_update(self):
+        dataframe = _prepare_dataframe(
+            [
+                "2023-01-01 00:00:00",
+                "2023-01-01 06:00:00",
+                "2023-01-01 12:00:00",
+                "2023-01-01 18:00:00",
+                "2023-01-02 00:00:00",
+                "2023-01-02 06:00:00",
+                "2023-01-02 06:00:00",
+                "2023-01-02 12:00:00",
+                "2023-01-02 18:00:00",
+                "2023-01-03 00:00:00",
+                "2023-01-03 12:00:00",
+            ],
+            "%Y-%m-%d %H:%M:%S",
+        )
+
+        for labelling_strategy in ["left", "right", "first"]:
+            for strategy in ["keep", "drop", "null"]:
+                processor = ResampleData(
+                    time_column="date",
+                    resampling_frequency="1d",
+                    resampling_function=["sum", "count", "min", "max", "mean"],
+                    target_columns=["values"],
+                    labelling_strategy=labelling_strategy,
+                    partial_data_resolution_strategy=strategy,
+                )
+                expected = processor.transform(dataframe)
+
+                # -- only windows receiving new rows are returned
+                transformed_1 = processor.update(dataframe.head(6))
+                transformed_2 = processor.update(dataframe.slice(6))
+                assert set(
+                    transformed_1["_lower_boundary"].dt.day().to_list()
+                ) <= {1, 2}
+                assert set(
+                    transformed_2["_lower_boundary"].dt.day().to_list()
+                ) <= {2, 3}
+
+                transformed = (
+                    pl.concat([transformed_1, transformed_2])
+                    .unique(
+                        "_lower_boundary", keep="last", maintain_order=True
+                    )
+                    .sort("_lower_boundary")
+                )
+                assert_frame_equal(transformed, expected)
+
+        # -- labels match `transform` when the first row of a window is
+        # masked out, and the state holds no raw timestamps
+        for labelling_strategy in ["left", "first"]:
+            processor = ResampleData(
+                time_column="date",
+                resampling_frequency="1d",
+                resampling_function="sum",
+                target_columns=["values"],
+                labelling_strategy=labelling_strategy,
+                partial_data_resolution_strategy="null",
+                filter_data_method=pl.col("date").dt.hour() != 0,
+            )
+            assert not hasattr(processor, "window_state_")
+            expected = processor.transform(dataframe)
+
+            transformed_1 = processor.update(dataframe.head(6))
+            transformed_2 = processor.update(dataframe.slice(6))
+            transformed = (
+                pl.concat([transformed_1, transformed_2])
+                .unique("_lower_boundary", keep="last", maintain_order=True)
+                .sort("_lower_boundary")
+            )
+            assert_frame_equal(transformed, expected)
+            assert not any(
+                isinstance(dtype, pl.List)
+                for dtype in processor.window_state_.dtypes
+            )
+
+        # -- state can be saved and loaded to resume
+        processor = ResampleData(
+            time_column="date",
+            resampling_frequency="1d",
+            resampling_function="sum",
+            target_columns=["values"],
+            partial_data_resolution_strategy="null",
+        )
+        processor.update(dataframe.head(6))
+
+        with tempfile.TemporaryDirectory() as path:
+            processor.save_state(path)
+
+            resumed_processor = ResampleData(
+                time_column="date",
+                resampling_frequency="1d",
+                resampling_function="sum",
+                target_columns=["values"],
+                partial_data_resolution_strategy="null",
+            )
+            resumed_processor.load_state(path)
+
+        assert_frame_equal(
+            resumed_processor.update(dataframe.slice(6)),
+            processor.update(dataframe.slice(6)),
+        )
+
+        # -- unsupported resampling functions
+        processor = ResampleData(
+            time_column="date",
+            resampling_frequency="1d",
+            resampling_function="collect",
+        )
+        with self.assertRaises(NotImplementedError):
+            processor.update(dataframe)
+
+    def test_resample_lazy(self):
+        dataframe = _prepare_dataframe(
+            [
+                "2023-01-01 00:00:00",
+                "2023-01-01 06:00:00",
+                "2023-01-01 12:00:00",
+                "2023-01-01 18:00:00",
+                "2023-01-02 06:00:00",
+                "2023-01-02 12:00:00",
+            ],
+            "%Y-%m-%d %H:%M:%S",
+        )
+
+        # -- lazy input returns lazy output matching the eager output
+        for strategy in ["keep", "drop", "null"]:
+            processor = ResampleData(
+                time_column="date",
+                resampling_frequency="1d",
+                resampling_function=["sum", "max"],
+                partial_data_resolution_strategy=strategy,
+            )
+
+            transformed = processor.transform(dataframe.lazy())
+
+            assert isinstance(transformed, pl.LazyFrame)
+            assert_frame_equal(
+                transformed.collect(), processor.transform(dataframe)
+            )
+
+        # -- filter method receives a lazy frame
+        def _remove_last_timestamp(df):
+            assert isinstance(df, pl.LazyFrame)
+            return df.filter(pl.col("date") != pl.col("date").max())
+
+        processor = ResampleData(
+            time_column="date",
+            resampling_frequency="1d",
+            resampling_function="sum",
+            partial_data_resolution_strategy="drop",
+            filter_data_method=_remove_last_timestamp,
+        )
+
+        transformed = processor.transform(dataframe.lazy()).collect()
+
+        assert transformed["values"].to_list() == [
+            dataframe.head(4)["values"].sum()
+        ]
+
+        # -- fail strategy raises only once collected
+        processor = ResampleData(
+            time_column="date",
+            resampling_frequency="1d",
+            resampling_function="sum",
+            partial_data_resolution_strategy="fail",
+        )
+
+        transformed = processor.transform(dataframe.lazy())
+
+        with self.assertRaises(pl.ComputeError):
+            transformed.collect()
+
+        # -- even when `_is_partial` is projected away
+        with self.assertRaises(pl.ComputeError):
+            transformed.select("date", "values").collect()
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -1,3 +1,4 @@
+import datetime
 import unittest
 
 import numpy as np
@@ -5,9 +6,14 @@ import polars as pl
 
 from mix_n_match.utils import (
     PolarsDuration,
+    PrefixSumWindows,
+    decompose_duration,
     detect_timeseries_frequency,
     find_contiguous_segments,
     generate_polars_condition,
+    intersect_intervals,
+    is_in_intervals_expression,
+    union_intervals,
 )
 
 
@@ -26,6 +32,56 @@ class TestUtils(unittest.TestCase):
             (25, "s"),
         ]
 
+        # -- numeric form
+        duration = PolarsDuration("1y2mo3d12h")
+        assert (duration.months, duration.nanoseconds) == (14, 3.5 * 86400e9)
+        assert str(duration) == "1y2mo3d12h"
+
+        # -- given form is kept, string form is normalised
+        duration = PolarsDuration("24h")
+        assert duration.duration == "24h"
+        assert duration.decomposed_duration == [(24, "h")]
+        assert str(duration) == "1d"
+        assert PolarsDuration("-90m").decomposed_duration == [(90, "m")]
+        assert (PolarsDuration("1d") * 2).duration == "2d"
+        assert (PolarsDuration("90m") * 2).decomposed_duration == [(3, "h")]
+        assert (PolarsDuration("1d") - "1d1h").duration == "-1h"
+        assert str(PolarsDuration("90m") * 3) == "4h30m"
+        assert str(PolarsDuration("1d") - "1d1h") == "-1h"
+        assert str(PolarsDuration("1w") + PolarsDuration("1ms")) == "7d1ms"
+        assert PolarsDuration("1w") == PolarsDuration("7d")
+        assert PolarsDuration("1d") != "1d"
+        assert PolarsDuration("1d") != "abc"
+        assert {PolarsDuration("1d"): 1}.get(PolarsDuration("24h")) == 1
+        assert str(PolarsDuration("1h") * np.int64(3)) == "3h"
+        assert len({PolarsDuration("1w"), PolarsDuration("7d")}) == 1
+        assert PolarsDuration("1h") < PolarsDuration("61m")
+        assert PolarsDuration("1y") > PolarsDuration("11mo")
+        assert PolarsDuration("1q") >= PolarsDuration("3mo")
+        assert PolarsDuration("1d1us").to_timedelta() == datetime.timedelta(
+            days=1, microseconds=1
+        )
+        assert pl.select(PolarsDuration("2s").to_expression()).item() == (
+            datetime.timedelta(seconds=2)
+        )
+
+        with self.assertRaises(TypeError):
+            duration = PolarsDuration("1mo") < PolarsDuration("31d")
+        with self.assertRaises(ValueError):
+            PolarsDuration("1mo").to_timedelta()
+        with self.assertRaises(ValueError):
+            duration = str(PolarsDuration("1mo") - "1d")
+        with self.assertRaises(ValueError):
+            duration = PolarsDuration("3i")
+
+    def test_decompose_duration(self):
+        assert decompose_duration("2wd12h") == ((2, "wd"), (12, "h"))
+        assert decompose_duration("2wd12h") is decompose_duration("2wd12h")
+
+        for duration in ["", "h", "1", "h1", "1h2"]:
+            with self.assertRaises(ValueError):
+                decompose_duration(duration)
+
     def test_find_contiguous_segments(self):
         # -- test single contiguous segment
         array = np.array([0])
@@ -172,6 +228,14 @@ class TestUtils(unittest.TestCase):
 
         assert frequency == 15 * 60  # 15 mins
 
+        # -- case with sorted data
+        df = df.sort("date")
+        frequency = detect_timeseries_frequency(
+            df, time_column="date", how="max"
+        )
+
+        assert frequency == 15 * 60 * 2  # 30 mins
+
     def test_generate_polars_condition(self):
         left = pl.col("value") > 10
         right = pl.col("value") < 15
@@ -181,6 +245,64 @@ class TestUtils(unittest.TestCase):
 
         assert str(final_expression) == str(right.or_(left))
 
+    def test_intervals(self):
+        first = np.array([[0, 5], [3, 4], [8, 10]])
+        second = np.array([[5, 6], [9, 12], [20, 30]])
+
+        # -- overlapping and adjacent intervals are merged
+        assert union_intervals([first, second]).tolist() == [
+            [0, 6],
+            [8, 12],
+            [20, 30],
+        ]
+        assert intersect_intervals([first, second]).tolist() == [[9, 10]]
+        assert intersect_intervals([first, np.array([[5, 8]])]).size == 0
+
+        values = pl.DataFrame({"value": list(range(32))})
+        is_in = (
+            values.select(
+                is_in_intervals_expression(
+                    pl.col("value"), union_intervals([first, second])
+                )
+            )
+            .to_series()
+            .to_list()
+        )
+        expected = [
+            0 <= value < 6 or 8 <= value < 12 or 20 <= value < 30
+            for value in range(32)
+        ]
+        assert is_in == expected
+
+    def test_PrefixSumWindows(self):
+        keys = np.array([0, 1, 1, 3, 6])
+        values = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+        windows = PrefixSumWindows(
+            keys, np.column_stack([values, values**2])
+        )
+
+        lower = np.array([0, 1, 2, 7, 3])
+        upper = np.array([1, 3, 2, 9, 0])
+        for closed, included in [
+            ("left", lambda key, lo, hi: lo <= key < hi),
+            ("right", lambda key, lo, hi: lo < key <= hi),
+            ("both", lambda key, lo, hi: lo <= key <= hi),
+            ("none", lambda key, lo, hi: lo < key < hi),
+        ]:
+            count, sums = windows.window_sums(lower, upper, closed=closed)
+            for index, (lo, hi) in enumerate(zip(lower, upper)):  # noqa: B905
+                mask = np.array([included(key, lo, hi) for key in keys])
+                assert count[index] == mask.sum()
+                assert sums[index].tolist() == [
+                    values[mask].sum(),
+                    (values[mask] ** 2).sum(),
+                ]
+
+        with self.assertRaises(ValueError):
+            windows.window_sums(lower, upper, closed="neither")
+        with self.assertRaises(ValueError):
+            PrefixSumWindows(keys[::-1], values)
+
 
 if __name__ == "__main__":
     unittest.main()